@@ -0,0 +1,233 @@
+"""远程头像异步抓取：upload_avatar 收到 remote_url 时不在请求线程中下载，而是提交到后台线程池。
+
+- 共享一个 keep-alive 的 requests.Session（连接池大小与线程数一致），失败按指数退避重试
+  （连接错误、读超时、429/5xx；见 AVATAR_FETCH_RETRIES / AVATAR_FETCH_BACKOFF）
+- 并发受限：最多 AVATAR_FETCH_WORKERS 个下载同时进行，排队中的任务超过 AVATAR_FETCH_MAX_PENDING 时拒绝新任务
+- 同一用户同一 URL 的任务在完成前只下载一次（重复提交返回同一个任务）
+- 下载完成后写入内容寻址存储（blobstore.put_bytes），并把已有用户的 users.avatar_url 更新为新 URL、
+  记录来源地址 users.avatar_source_url（不创建用户）；内容与当前头像相同（摘要一致）时不写文件只记录来源，
+  结果记为 unchanged；若期间头像已被其他途径修改（与提交时的值不同）或用户已不存在，不覆盖，记为 superseded
+- 任务只在进程内跟踪（用于去重与统计），不对外提供查询；客户端通过 /api/users/profile 查看头像是否已更新
+线程池与 Session 在首次提交时创建（按进程 ID 判断，兼容 gunicorn 预加载后 fork）。
+
+清理：flask avatars gc 删除 static/avatars 下不再被任何用户引用、且超过宽限期未使用的头像文件，
+建议由 cron 定期执行，例如每天凌晨：
+  0 4 * * * cd /opt/projects/backend && FLASK_APP=wsgi.py flask avatars gc >> avatar_gc.log 2>&1
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import requests
+from flask import current_app
+from flask.cli import AppGroup
+from requests.adapters import HTTPAdapter
+from sqlalchemy import update
+from urllib3.util.retry import Retry
+
+from models import db, User
+from blobstore import CAS_DIR, put_bytes, avatar_root, content_digest, digest_of
+
+logger = logging.getLogger(__name__)
+
+# 仅允许微信头像域名，避免滥用
+ALLOWED_HOSTS = frozenset({'thirdwx.qlogo.cn', 'wx.qlogo.cn'})
+ALLOWED_TYPES = frozenset({'image/jpeg', 'image/png', 'image/jpg'})
+MAX_AVATAR_BYTES = 2 * 1024 * 1024
+
+
+class AvatarFetchError(Exception):
+    """远程头像内容不符合要求（类型、大小）。"""
+
+
+class AvatarQueueFull(Exception):
+    """排队中的抓取任务已达上限。"""
+
+
+class AvatarFetcher:
+    """后台头像抓取器：submit() 立即返回任务，下载、保存与更新用户头像在线程池中完成。"""
+
+    def __init__(self):
+        self._app = None
+        self._pid = None
+        self._pool = None
+        self._session = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._inflight = {}
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'done': 0, 'unchanged': 0,
+                         'superseded': 0, 'failed': 0}
+
+    def init_app(self, app):
+        self._app = app
+        cfg = app.config
+        self.workers = max(1, int(cfg.get('AVATAR_FETCH_WORKERS', 4)))
+        self.max_pending = max(1, int(cfg.get('AVATAR_FETCH_MAX_PENDING', 64)))
+        self.retries = max(0, int(cfg.get('AVATAR_FETCH_RETRIES', 3)))
+        self.backoff = float(cfg.get('AVATAR_FETCH_BACKOFF', 0.5))
+        self.timeout = (float(cfg.get('AVATAR_FETCH_CONNECT_TIMEOUT', 3)), float(cfg.get('AVATAR_FETCH_READ_TIMEOUT', 5)))
+
+    def _make_session(self) -> requests.Session:
+        retry = Retry(total=self.retries, connect=self.retries, read=self.retries, status=self.retries,
+                      backoff_factor=self.backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset({'GET'}), respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=len(ALLOWED_HOSTS), pool_maxsize=self.workers, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _ensure_started(self):
+        # 调用方持有 self._lock
+        if self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='avatar-fetch')
+            self._session = self._make_session()
+            self._pending = 0
+            self._inflight = {}
+            self._pid = os.getpid()
+
+    def submit(self, open_id: str, url: str, url_base: str, previous: str = None) -> dict:
+        """提交抓取任务，返回任务字典（job_id/state/...）。url_base 为头像 URL 前缀（含 /static/avatars/），
+        previous 为提交时用户的 avatar_url，用于避免覆盖期间发生的修改。排队已满时抛 AvatarQueueFull。"""
+        key = (open_id, url)
+        with self._lock:
+            self._ensure_started()
+            job = self._inflight.get(key)
+            if job is not None:
+                self.counters['deduplicated'] += 1
+                return job
+            if self._pending >= self.max_pending:
+                self.counters['rejected'] += 1
+                raise AvatarQueueFull('avatar fetch queue full')
+            job = {'job_id': uuid.uuid4().hex, 'open_id': open_id, 'state': 'pending', 'url': None,
+                   'error': None, 'created_at': time.time()}
+            self._inflight[key] = job
+            self._pending += 1
+            self.counters['submitted'] += 1
+            self._pool.submit(self._run, job, key, url, url_base, previous)
+        return job
+
+    def _download(self, url: str):
+        """下载头像并校验类型与大小，返回 (字节内容, 扩展名)。"""
+        with self._session.get(url, timeout=self.timeout, stream=True) as r:
+            r.raise_for_status()
+            content_type = (r.headers.get('Content-Type') or '').split(';', 1)[0].strip().lower()
+            if content_type not in ALLOWED_TYPES:
+                raise AvatarFetchError(f'unsupported file type: {content_type!r}')
+            body = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                body += chunk
+                if len(body) > MAX_AVATAR_BYTES:
+                    raise AvatarFetchError('file too large')
+        return bytes(body), ('.png' if content_type.endswith('png') else '.jpg')
+
+    def _save_user_avatar(self, open_id: str, avatar_url: str, source_url: str, previous: str) -> bool:
+        """仅当用户存在且头像仍为提交时的值才更新头像与来源地址（不创建用户）。返回是否写入。"""
+        cond = User.avatar_url.is_(None) if previous is None else (User.avatar_url == previous)
+        res = db.session.execute(update(User).where(User.open_id == open_id, cond)
+                                 .values(avatar_url=avatar_url, avatar_source_url=source_url))
+        if not res.rowcount:
+            db.session.rollback()
+            return False
+        db.session.commit()
+        return True
+
+    def _run(self, job, key, url, url_base, previous):
+        t0 = time.perf_counter()
+        try:
+            with self._app.app_context():
+                try:
+                    content, ext = self._download(url)
+                    digest = content_digest(content)
+                    if previous and digest_of(previous) == digest:
+                        # 内容与当前头像相同：不写文件，只记录来源地址，下次同一地址直接跳过下载
+                        job['url'] = previous
+                        saved, state = self._save_user_avatar(job['open_id'], previous, url, previous), 'unchanged'
+                    else:
+                        job['url'] = url_base + put_bytes(avatar_root(self._app), content, ext, digest)
+                        saved, state = self._save_user_avatar(job['open_id'], job['url'], url, previous), 'done'
+                    job['state'] = state if saved else 'superseded'
+                except Exception as e:
+                    db.session.rollback()
+                    job['state'] = 'failed'
+                    job['error'] = str(e)
+                    logger.warning('avatar fetch failed open_id=%r url=%r err=%s', job['open_id'], url, e)
+            logger.info('avatar fetch %s open_id=%r url=%r cost=%.1fms', job['state'], job['open_id'],
+                        job['url'], (time.perf_counter() - t0) * 1000)
+        finally:
+            with self._lock:
+                self.counters[job['state']] += 1
+                self._pending -= 1
+                if self._inflight.get(key) is job:
+                    del self._inflight[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters, pending=self._pending, workers=getattr(self, 'workers', None),
+                    max_pending=getattr(self, 'max_pending', None))
+
+
+avatar_fetcher = AvatarFetcher()
+
+
+def collect_garbage(root, grace_seconds: float = 86400, dry_run: bool = False) -> dict:
+    """删除 root 下未被任何 users.avatar_url 引用、且修改时间早于宽限期的头像文件（含残留临时文件）。
+    宽限期用于保护刚上传、客户端尚未写回 avatar_url 的文件（复用已有文件时 put_bytes 会刷新其修改时间）。"""
+    root = Path(root)
+    marker = '/static/avatars/'
+    t0 = time.perf_counter()
+    referenced = set()
+    for (url,) in db.session.query(User.avatar_url).filter(User.avatar_url.like(f'%{marker}%')).yield_per(5000):
+        referenced.add(url.split(marker, 1)[1].split('?', 1)[0])
+    stats = {'referenced': len(referenced), 'scanned': 0, 'kept_recent': 0, 'removed': 0, 'bytes_freed': 0}
+    cutoff = time.time() - grace_seconds
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = Path(dirpath) / name
+            rel = path.relative_to(root).as_posix()
+            stats['scanned'] += 1
+            if rel in referenced:
+                continue
+            try:
+                st = path.stat()
+                if st.st_mtime > cutoff:
+                    stats['kept_recent'] += 1
+                    continue
+                if not dry_run:
+                    path.unlink()
+            except OSError as e:
+                logger.warning('avatar gc %s failed: %s', rel, e)
+                continue
+            stats['removed'] += 1
+            stats['bytes_freed'] += st.st_size
+    if not dry_run:
+        # 清理空的内容寻址子目录；宽限期内修改过的目录可能正被写入，保留
+        cas_dir = root / CAS_DIR
+        for sub in (cas_dir.iterdir() if cas_dir.is_dir() else ()):
+            try:
+                if sub.is_dir() and sub.stat().st_mtime <= cutoff and not any(sub.iterdir()):
+                    sub.rmdir()
+            except OSError as e:
+                logger.warning('avatar gc rmdir %s failed: %s', sub.name, e)
+    stats['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    logger.info('avatar gc %s', stats)
+    return stats
+
+
+avatars_cli = AppGroup('avatars', help='用户头像文件维护')
+
+
+@avatars_cli.command('gc')
+@click.option('--grace-hours', type=float, default=24, help='最近该小时数内写入或复用过的文件不删除')
+@click.option('--dry-run', is_flag=True, help='只统计，不删除')
+def gc_command(grace_hours, dry_run):
+    """删除不再被任何用户引用的头像文件（被替换的旧头像、迁移后的旧文件名等）。"""
+    stats = collect_garbage(avatar_root(current_app), grace_hours * 3600, dry_run)
+    click.echo(json.dumps(stats, ensure_ascii=False))
@@ -0,0 +1,287 @@
+"""内容寻址文件存储：文件按内容摘要命名，相同内容只存一份，URL 永不变化（可长期缓存）。
+
+布局：<根目录>/cas/<摘要前 2 位>/<摘要>.<扩展名>，摘要为 SHA-256 的前 32 位十六进制（128 bit）。
+- 商品图片根目录为 IMAGE_SAVE_DIR，数据库 image1..image15 保存相对路径 cas/ab/ab12....jpg
+- 用户头像根目录为 static/avatars，头像 URL 为 /static/avatars/cas/ab/ab12....jpg
+写入先落临时文件再原子替换；目标已存在时直接复用（去重）。
+migrate_product_images / migrate_avatars 把已有的任意文件名迁移到内容寻址路径并批量改写数据库引用
+（命令行：flask images migrate-cas）。旧文件不立即删除：商品图片登记到待删除清单，宽限期后由
+flask images prune-retired 连同其派生图一起删除；旧头像由 flask avatars gc 按宽限期清理。
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+
+from sqlalchemy import bindparam, select, update
+
+from models import db, Product, User
+from catalog import bump_catalog_version
+
+logger = logging.getLogger(__name__)
+
+CAS_DIR = 'cas'
+DIGEST_HEX = 32
+WRITE_BATCH = 1000
+_EXT_ALIASES = {'.jpeg': '.jpg', '.jpe': '.jpg'}
+
+
+def avatar_root(app) -> Path:
+    """用户头像存储根目录（对外路径 /static/avatars/）。"""
+    return Path(app.root_path) / 'static' / 'avatars'
+
+
+def normalize_ext(ext: str) -> str:
+    ext = (ext or '').lower()
+    if ext and not ext.startswith('.'):
+        ext = '.' + ext
+    return _EXT_ALIASES.get(ext, ext)
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:DIGEST_HEX]
+
+
+def cas_relpath(digest: str, ext: str) -> str:
+    return f'{CAS_DIR}/{digest[:2]}/{digest}{normalize_ext(ext)}'
+
+
+def is_cas_path(path: str) -> bool:
+    """path 是否已是内容寻址路径（相对路径或 URL 均可）。"""
+    name = (path or '').replace('\\', '/').rsplit('/', 3)
+    if len(name) < 3 or name[-3] != CAS_DIR:
+        return False
+    stem = name[-1].split('.', 1)[0]
+    return len(stem) == DIGEST_HEX and stem.startswith(name[-2]) and all(c in '0123456789abcdef' for c in stem)
+
+
+def digest_of(path: str):
+    """内容寻址路径（相对路径或 URL）中的内容摘要；不是内容寻址路径时返回 None。"""
+    if not is_cas_path(path):
+        return None
+    return path.replace('\\', '/').rsplit('/', 1)[-1].split('.', 1)[0]
+
+
+def _store(root: Path, rel: str, write, touch: bool = False) -> bool:
+    """目标不存在时调用 write(临时路径) 写入并原子替换；返回是否新写入。
+    touch=True 时已存在的文件刷新修改时间，标记为最近使用（头像清理按修改时间保留宽限期）。"""
+    dst = root / rel
+    if dst.exists():
+        if touch:
+            try:
+                os.utime(dst)
+            except OSError:
+                pass
+        return False
+    tmp = dst.with_name(f'{dst.name}.{os.getpid()}.tmp')
+    try:
+        for attempt in (1, 2):
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                write(tmp)
+                os.replace(tmp, dst)
+                break
+            except FileNotFoundError:
+                # 子目录可能在 mkdir 之后被清理任务当作空目录删除，重建后再试一次
+                if attempt == 2:
+                    raise
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return True
+
+
+def put_bytes(root, data: bytes, ext: str, digest: str = None) -> str:
+    """保存字节内容，返回相对 root 的内容寻址路径（内容已存在时不重复写入，只刷新修改时间）。
+    digest 为调用方已算好的 content_digest(data)。"""
+    rel = cas_relpath(digest or content_digest(data), ext)
+    _store(Path(root), rel, lambda tmp: tmp.write_bytes(data), touch=True)
+    return rel
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:DIGEST_HEX]
+
+
+def put_file(root, src: Path, ext: str = None):
+    """把已有文件收入存储（复制，不删除源文件）。返回 (相对路径, 是否新写入)。"""
+    src = Path(src)
+    rel = cas_relpath(file_digest(src), ext if ext is not None else src.suffix)
+
+    def _copy(tmp):
+        # 始终复制而不是硬链接：旧文件名的文件之后仍可能被原地覆盖，共享 inode 会改写内容寻址文件
+        with open(src, 'rb') as fi, open(tmp, 'wb') as fo:
+            for chunk in iter(lambda: fi.read(1 << 20), b''):
+                fo.write(chunk)
+    return rel, _store(Path(root), rel, _copy)
+
+
+def _is_local(path: str) -> bool:
+    lower = (path or '').lower()
+    return bool(path) and not (lower.startswith('http://') or lower.startswith('https://'))
+
+
+def _ingest(root: Path, names, stats) -> dict:
+    """把 root 下的一批相对路径收入存储，返回 {旧路径: 新路径}（缺失文件不出现在结果中）。"""
+    mapping = {}
+    for name in names:
+        src = root / name.replace('\\', '/').lstrip('/')
+        if not src.is_file():
+            stats['missing'] += 1
+            continue
+        rel, created = put_file(root, src)
+        mapping[name] = rel
+        stats['stored' if created else 'deduplicated'] += 1
+        stats['bytes'] += src.stat().st_size if created else 0
+    return mapping
+
+
+def migrate_product_images(image_root, dry_run=False) -> dict:
+    """把商品表引用的本地图片迁移到内容寻址路径，并按主键批量改写 image1..image15（一个事务）。
+    改写的商品 row_version 置为新目录版本号，会出现在变更流中。返回统计与被替换的旧文件列表。"""
+    root = Path(image_root)
+    cols = ['frame_model'] + [f'image{i}' for i in range(1, Product.IMAGE_SLOTS + 1)]
+    table = Product.__table__
+    rows = db.session.connection().execute(select(*[table.c[c] for c in cols])).all()
+    names = {p for r in rows for p in r[1:] if _is_local(p) and not is_cas_path(p)}
+    stats = {'references': len(names), 'stored': 0, 'deduplicated': 0, 'missing': 0, 'bytes': 0}
+    t0 = time.perf_counter()
+    mapping = {} if dry_run else _ingest(root, sorted(names), stats)
+    if dry_run:
+        stats['missing'] = sum(1 for n in names if not (root / n.lstrip('/')).is_file())
+    updates = []
+    for r in rows:
+        new = [mapping.get(p, p) for p in r[1:]]
+        if new != list(r[1:]):
+            updates.append(dict(zip(cols[1:], new), _pk=r[0]))
+    stats['products_updated'] = len(updates)
+    if updates and not dry_run:
+        try:
+            version = bump_catalog_version()
+            stmt = (update(table).where(table.c.frame_model == bindparam('_pk'))
+                    .values({**{c: bindparam(c) for c in cols[1:]}, 'row_version': version}))
+            for k in range(0, len(updates), WRITE_BATCH):
+                db.session.execute(stmt, updates[k:k + WRITE_BATCH])
+            db.session.commit()
+            stats['version'] = version
+        except Exception:
+            db.session.rollback()
+            raise
+    stats['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    stats['replaced_files'] = sorted(mapping)
+    return stats
+
+
+def migrate_avatars(avatar_root, dry_run=False) -> dict:
+    """把 users.avatar_url 指向 /static/avatars/ 下旧文件名的头像迁移到内容寻址路径，并批量改写 URL（保留主机部分）。"""
+    root = Path(avatar_root)
+    marker = '/static/avatars/'
+    users = db.session.query(User.open_id, User.avatar_url).filter(User.avatar_url.like(f'%{marker}%')).all()
+    refs = {}
+    for oid, url in users:
+        name = url.split(marker, 1)[1].split('?', 1)[0]
+        if name and not is_cas_path(name):
+            refs[oid] = (url, name)
+    stats = {'references': len(refs), 'stored': 0, 'deduplicated': 0, 'missing': 0, 'bytes': 0}
+    t0 = time.perf_counter()
+    names = sorted({name for _, name in refs.values()})
+    mapping = {} if dry_run else _ingest(root, names, stats)
+    updates = [{'_pk': oid, 'avatar_url': url.split(marker, 1)[0] + marker + mapping[name]}
+               for oid, (url, name) in refs.items() if name in mapping]
+    stats['users_updated'] = len(updates)
+    if updates and not dry_run:
+        try:
+            stmt = (update(User.__table__).where(User.__table__.c.open_id == bindparam('_pk'))
+                    .values(avatar_url=bindparam('avatar_url')))
+            for k in range(0, len(updates), WRITE_BATCH):
+                db.session.execute(stmt, updates[k:k + WRITE_BATCH])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # 刷新旧文件的修改时间：flask avatars gc 从迁移时起按宽限期保留，之后再删除
+        for name in mapping:
+            try:
+                os.utime(root / name.lstrip('/'))
+            except OSError:
+                pass
+    stats['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    stats['replaced_files'] = sorted(mapping)
+    return stats
+
+
+def retired_list_path(app) -> Path:
+    """迁移后待删除的旧商品图片清单（位于实例目录，不在对外静态目录中）。"""
+    return Path(app.instance_path) / 'cas_retired.json'
+
+
+def _read_retired(list_path: Path) -> dict:
+    try:
+        return json.loads(list_path.read_text('utf-8'))
+    except FileNotFoundError:
+        return {}
+
+
+def _write_retired(list_path: Path, retired: dict):
+    list_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = list_path.with_name(f'{list_path.name}.{os.getpid()}.tmp')
+    tmp.write_text(json.dumps(retired, ensure_ascii=False, indent=0), 'utf-8')
+    os.replace(tmp, list_path)
+
+
+def retire_files(list_path, names) -> int:
+    """把迁移后不再被引用的旧文件登记到待删除清单（记录登记时间，重复登记保留最早时间）。返回新登记数量。"""
+    list_path = Path(list_path)
+    retired = _read_retired(list_path)
+    now = time.time()
+    added = 0
+    for name in names:
+        if not is_cas_path(name) and name not in retired:
+            retired[name] = now
+            added += 1
+    if added:
+        _write_retired(list_path, retired)
+    return added
+
+
+def prune_retired(list_path, root, referenced, grace_seconds: float = 86400, extra_paths=None,
+                  dry_run: bool = False) -> dict:
+    """删除待删除清单中登记超过宽限期的旧文件。referenced 为仍被引用的相对路径集合（重新被引用的文件
+    不删除并移出清单）；extra_paths(旧路径) 返回需一并删除的附属文件（如派生图）相对路径。"""
+    list_path, root = Path(list_path), Path(root)
+    retired = _read_retired(list_path)
+    stats = {'retired': len(retired), 'kept_recent': 0, 'referenced': 0, 'removed': 0, 'bytes_freed': 0}
+    cutoff = time.time() - grace_seconds
+    remaining = {}
+    for name, retired_at in retired.items():
+        if name in referenced:
+            stats['referenced'] += 1
+            continue
+        if retired_at > cutoff:
+            stats['kept_recent'] += 1
+            remaining[name] = retired_at
+            continue
+        for rel in [name] + list(extra_paths(name) if extra_paths else ()):
+            path = root / rel.replace('\\', '/').lstrip('/')
+            try:
+                size = path.stat().st_size
+                if not dry_run:
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning('prune %s failed: %s', rel, e)
+                remaining[name] = retired_at
+                continue
+            stats['removed'] += 1
+            stats['bytes_freed'] += size
+    if not dry_run and remaining != retired:
+        _write_retired(list_path, remaining)
+    stats['remaining'] = len(remaining)
+    return stats
@@ -0,0 +1,90 @@
+"""离线目录包：把目录快照中的全部上架商品编码为紧凑的列式 JSON，供小程序下载后在本地筛选与排序。
+
+格式（format=1）：
+- models: 型号数组，其余各列与之按下标对应
+- numbers: {字段: 数值数组}，缺失为 null，整数值不带小数部分
+- brand / material: {dict: 去重取值, codes: 每个商品在 dict 中的下标}
+- material_tags: 与 material.dict 对应的标签数组（小写归一，按 '+' 拆分），多选材质任一命中即匹配
+- image: 首图路径数组（相对路径需拼接 image_base，http(s) 开头的原样使用），无图为 null
+文件名含内容摘要（catalog-v<版本>-<sha1 前 12 位>.json），内容不变则名称不变，客户端可按名称长期缓存。
+"""
+import gzip
+import json
+import hashlib
+from collections import namedtuple
+
+from catalog import NUMERIC_FIELDS, PLACEHOLDER_TEXTS, _material_tags
+from compression import available_encodings
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+BUNDLE_FORMAT = 1
+BUNDLE_NUMBER_FIELDS = NUMERIC_FIELDS + ('frame_thickness',)
+# 每个目录版本只压缩一次，使用最高压缩级别
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# body 为未压缩 JSON；encoded 为 {编码: 预压缩字节}
+CatalogBundle = namedtuple('CatalogBundle', 'name version sha1 count body encoded')
+
+
+def _number(v):
+    if v is None or v != v:
+        return None
+    f = float(v)
+    return int(f) if f.is_integer() else f
+
+
+def _clean_text(v) -> str:
+    t = (v or '').strip()
+    return '' if t.lower() in PLACEHOLDER_TEXTS else t
+
+
+def _dict_encode(values):
+    """驻留编码：返回 (去重取值列表, 下标数组)。"""
+    index, out, codes = {}, [], []
+    for v in values:
+        code = index.get(v)
+        if code is None:
+            code = index[v] = len(out)
+            out.append(v)
+        codes.append(code)
+    return out, codes
+
+
+def encode_bundle(snap, image_base: str) -> dict:
+    """按快照（catalog.CatalogSnapshot）生成列式目录数据。"""
+    rows = snap.card_rows
+    numbers = {}
+    for f in BUNDLE_NUMBER_FIELDS:
+        col = snap.columns.get(f)
+        numbers[f] = [_number(v) for v in col] if col is not None else [_number(r.get(f)) for r in rows]
+    brands, brand_codes = _dict_encode(_clean_text(r.get('brand')) for r in rows)
+    materials, material_codes = _dict_encode((r.get('frame_material') or '').strip() for r in rows)
+    return {
+        'format': BUNDLE_FORMAT,
+        'version': snap.version,
+        'count': snap.size,
+        'models': list(snap.models),
+        'numbers': numbers,
+        'brand': {'dict': brands, 'codes': brand_codes},
+        'material': {'dict': materials, 'codes': material_codes},
+        'material_tags': [[key for key, _ in _material_tags(m)] for m in materials],
+        'image_base': image_base,
+        'image': [(r.get('images') or [None])[0] for r in rows],
+    }
+
+
+def build_bundle(snap, image_base: str) -> CatalogBundle:
+    """生成目录包并预压缩（gzip；安装 brotli 时另生成 br）。"""
+    data = encode_bundle(snap, image_base)
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    sha1 = hashlib.sha1(body).hexdigest()
+    encoded = {'gzip': gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)}
+    if 'br' in available_encodings():
+        encoded['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    name = f'catalog-v{snap.version}-{sha1[:12]}.json'
+    return CatalogBundle(name, snap.version, sha1, snap.size, body, encoded)
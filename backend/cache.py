@@ -0,0 +1,136 @@
+"""进程内缓存工具。
+
+- TTLCache：线程安全的 LRU + 过期时间缓存，附带命中/未命中计数，供各接口的结果缓存复用。
+- SingleFlight：同一键的并发计算合并为一次，其余调用方等待并共享结果，避免缓存失效瞬间的击穿。
+注意：gunicorn 多 worker 时每个进程各自持有一份缓存，失效依赖 catalog_meta 中的版本号。
+"""
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """容量受限的 LRU 缓存，条目可带过期时间（秒）。ttl 为 None 表示不过期。"""
+
+    def __init__(self, maxsize: int = 1024, ttl=None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=_MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires = (time.monotonic() + ttl) if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def pop_matching(self, pred) -> int:
+        """删除键满足 pred(key) 的全部条目，返回删除数量。"""
+        with self._lock:
+            keys = [k for k in self._data if pred(k)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """按键合并并发计算：首个调用方执行 fn，同键的其余调用方等待其完成并共享返回值（或异常）。
+    等待超过 timeout 秒时不再等待，自行执行 fn（防止慢查询拖住全部请求）。
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+        if not leader:
+            if call.event.wait(self.timeout):
+                with self._lock:
+                    self.shared += 1
+                if call.error is not None:
+                    raise call.error
+                return call.value
+            with self._lock:
+                self.timeouts += 1
+            return fn()
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,697 @@
+"""进程内商品目录引擎。
+
+设计说明：
+- 商品数量级为数千，完整加载到内存的代价很小；以列数组（array('d')）保存七个数值列，
+  品牌/材质等文本列做驻留（intern）编码，过滤结果用 Python 大整数作为位图（bitset）表示，
+  按位与/或即可完成多条件组合，避免每次列表请求都走 MySQL 的 COUNT + 分页两次查询。
+- 试戴近邻搜索（nearest）在同一列数组上做加权暴力扫描：容差先经排序列二分缩小候选，数千商品量级
+  下单次查询为毫秒级，快照随目录版本重建。
+- frame_model 子串检索使用 n-gram（三元组）倒排表：求交得到候选后仅对候选做精确校验。
+- 联想输入（suggest）：型号与品牌各有一份小写有序数组，前缀命中用二分定位，不足时再用 n-gram 补充子串命中。
+- 排序（sort=price,-weight）使用预先计算的下标排列（permutation）及其逆（rank）：无过滤时一页即排列的
+  一个切片，有过滤时仅对命中下标按 rank 排序，不必对每次请求的结果集重新按列比较排序。
+- 过滤条件先被规范化为 FilterCond 元组（build_filter_spec），SQL 路径与内存路径共用同一份语义。
+- 内存引擎不支持的条件（例如含 LIKE 通配符的输入）由 match() 返回 None，调用方回退到 SQL。
+- 目录版本号存放在 catalog_meta 表，按 CATALOG_CHECK_INTERVAL 节流检查，版本变化或超过
+  CATALOG_MAX_AGE（兜底手工 SQL 修改）时整体重建快照；快照不可变，读路径无需加锁。
+- CATALOG_LISTING_ENGINE_ENABLED 只决定商品列表（/api/products、batch）是否走快照；材质、分面、联想、
+  近邻、相似款与目录包只有快照实现，始终使用快照。快照为进程内对象，每个 worker 各持有一份。
+"""
+import re
+import math
+import heapq
+import time
+import threading
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, Product, CatalogMeta
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FIELDS = (
+    'lens_size',
+    'nose_bridge_width',
+    'temple_length',
+    'frame_total_length',
+    'frame_height',
+    'weight',
+    'price',
+)
+# 数值匹配容差：与数据库 FLOAT 存储误差对齐
+RANGE_EPS = 1e-4
+CATALOG_VERSION_KEY = 'catalog_version'
+# 图片清单版本号：image_meta 有写入时递增，进程内清单据此重新加载
+IMAGE_MANIFEST_VERSION_KEY = 'image_manifest_version'
+# 试戴近邻搜索使用的镜架尺寸维度
+FIT_FIELDS = (
+    'lens_size',
+    'nose_bridge_width',
+    'temple_length',
+    'frame_total_length',
+    'frame_height',
+)
+# 型号子串检索所用 n-gram 的最大长度（三元组）
+GRAM_SIZE = 3
+# 可排序字段（sort=price,-weight；'-' 前缀表示降序）
+SORT_FIELDS = ('price', 'weight', 'lens_size', 'frame_model')
+DEFAULT_SORT = (('frame_model', False),)
+
+# 规范化后的单个过滤条件：
+# - contains_ci: 忽略大小写子串匹配（value 已转小写）
+# - brand_or_notes: 品牌或备注模糊匹配
+# - like: 单列模糊匹配
+# - material_any: 材质标签任一命中（value 为标签元组）
+# - range: 数值范围（value 为 (lo, hi)）
+# - invalid: 非法数值，结果恒为空
+# - eq: 文本精确匹配
+FilterCond = namedtuple('FilterCond', ['op', 'field', 'value'])
+
+
+def parse_range_or_number(s: str):
+    """解析数值或范围字符串，支持：
+    - 单值: "42" -> (42.0, 42.0)
+    - 范围: "40-45" / "40 - 45" -> (40.0, 45.0)
+    返回: (lo, hi) 或抛出 ValueError
+    """
+    if s is None:
+        raise ValueError('empty')
+    text = str(s).strip()
+    # 兼容中文破折号、全角连字符
+    text = text.replace('－', '-').replace('—', '-').replace('–', '-')
+    if '-' in text:
+        parts = [p.strip() for p in text.split('-', 1)]
+        if len(parts) != 2 or parts[0] == '' or parts[1] == '':
+            raise ValueError('invalid range')
+        lo = float(parts[0])
+        hi = float(parts[1])
+        if lo > hi:
+            lo, hi = hi, lo
+        return (lo, hi)
+    # 单值
+    v = float(text)
+    return (v, v)
+
+
+def split_material_tags(value: str):
+    """解析为多选标签，分隔符支持逗号/中文逗号/竖线。"""
+    return [p.strip() for p in re.split(r'[，,|]+', value or '') if p and p.strip()]
+
+
+def _cond_for(field: str, value: str):
+    if field == 'frame_model':
+        # 镜架型号：忽略大小写的子串匹配（如搜索 123 可匹配到 s123）
+        return FilterCond('contains_ci', 'frame_model', (value or '').strip().lower())
+    if field == 'other_info':
+        return FilterCond('brand_or_notes', None, value)
+    if field == 'brand_info':
+        return FilterCond('like', 'brand', value)
+    if field == 'frame_material':
+        # 任一命中语义与顺序无关：去重排序，使 "a,b" 与 "b,a" 得到相同条件（结果缓存键依赖于此）
+        tags = sorted(set(split_material_tags(value)))
+        return FilterCond('material_any', 'frame_material', tuple(tags)) if tags else None
+    if field in NUMERIC_FIELDS:
+        try:
+            return FilterCond('range', field, parse_range_or_number(value))
+        except ValueError:
+            return FilterCond('invalid', field, value)
+    return FilterCond('eq', field, value)
+
+
+def build_filter_spec(args, allowed_fields, default_field='frame_model'):
+    """从请求参数构造规范化过滤条件。
+    - 多字段并行过滤：抓取所有白名单字段（AND）
+    - 否则兼容旧的 search_field/search_value 单字段搜索
+    返回: (mode, conds)，mode 为 'multi' / 'single' / None
+    """
+    conds = []
+    for f in allowed_fields:
+        v = args.get(f, type=str)
+        if v is not None and str(v).strip() != '':
+            c = _cond_for(f, str(v).strip())
+            if c is not None:
+                conds.append(c)
+    if conds:
+        return 'multi', tuple(conds)
+    search_field = (args.get('search_field') or '').strip()
+    search_value = (args.get('search_value') or '').strip()
+    if search_value:
+        if not search_field or search_field not in allowed_fields:
+            search_field = default_field
+        c = _cond_for(search_field, search_value)
+        return 'single', ((c,) if c is not None else ())
+    return None, ()
+
+
+class InvalidSort(ValueError):
+    """sort 参数包含 SORT_FIELDS 之外的字段。"""
+
+
+def parse_sort(raw) -> tuple:
+    """解析 sort 参数为 ((字段, 是否降序), ...)，空值返回 DEFAULT_SORT。
+    frame_model 唯一，始终作为最后一个排序键使顺序确定（游标分页依赖于此）；未显式给出时沿用首个排序键的方向，
+    使 ORDER BY 各列方向一致，便于 MySQL 直接（或反向）扫描 (is_active, 列, frame_model) 复合索引。
+    """
+    keys = []
+    seen = set()
+    for part in (raw or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        desc = part.startswith('-')
+        field = part.lstrip('+-').strip()
+        if field not in SORT_FIELDS:
+            raise InvalidSort(f'unsupported sort field: {field}')
+        if field in seen:
+            continue
+        seen.add(field)
+        keys.append((field, desc))
+        if field == 'frame_model':
+            break
+    if not keys:
+        return DEFAULT_SORT
+    if keys[-1][0] != 'frame_model':
+        keys.append(('frame_model', keys[0][1]))
+    return tuple(keys)
+
+
+def sorts_after(values, last, sort) -> bool:
+    """排序键 values 是否按 sort 排在游标键 last 之后（相等返回 False）。"""
+    for v, l, (_, desc) in zip(values, last, sort):
+        if v != l:
+            return v < l if desc else v > l
+    return False
+
+
+def _has_like_wildcard(s: str) -> bool:
+    return any(ch in (s or '') for ch in ('%', '_', '\\'))
+
+
+def _material_tags(material: str):
+    """拆分材质字符串（如 "TR+B钛"）为 (归一键, 原始标签) 序列，去重。"""
+    seen = set()
+    out = []
+    for raw in (material or '').split('+'):
+        label = raw.strip()
+        key = label.lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        out.append((key, label))
+    return out
+
+
+def _build_gram_index(strings):
+    """构造 1..GRAM_SIZE 元组倒排表：gram -> 升序下标数组。
+    型号通常不超过十余字符，全部短子串入表的体积可控，短查询无需再校验。"""
+    postings = {}
+    for i, s in enumerate(strings):
+        seen = set()
+        L = len(s)
+        for size in range(1, GRAM_SIZE + 1):
+            for k in range(L - size + 1):
+                seen.add(s[k:k + size])
+        for gram in seen:
+            postings.setdefault(gram, []).append(i)
+    return {gram: array('i', idx) for gram, idx in postings.items()}
+
+
+# 常见占位文本，按空值处理（与接口输出清洗保持一致）
+PLACEHOLDER_TEXTS = ('none', 'null', 'undefined', 'nan')
+
+
+def compute_facets(rows, buckets):
+    """单次遍历统计分面计数。
+    - rows: 可迭代 (frame_material, brand, {数值字段: 值})
+    - buckets: {数值字段: 升序边界列表}，区间为左闭右开，最后一个区间无上界
+    返回: { total, materials: [{tag, count}], brands: [{brand, count}], buckets: {字段: [{from, to, count}]} }
+    """
+    tag_counts, tag_labels, brand_counts = {}, {}, {}
+    bucket_counts = {f: [0] * len(edges) for f, edges in buckets.items()}
+    total = 0
+    for material, brand, values in rows:
+        total += 1
+        for key, label in _material_tags(material):
+            tag_counts[key] = tag_counts.get(key, 0) + 1
+            tag_labels.setdefault(key, label)
+        b = (brand or '').strip()
+        if b and b.lower() not in PLACEHOLDER_TEXTS:
+            brand_counts[b] = brand_counts.get(b, 0) + 1
+        for f, edges in buckets.items():
+            v = values.get(f)
+            if v is None or v != v:
+                continue
+            pos = bisect_right(edges, v) - 1
+            if pos >= 0:
+                bucket_counts[f][pos] += 1
+    materials = sorted(({'tag': tag_labels[k], 'count': n} for k, n in tag_counts.items()),
+                       key=lambda x: (-x['count'], x['tag']))
+    brands = sorted(({'brand': b, 'count': n} for b, n in brand_counts.items()),
+                    key=lambda x: (-x['count'], x['brand']))
+    out_buckets = {}
+    for f, edges in buckets.items():
+        out_buckets[f] = [{
+            'from': lo,
+            'to': edges[j + 1] if j + 1 < len(edges) else None,
+            'count': bucket_counts[f][j],
+        } for j, lo in enumerate(edges)]
+    return {'total': total, 'materials': materials, 'brands': brands, 'buckets': out_buckets}
+
+
+def _mask_from_indices(indices, n: int) -> int:
+    """将下标序列转换为位图整数（第 i 位代表第 i 个商品）。"""
+    if not n:
+        return 0
+    buf = bytearray(b'0') * n
+    for i in indices:
+        buf[i] = 49  # ord('1')
+    buf.reverse()
+    return int(buf, 2)
+
+
+def mask_to_indices(mask: int):
+    """位图整数 -> 升序下标列表。"""
+    if not mask:
+        return []
+    bits = bin(mask)[:1:-1]
+    out = []
+    i = bits.find('1')
+    while i != -1:
+        out.append(i)
+        i = bits.find('1', i + 1)
+    return out
+
+
+def read_meta_versions(keys):
+    """批量读取 catalog_meta 中的版本号（一次主键 IN 查询），缺失记为 0，按 keys 顺序返回元组。"""
+    try:
+        rows = db.session.query(CatalogMeta.key, CatalogMeta.value).filter(CatalogMeta.key.in_(list(keys))).all()
+        found = {k: int(v) for k, v in rows}
+        return tuple(found.get(k, 0) for k in keys)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning('read meta versions %s failed: %s', list(keys), e)
+        return tuple(0 for _ in keys)
+
+
+def read_catalog_version() -> int:
+    """读取目录版本号；表不存在或无记录时返回 0。"""
+    return read_meta_versions((CATALOG_VERSION_KEY,))[0]
+
+
+def bump_meta_version(key: str) -> None:
+    """版本号 +1（在调用方事务中执行，由调用方提交）。
+    首次递增某个键时并发插入可能冲突：插入放在保存点内，冲突只回滚保存点，随后改为递增对方插入的行。"""
+    stmt = update(CatalogMeta).where(CatalogMeta.key == key).values(value=CatalogMeta.value + 1)
+    if db.session.execute(stmt).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(CatalogMeta(key=key, value=1))
+    except IntegrityError:
+        db.session.execute(stmt)
+
+
+def bump_catalog_version() -> int:
+    """目录版本号 +1（在调用方事务中执行，由调用方提交）。返回新版本号。"""
+    bump_meta_version(CATALOG_VERSION_KEY)
+    return read_catalog_version()
+
+
+def mark_products_changed(frame_models) -> int:
+    """目录版本号 +1，并把这些型号的 row_version 置为新版本号，使其出现在变更流中
+    （在调用方事务中执行，由调用方提交）。返回新版本号。
+    下架请将 is_active 置为 '否' 后调用本函数；物理删除的商品不会出现在变更流中。
+    """
+    version = bump_catalog_version()
+    models = list(dict.fromkeys(frame_models))
+    for i in range(0, len(models), 1000):
+        db.session.execute(
+            update(Product)
+            .where(Product.frame_model.in_(models[i:i + 1000]))
+            .values(row_version=version),
+            execution_options={'synchronize_session': False},
+        )
+    return version
+
+
+class CatalogSnapshot:
+    """某一目录版本下全部上架商品的只读列式快照。"""
+
+    def __init__(self, products, version: int):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.size = n = len(products)
+        self.all_mask = (1 << n) - 1
+        self.models = [p.frame_model for p in products]
+        self.position = {m: i for i, m in enumerate(self.models)}
+        # 预先生成基础字典（图片尚未转为公网 URL），列表接口直接复用
+        self.rows = [p.to_dict() for p in products]
+        # 列表卡片视图（view=card）只带首图
+        self.card_rows = [p.to_dict(max_images=1) for p in products]
+
+        self.columns = {}
+        self._sorted = {}
+        for f in NUMERIC_FIELDS:
+            col = array('d', (float('nan') if getattr(p, f) is None else float(getattr(p, f)) for p in products))
+            self.columns[f] = col
+            # 每列一份升序排列（跳过 NaN），范围查询用二分定位
+            order = sorted((i for i in range(n) if col[i] == col[i]), key=col.__getitem__)
+            self._sorted[f] = (order, [col[i] for i in order])
+
+        # 排序规格 -> (perm, rank)；单字段排序在此预计算，多字段组合首次使用时计算并记入
+        # （只增不改，且组合数受 SORT_FIELDS 限制，读路径仍无需加锁）
+        self._orders = {}
+        for f in SORT_FIELDS:
+            for desc in (False, True):
+                self.ordering(parse_sort(('-' if desc else '') + f))
+
+        # 文本列：驻留编码 + 小写副本用于模糊匹配
+        self.brands = []
+        brand_code = {}
+        self.brand_codes = array('i')
+        for p in products:
+            b = p.brand or ''
+            code = brand_code.get(b)
+            if code is None:
+                code = brand_code[b] = len(self.brands)
+                self.brands.append(b)
+            self.brand_codes.append(code)
+        self._model_lower = [m.lower() for m in self.models]
+        self._model_grams = _build_gram_index(self._model_lower)
+        self._brand_lower = [b.lower() for b in self.brands]
+        self._notes_lower = [(p.notes or '').lower() for p in products]
+
+        # 联想输入：型号小写有序数组（前缀二分）；品牌按小写归并计数，跳过空值与占位文本
+        order = sorted(range(n), key=self._model_lower.__getitem__)
+        self._model_prefix_keys = [self._model_lower[i] for i in order]
+        self._model_prefix_idx = array('i', order)
+        brand_counts = {}
+        for code in self.brand_codes:
+            label = self.brands[code].strip()
+            key = label.lower()
+            if key and key not in PLACEHOLDER_TEXTS:
+                entry = brand_counts.setdefault(key, [label, 0])
+                entry[1] += 1
+        self._brand_prefix_keys = sorted(brand_counts)
+        self._brand_entries = [tuple(brand_counts[k]) for k in self._brand_prefix_keys]
+
+        self.materials = []
+        material_code = {}
+        self.material_codes = array('i')
+        for p in products:
+            m = p.frame_material or ''
+            code = material_code.get(m)
+            if code is None:
+                code = material_code[m] = len(self.materials)
+                self.materials.append(m)
+            self.material_codes.append(code)
+
+        # 材质倒排索引：'+' 分隔的标签（小写归一）-> 商品位图；多选任一命中即位图并集
+        self.tag_masks = {}
+        self.tag_labels = {}
+        postings = {}
+        for i, code in enumerate(self.material_codes):
+            for key, label in _material_tags(self.materials[code]):
+                postings.setdefault(key, []).append(i)
+                self.tag_labels.setdefault(key, label)
+        for key, idx in postings.items():
+            self.tag_masks[key] = _mask_from_indices(idx, n)
+        self.tag_counts = {key: len(idx) for key, idx in postings.items()}
+
+    # --- 单条件求值 ---
+    def _range_mask(self, field, lo, hi) -> int:
+        order, values = self._sorted[field]
+        a = bisect_left(values, lo - RANGE_EPS)
+        b = bisect_right(values, hi + RANGE_EPS)
+        return _mask_from_indices(order[a:b], self.size)
+
+    def _model_contains_indices(self, needle):
+        """型号子串匹配，返回升序下标：短查询（<=3 字符）直接命中 n-gram 倒排表；更长的查询对其全部三元组
+        的倒排表求交得到候选，再逐个做精确子串校验。"""
+        grams = self._model_grams
+        if len(needle) <= GRAM_SIZE:
+            return grams.get(needle, ())
+        postings = []
+        for k in range(len(needle) - GRAM_SIZE + 1):
+            plist = grams.get(needle[k:k + GRAM_SIZE])
+            if not plist:
+                return ()
+            postings.append(plist)
+        postings.sort(key=len)
+        cand = set(postings[0])
+        for plist in postings[1:]:
+            cand.intersection_update(plist)
+            if not cand:
+                return ()
+        lowers = self._model_lower
+        return sorted(i for i in cand if needle in lowers[i])
+
+    def _model_contains_mask(self, needle) -> int:
+        if not needle:
+            return self.all_mask
+        return _mask_from_indices(self._model_contains_indices(needle), self.size)
+
+    def _contains_mask(self, haystacks, needle) -> int:
+        return _mask_from_indices((i for i, s in enumerate(haystacks) if needle in s), self.size)
+
+    def _brand_contains_mask(self, needle) -> int:
+        hit_codes = {c for c, b in enumerate(self._brand_lower) if needle in b}
+        if not hit_codes:
+            return 0
+        codes = self.brand_codes
+        return _mask_from_indices((i for i in range(self.size) if codes[i] in hit_codes), self.size)
+
+    def _material_mask(self, tags) -> int:
+        mask = 0
+        for t in tags:
+            mask |= self.tag_masks.get(t.strip().lower(), 0)
+        return mask
+
+    def suggest(self, q, limit=8):
+        """联想输入：返回 (型号列表, [(品牌, 商品数)])，均为前缀命中在前、子串命中补足。
+        型号组内按型号排序；品牌前缀组按字母序、子串组按商品数降序。"""
+        q = (q or '').strip().lower()
+        if not q or limit <= 0:
+            return [], []
+        models, seen = [], set()
+        keys, idx = self._model_prefix_keys, self._model_prefix_idx
+        j = bisect_left(keys, q)
+        while j < len(keys) and len(models) < limit and keys[j].startswith(q):
+            seen.add(idx[j])
+            models.append(self.models[idx[j]])
+            j += 1
+        if len(models) < limit:
+            for i in self._model_contains_indices(q):
+                if i not in seen:
+                    models.append(self.models[i])
+                    if len(models) >= limit:
+                        break
+
+        brands = []
+        keys = self._brand_prefix_keys
+        a = j = bisect_left(keys, q)
+        while j < len(keys) and len(brands) < limit and keys[j].startswith(q):
+            brands.append(self._brand_entries[j])
+            j += 1
+        if len(brands) < limit:
+            infix = [self._brand_entries[k] for k, key in enumerate(keys)
+                     if q in key and not (a <= k < j)]
+            infix.sort(key=lambda e: (-e[1], e[0]))
+            brands.extend(infix[:limit - len(brands)])
+        return models, brands
+
+    def material_facets(self):
+        """材质标签列表及商品数，按数量降序、标签升序。"""
+        out = [{'tag': self.tag_labels[k], 'count': cnt} for k, cnt in self.tag_counts.items()]
+        out.sort(key=lambda x: (-x['count'], x['tag']))
+        return out
+
+    def _cond_mask(self, c: FilterCond):
+        if c.op == 'range':
+            if c.field not in self.columns:
+                return None
+            lo, hi = c.value
+            return self._range_mask(c.field, lo, hi)
+        if c.op == 'invalid':
+            return 0
+        if c.op == 'material_any':
+            return self._material_mask(c.value)
+        if c.op in ('contains_ci', 'like', 'brand_or_notes'):
+            # SQL LIKE 会把 % 与 _ 当作通配符，此类输入交回数据库保证语义一致
+            if _has_like_wildcard(c.value):
+                return None
+            needle = c.value.lower()
+            if c.op == 'contains_ci' and c.field == 'frame_model':
+                return self._model_contains_mask(needle)
+            if c.op == 'like' and c.field == 'brand':
+                return self._brand_contains_mask(needle)
+            if c.op == 'brand_or_notes':
+                return self._brand_contains_mask(needle) | self._contains_mask(self._notes_lower, needle)
+        return None
+
+    def facet_rows(self, indices, fields):
+        """为 compute_facets 生成 (材质, 品牌, {数值字段: 值}) 行。"""
+        cols = [(f, self.columns[f]) for f in fields if f in self.columns]
+        mats, mcodes = self.materials, self.material_codes
+        brands, bcodes = self.brands, self.brand_codes
+        for i in indices:
+            yield mats[mcodes[i]], brands[bcodes[i]], {f: col[i] for f, col in cols}
+
+    def mask_for_models(self, frame_models) -> int:
+        pos = self.position
+        return _mask_from_indices((pos[m] for m in frame_models if m in pos), self.size)
+
+    def nearest(self, target, weights=None, tolerances=None, k=10, mask=None):
+        """按加权欧氏距离返回最近的 k 个商品：[(distance, index, deltas), ...]。
+        - target: {维度: 目标值}，仅参与给定的维度
+        - weights: {维度: 权重}，缺省为 1
+        - tolerances: {维度: 容差}，|值-目标| 超出容差的商品直接排除（先用排序列二分求位图）
+        - mask: 额外的候选位图（例如其他过滤条件的结果）
+        """
+        weights = weights or {}
+        tolerances = tolerances or {}
+        cand = self.all_mask if mask is None else mask
+        for f, tol in tolerances.items():
+            if f in target:
+                cand &= self._range_mask(f, target[f] - tol, target[f] + tol)
+        if not cand:
+            return []
+        dims = [(self.columns[f], float(target[f]), float(weights.get(f, 1.0)), f) for f in FIT_FIELDS if f in target]
+        if len(dims) == 1:
+            col, t, w, _ = dims[0]
+            def dist2(i):
+                d = col[i] - t
+                return w * d * d
+        else:
+            def dist2(i):
+                acc = 0.0
+                for col, t, w, _ in dims:
+                    d = col[i] - t
+                    acc += w * d * d
+                return acc
+        scored = ((dist2(i), i) for i in mask_to_indices(cand))
+        # NaN 距离（尺寸缺失）排除
+        best = heapq.nsmallest(k, (x for x in scored if x[0] == x[0]))
+        return [(math.sqrt(d2), i, {f: round(col[i] - t, 4) for col, t, _, f in dims}) for d2, i in best]
+
+    def match(self, conds):
+        """对规范化条件求交集，返回位图；存在不支持的条件时返回 None。"""
+        mask = self.all_mask
+        for c in conds:
+            m = self._cond_mask(c)
+            if m is None:
+                return None
+            mask &= m
+            if not mask:
+                break
+        return mask
+
+    def select(self, conds, sort=DEFAULT_SORT):
+        """返回命中商品下标（按 sort 排列，默认 frame_model 升序）；不支持时返回 None。
+        无过滤条件时直接返回预计算的排列本身，调用方只可切片、不可修改。
+        """
+        mask = self.match(conds)
+        if mask is None:
+            return None
+        if sort == DEFAULT_SORT:
+            return mask_to_indices(mask)
+        perm, rank = self.ordering(sort)
+        if mask == self.all_mask:
+            return perm
+        hits = mask_to_indices(mask)
+        hits.sort(key=rank.__getitem__)
+        return hits
+
+    # --- 排序 ---
+    def _sort_value(self, field, i):
+        if field == 'frame_model':
+            return self.models[i]
+        v = self.columns[field][i]
+        # NULL（NaN）视为最小值，与 MySQL 排序一致
+        return v if v == v else float('-inf')
+
+    def sort_key(self, i, sort) -> tuple:
+        """下标 i 在 sort 下的排序键（即游标键）。"""
+        return tuple(self._sort_value(f, i) for f, _ in sort)
+
+    def ordering(self, sort):
+        """返回 (perm, rank)：perm 为按 sort 排列的全部下标，rank[i] 为下标 i 在 perm 中的位置。"""
+        cached = self._orders.get(sort)
+        if cached is not None:
+            return cached
+        # 快照行本身按 frame_model 升序；从最次要的键开始逐轮稳定排序得到多键顺序
+        perm = list(range(self.size))
+        for field, desc in reversed(sort):
+            if field == 'frame_model':
+                perm.sort(reverse=desc)
+            else:
+                perm.sort(key=lambda i, f=field: self._sort_value(f, i), reverse=desc)
+        rank = array('i', [0]) * self.size
+        for pos, i in enumerate(perm):
+            rank[i] = pos
+        self._orders[sort] = (perm, rank)
+        return perm, rank
+
+
+class CatalogEngine:
+    """持有当前目录快照，并按版本号节流刷新。"""
+
+    def __init__(self, check_interval: float = 5.0, max_age: float = 300.0):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, check_interval=None, max_age=None):
+        if check_interval is not None:
+            self.check_interval = float(check_interval)
+        if max_age is not None:
+            self.max_age = float(max_age)
+
+    def invalidate(self):
+        """强制下次访问时重新检查版本并重建。"""
+        self._version = None
+        self._snapshot = None
+
+    def current_version(self) -> int:
+        """当前目录版本号；每 check_interval 秒最多读取一次数据库，其余时间返回进程内缓存值。"""
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.check_interval:
+            self._version = read_catalog_version()
+            self._checked_at = now
+        return self._version
+
+    def _load(self, version: int) -> CatalogSnapshot:
+        t0 = time.perf_counter()
+        products = Product.query.filter_by(is_active='是').all()
+        # 在 Python 侧排序：保证快照顺序与游标比较（字符串大小）一致，不受数据库排序规则影响
+        products.sort(key=lambda p: p.frame_model)
+        snap = CatalogSnapshot(products, version)
+        logger.info('catalog snapshot loaded version=%s products=%s cost=%.1fms',
+                    version, snap.size, (time.perf_counter() - t0) * 1000)
+        return snap
+
+    def _fresh(self, snap, version) -> bool:
+        return snap is not None and snap.version == version and time.monotonic() - snap.loaded_at < self.max_age
+
+    def snapshot(self) -> CatalogSnapshot:
+        version = self.current_version()
+        snap = self._snapshot
+        if self._fresh(snap, version):
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if not self._fresh(snap, version):
+                snap = self._load(version)
+                self._snapshot = snap
+            return snap
+
+
+catalog = CatalogEngine()
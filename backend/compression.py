@@ -0,0 +1,68 @@
+"""JSON 响应压缩。
+
+- choose_encoding：按 Accept-Encoding 选择编码（br 优先，brotli 未安装时仅 gzip）
+- compress：压缩字节串
+- CompressionStats：按接口（endpoint）累计压缩前后字节数与压缩 CPU 耗时，供 /admin/cache_stats 输出
+brotli 为可选依赖（pip install brotli），未安装时自动退化为 gzip。
+"""
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+
+def available_encodings() -> tuple:
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings) -> str:
+    """accept_encodings 为 werkzeug 的 request.accept_encodings；客户端都不接受时返回 None。"""
+    for enc in available_encodings():
+        if accept_encodings[enc]:
+            return enc
+    return None
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0：相同输入得到相同输出，便于按 ETag 缓存
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionStats:
+    """按接口统计压缩效果：次数、缓存命中、原始/压缩后字节数、压缩 CPU 毫秒数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, endpoint: str, encoding: str, raw_size: int, size: int, cpu_ms: float = 0.0, cached: bool = False):
+        with self._lock:
+            e = self._data.get(endpoint)
+            if e is None:
+                e = self._data[endpoint] = {'responses': 0, 'cache_hits': 0, 'bytes_in': 0, 'bytes_out': 0,
+                                            'cpu_ms': 0.0, 'encodings': {}}
+            e['responses'] += 1
+            e['cache_hits'] += 1 if cached else 0
+            e['bytes_in'] += raw_size
+            e['bytes_out'] += size
+            e['cpu_ms'] += cpu_ms
+            e['encodings'][encoding] = e['encodings'].get(encoding, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {}
+            for endpoint, e in self._data.items():
+                compressed = e['responses'] - e['cache_hits']
+                out[endpoint] = dict(
+                    e,
+                    encodings=dict(e['encodings']),
+                    cpu_ms=round(e['cpu_ms'], 3),
+                    ratio=round(e['bytes_out'] / e['bytes_in'], 4) if e['bytes_in'] else None,
+                    avg_cpu_ms=round(e['cpu_ms'] / compressed, 3) if compressed else 0.0,
+                )
+            return out
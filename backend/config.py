@@ -47,6 +47,22 @@ class Config:
     # 图片文件配置
     IMAGE_SAVE_DIR = os.getenv('IMAGE_SAVE_DIR', 'D:/data/eyewear/images')
     IMAGE_URL_PREFIX = os.getenv('IMAGE_URL_PREFIX', '/static/images/')
+    # 商品图片派生图（flask images derive 生成，nginx 直出）：启用后商品输出附带 thumbs {宽度: [URL]}
+    IMAGE_DERIVATIVES_ENABLED = os.getenv('IMAGE_DERIVATIVES_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+    IMAGE_DERIVATIVE_SIZES = [int(x) for x in os.getenv('IMAGE_DERIVATIVE_SIZES', '200,480,1080').split(',') if x.strip()]
+    IMAGE_DERIVATIVE_FORMAT = os.getenv('IMAGE_DERIVATIVE_FORMAT', 'webp')
+    IMAGE_DERIVATIVE_QUALITY = int(os.getenv('IMAGE_DERIVATIVE_QUALITY', '80'))
+    # 派生图在 IMAGE_SAVE_DIR 下的子目录（URL 同样位于 IMAGE_URL_PREFIX 下）
+    IMAGE_DERIVATIVE_DIR = os.getenv('IMAGE_DERIVATIVE_DIR', '_v')
+    # 图片清单（flask images manifest 预计算宽高、字节数与占位图）：启用后商品输出附带 image_meta
+    IMAGE_MANIFEST_ENABLED = os.getenv('IMAGE_MANIFEST_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+    # 远程头像后台抓取（见 avatars.py）：并发线程数、排队上限、重试次数与退避系数（秒）、连接/读取超时（秒）
+    AVATAR_FETCH_WORKERS = int(os.getenv('AVATAR_FETCH_WORKERS', '4'))
+    AVATAR_FETCH_MAX_PENDING = int(os.getenv('AVATAR_FETCH_MAX_PENDING', '64'))
+    AVATAR_FETCH_RETRIES = int(os.getenv('AVATAR_FETCH_RETRIES', '3'))
+    AVATAR_FETCH_BACKOFF = float(os.getenv('AVATAR_FETCH_BACKOFF', '0.5'))
+    AVATAR_FETCH_CONNECT_TIMEOUT = float(os.getenv('AVATAR_FETCH_CONNECT_TIMEOUT', '3'))
+    AVATAR_FETCH_READ_TIMEOUT = float(os.getenv('AVATAR_FETCH_READ_TIMEOUT', '5'))
 
     # 搜索配置
     ALLOWED_SEARCH_FIELDS = [
@@ -64,5 +80,53 @@ class Config:
     ]
     DEFAULT_SEARCH_FIELD = os.getenv('DEFAULT_SEARCH_FIELD', 'frame_model')
 
+    # 商品列表走进程内目录快照：/api/products、/api/products/batch 的过滤在内存快照上完成（数千商品量级），减少数据库往返；
+    # 只控制这两个接口，关闭时走 SQL。材质、分面、联想、近邻、相似款与目录包接口始终使用快照（没有 SQL 实现），不受此开关影响。
+    # 旧变量名 CATALOG_ENGINE_ENABLED 仍可用（新变量未设置时读取）。
+    # 内存：快照按 gunicorn worker 各自加载一份（商品行 + 索引，约 3KB/商品，5000 个商品约 15MB/worker，重建期间短暂翻倍），
+    # 无论此开关是否开启，首次访问上述快照接口时都会加载
+    CATALOG_LISTING_ENGINE_ENABLED = os.getenv(
+        'CATALOG_LISTING_ENGINE_ENABLED', os.getenv('CATALOG_ENGINE_ENABLED', 'false')
+    ).lower() in ('1', 'true', 'yes', 'on')
+    # 目录版本号检查间隔（秒）；版本号变化时重建快照
+    CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL', '5'))
+    # 快照最长存活时间（秒）；兜底手工 SQL 修改商品但未更新版本号的情况。
+    # 也是商品片段缓存、列表结果缓存与目录 ETag 的时间窗口，即手工 SQL 修改的最长可见延迟
+    CATALOG_MAX_AGE = float(os.getenv('CATALOG_MAX_AGE', '300'))
+    # 目录只读接口的 HTTP 缓存时间（秒）；默认 0，即客户端每次都用 ETag 重新验证
+    CATALOG_HTTP_MAX_AGE = int(os.getenv('CATALOG_HTTP_MAX_AGE', '0'))
+    # 列表总数缓存：条目上限与存活时间（秒）；include_total=approx 在存活期内直接复用
+    COUNT_CACHE_SIZE = int(os.getenv('COUNT_CACHE_SIZE', '2048'))
+    COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', '300'))
+    # 推荐/分享列表总数只靠过期失效（写入时仅清理本进程内的对应条目），其他 worker 最多滞后该秒数
+    USER_COUNT_CACHE_TTL = float(os.getenv('USER_COUNT_CACHE_TTL', '30'))
+    # 搜索页分面统计的数值分桶边界（逗号分隔，升序；区间左闭右开，最后一档无上界）
+    FACET_BUCKETS = {
+        'price': [float(x) for x in os.getenv('FACET_PRICE_BUCKETS', '0,200,400,600,800,1000,1500').split(',') if x.strip()],
+        'weight': [float(x) for x in os.getenv('FACET_WEIGHT_BUCKETS', '0,10,15,20,25,30').split(',') if x.strip()],
+        'lens_size': [float(x) for x in os.getenv('FACET_LENS_SIZE_BUCKETS', '0,46,48,50,52,54,56').split(',') if x.strip()],
+    }
+    # 分面结果缓存条目上限
+    FACET_CACHE_SIZE = int(os.getenv('FACET_CACHE_SIZE', '512'))
+    # 预渲染商品 JSON 片段缓存条目上限（LRU）
+    PRODUCT_FRAGMENT_CACHE_SIZE = int(os.getenv('PRODUCT_FRAGMENT_CACHE_SIZE', '4096'))
+    # JSON 响应压缩：超过 COMPRESS_MIN_SIZE 字节时按 Accept-Encoding 压缩（安装 brotli 后优先 br，否则 gzip）
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+    # 目录响应压缩结果缓存条目上限（按 ETag + 编码）
+    COMPRESSED_CACHE_SIZE = int(os.getenv('COMPRESSED_CACHE_SIZE', '256'))
+    # 商品列表结果缓存：键为规范化的过滤/排序/分页/视图参数 + 目录版本号，值为完整响应体；
+    # 存活时间（秒）内复用，目录版本号变化即失效；并发的相同未命中只查询一次（single-flight）。
+    # 目录引擎关闭（SQL 路径）时同样生效：直接用 SQL 修改商品不递增版本号，列表最多滞后 QUERY_CACHE_TTL 秒
+    QUERY_CACHE_ENABLED = os.getenv('QUERY_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+    QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '60'))
+    # 等待同键在途查询的最长时间（秒），超时后自行查询
+    QUERY_SINGLE_FLIGHT_TIMEOUT = float(os.getenv('QUERY_SINGLE_FLIGHT_TIMEOUT', '10'))
+    # 相似镜架推荐：每个型号预计算并保存的相似商品数（flask similar rebuild/refresh）
+    SIMILAR_TOP_K = int(os.getenv('SIMILAR_TOP_K', '12'))
+
     # （已废弃）销售白名单参数：现已改为从数据库 sales 表读取，不再使用该配置。
     SALES_OPENID_WHITELIST = []
\ No newline at end of file
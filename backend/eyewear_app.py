@@ -2,8 +2,13 @@
 import os
 import re
 import json
+import math
+import base64
 import time
+import hashlib
 import logging
+from functools import wraps
+from collections import namedtuple
 from pathlib import Path
 from dotenv import load_dotenv
 import requests
@@ -15,11 +20,23 @@ load_dotenv(dotenv_path=envfile)
 from flask import Flask, jsonify, request, g, has_request_context, render_template, make_response, url_for
 from flask_cors import CORS
 from config import Config
-from models import db, Product, User, PageView, Favorite, Salesperson, SalesShare
-from sqlalchemy import inspect, text, or_, select, func
+from models import db, Product, User, PageView, Favorite, Salesperson, SalesShare, CatalogMeta, ProductSimilar, ImageMeta
+from catalog import (catalog, build_filter_spec, compute_facets, read_meta_versions, read_catalog_version,
+                     parse_sort, sorts_after, InvalidSort,
+                     RANGE_EPS, FIT_FIELDS, CATALOG_VERSION_KEY)
+from cache import TTLCache, SingleFlight
+from compression import CompressionStats, available_encodings, choose_encoding, compress
+from similar import similar_cli
+from bundle import build_bundle
+from importer import catalog_cli
+from blobstore import put_bytes, avatar_root, content_digest, digest_of
+from imagemeta import image_manifest
+from avatars import avatars_cli, avatar_fetcher, AvatarQueueFull, ALLOWED_HOSTS as AVATAR_REMOTE_HOSTS
+from thumbnails import images_cli, derivative_settings, variant_relpath, is_local_image
+from sqlalchemy import inspect, text, and_, or_, select, func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 from werkzeug.middleware.proxy_fix import ProxyFix
-from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -128,6 +145,15 @@ cors_resources = {r"/api/*": {"origins": cors_origins}}
 CORS(app, resources=cors_resources, supports_credentials=False)
 
 db.init_app(app)
+catalog.configure(check_interval=app.config.get('CATALOG_CHECK_INTERVAL'),
+                  max_age=app.config.get('CATALOG_MAX_AGE'))
+# 远程头像后台抓取（线程池在首次提交时按进程创建）
+avatar_fetcher.init_app(app)
+# 命令行：flask similar rebuild | refresh | bench、flask catalog import、flask images derive | manifest | migrate-cas | prune-retired、flask avatars gc（FLASK_APP=wsgi.py）
+app.cli.add_command(similar_cli)
+app.cli.add_command(catalog_cli)
+app.cli.add_command(images_cli)
+app.cli.add_command(avatars_cli)
 
 # 生产环境关键配置校验
 if app.config.get('ENV') == 'production':
@@ -217,6 +243,54 @@ try:
                     logger.warning('Ensure unique index on sales_shares.dedup_key failed or exists: %s', ie)
             except Exception as e:
                 logger.warning('sales_shares column ensure skipped: %s', e)
+        # 轻量自检：users.avatar_source_url（头像来源地址，远程头像去重用），缺失则添加
+        if 'users' in insp.get_table_names() and 'avatar_source_url' not in [c['name'] for c in insp.get_columns('users')]:
+            try:
+                db.session.execute(text('ALTER TABLE users ADD COLUMN avatar_source_url VARCHAR(512) NULL'))
+                db.session.commit()
+                logger.info('Added column users.avatar_source_url via ALTER TABLE')
+            except Exception as ie:
+                db.session.rollback()
+                logger.warning('Ensure users.avatar_source_url failed (may already exist or unsupported): %s', ie)
+        # 轻量自检：products 变更版本号列与排序/变更流复合索引，缺失则创建（失败仅记录日志）
+        if 'products' in insp.get_table_names():
+            if 'row_version' not in [c['name'] for c in insp.get_columns('products')]:
+                try:
+                    db.session.execute(text('ALTER TABLE products ADD COLUMN row_version BIGINT NOT NULL DEFAULT 0'))
+                    db.session.commit()
+                    logger.info('Added column products.row_version via ALTER TABLE')
+                except Exception as ie:
+                    db.session.rollback()
+                    logger.warning('Ensure products.row_version failed (may already exist or unsupported): %s', ie)
+            prod_idx = {i.get('name') for i in insp.get_indexes('products')}
+            for idx in Product.__table__.indexes:
+                if idx.name not in prod_idx:
+                    try:
+                        idx.create(bind=db.engine)
+                        logger.info('Created index %s on products', idx.name)
+                    except Exception as ie:
+                        logger.warning('Ensure index %s failed (may already exist or unsupported): %s', idx.name, ie)
+        # 轻量自检：catalog_meta 表（目录版本号），若不存在则创建
+        if 'catalog_meta' not in insp.get_table_names():
+            try:
+                CatalogMeta.__table__.create(bind=db.engine)
+                logger.info('Created table catalog_meta')
+            except Exception as e:
+                logger.warning('Create catalog_meta failed (may already exist or unsupported): %s', e)
+        # 轻量自检：product_similar 表（相似镜架预计算结果），若不存在则创建
+        if 'product_similar' not in insp.get_table_names():
+            try:
+                ProductSimilar.__table__.create(bind=db.engine)
+                logger.info('Created table product_similar')
+            except Exception as e:
+                logger.warning('Create product_similar failed (may already exist or unsupported): %s', e)
+        # 轻量自检：image_meta 表（商品图片清单），若不存在则创建
+        if 'image_meta' not in insp.get_table_names():
+            try:
+                ImageMeta.__table__.create(bind=db.engine)
+                logger.info('Created table image_meta')
+            except Exception as e:
+                logger.warning('Create image_meta failed (may already exist or unsupported): %s', e)
 except Exception as e:
     logger.warning('Startup column check skipped: %s', e)
 
@@ -258,13 +332,21 @@ def set_security_headers(resp):
     resp.headers['Referrer-Policy'] = 'no-referrer'
     # 仅 API 响应；CSP 对纯 API 影响有限，但可作为保守默认
     resp.headers.setdefault('Content-Security-Policy', "default-src 'none'; img-src 'self' data:; connect-src 'self'")
-    # API 禁止缓存，确保客户端总是拿到最新数据
+    # API 默认禁止缓存，确保客户端总是拿到最新数据；
+    # 目录只读接口（conditional_get）带 ETag，允许客户端缓存并用 If-None-Match 重新验证
     try:
         p = (request.path or '')
         if p.startswith('/api/'):
-            resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-            resp.headers['Pragma'] = 'no-cache'
-            resp.headers['Expires'] = '0'
+            if getattr(g, '_cache_policy', None) == 'catalog':
+                max_age = int(app.config.get('CATALOG_HTTP_MAX_AGE', 0) or 0)
+                resp.headers['Cache-Control'] = f'public, max-age={max_age}, must-revalidate'
+            elif getattr(g, '_cache_policy', None) == 'immutable':
+                # 文件名含内容摘要的资源（如离线目录包），内容永不变化
+                resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            else:
+                resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+                resp.headers['Pragma'] = 'no-cache'
+                resp.headers['Expires'] = '0'
     except Exception:
         pass
     # HSTS：仅在启用 HTTPS 或强制 HTTPS 时设置
@@ -272,9 +354,257 @@ def set_security_headers(resp):
         resp.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains; preload'
     return resp
 
-def paginate_query(query, page, per_page):
-    """通用分页函数"""
-    return query.paginate(page=page, per_page=per_page, error_out=False)
+def paginate_query(query, page, per_page, count=None):
+    """通用分页函数
+    count: 可选的计数函数 fn(query) -> int|None（见 make_counter），用于复用缓存总数或跳过 COUNT；
+    缺省时沿用 Flask-SQLAlchemy 的 paginate（每页一次 COUNT）。
+    """
+    if count is None:
+        return query.paginate(page=page, per_page=per_page, error_out=False)
+    if page is None or page < 1:
+        page = 1
+    if per_page is None or per_page < 0:
+        per_page = 20
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if page == 1 and len(items) < per_page:
+        # 与 paginate 一致：首页未满时总数即为本页条数，无需 COUNT
+        total = len(items)
+    else:
+        total = count(query)
+    return ListPage(items, total, page, per_page)
+
+class ListPage:
+    """内存列表分页结果，字段与 Flask-SQLAlchemy Pagination 保持一致（items/total/pages/page）。
+    total 为 None 表示调用方选择不计数（include_total=none），此时 pages 也为 None。
+    """
+
+    def __init__(self, items, total, page, per_page):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+        if total is None:
+            self.pages = None
+        else:
+            self.pages = int(math.ceil(total / float(per_page))) if per_page else 0
+
+# === 列表总数缓存 ===
+# 键为 (接口, 规范化过滤条件)；值附带写入时的版本号元组（如 catalog_version），
+# include_total=exact 时版本号一致才复用（一次主键查询代替 COUNT），approx 时在 TTL 内直接复用。
+# 推荐/分享列表不依赖全局版本号（避免所有写入争用同一行），按用户/销售分键，靠短 TTL 与本进程写入时清理失效。
+# 已注册的进程内缓存（名称 -> TTLCache），供 /admin/cache_stats 输出命中统计
+CACHE_REGISTRY = {}
+
+count_cache = TTLCache(maxsize=app.config.get('COUNT_CACHE_SIZE', 2048), ttl=app.config.get('COUNT_CACHE_TTL', 300))
+CACHE_REGISTRY['counts'] = count_cache
+
+USER_COUNT_TTL = app.config.get('USER_COUNT_CACHE_TTL', 30)
+
+def _evict_favorite_counts(open_id):
+    """推荐写入后清理本进程内该用户的推荐列表总数缓存。"""
+    count_cache.pop_matching(lambda k: k[0] == 'favorites' and k[1] == open_id)
+
+def _evict_share_counts(salesperson_open_id):
+    """分享写入后清理本进程内该销售（以及不限销售）的分享列表总数缓存，含按客户过滤的键。
+    键为 ('shares', 销售 open_id, 客户 open_id)，未过滤的一项为 ''（见 list_shares）。"""
+    count_cache.pop_matching(lambda k: k[0] == 'shares' and k[1] in (salesperson_open_id or '', ''))
+
+def _total_mode(default='exact') -> str:
+    """解析 include_total：exact / approx / none；兼容 1/true（=exact）与 0/false（=none）。"""
+    v = (request.args.get('include_total') or '').strip().lower()
+    if v in ('exact', 'approx', 'none'):
+        return v
+    if v in ('1', 'true', 'yes', 'on'):
+        return 'exact'
+    if v in ('0', 'false', 'no', 'off'):
+        return 'none'
+    return default
+
+def _fast_count(query) -> int:
+    """直接对查询主实体做 COUNT(*)，不经 Query.count() 的派生表（否则子查询会列出全部列，包括大 TEXT 列）。
+    仅适用于单表 + WHERE 条件的列表查询（无 JOIN/GROUP BY）。
+    """
+    entity = query.column_descriptions[0]['entity']
+    stmt = select(func.count()).select_from(entity)
+    if query.whereclause is not None:
+        stmt = stmt.where(query.whereclause)
+    return db.session.execute(stmt).scalar() or 0
+
+def make_counter(mode, key, version_keys=(), ttl=None):
+    """构造分页用计数函数 fn(query) -> int|None。
+    - none: 不计数
+    - approx: 优先使用缓存值（不检查版本号），无缓存时按 exact 处理
+    - exact: 缓存值的版本号与当前一致时复用，否则 COUNT 并写回缓存
+    version_keys 为空时只靠过期失效；ttl 覆盖缓存默认过期时间。
+    """
+    if mode == 'none':
+        return lambda query: None
+
+    def _count(query):
+        if mode == 'approx':
+            hit = count_cache.get(key)
+            if hit is not None:
+                return hit[1]
+        versions = read_meta_versions(version_keys) if version_keys else ()
+        hit = count_cache.get(key)
+        if hit is not None and hit[0] == versions:
+            return hit[1]
+        total = _fast_count(query)
+        if ttl is None:
+            count_cache.set(key, (versions, total))
+        else:
+            count_cache.set(key, (versions, total), ttl=ttl)
+        return total
+    return _count
+
+def paginate_list(seq, page, per_page):
+    """对内存序列分页，边界处理与 paginate(error_out=False) 一致。"""
+    if page is None or page < 1:
+        page = 1
+    if per_page is None or per_page < 0:
+        per_page = 20
+    start = (page - 1) * per_page
+    return ListPage(list(seq[start:start + per_page]), len(seq), page, per_page)
+
+# === 游标（keyset）分页 ===
+# 列表接口传入 cursor 参数即启用：首页传空串 cursor=，后续传上一页返回的 next_cursor。
+# 按确定的键排序并以 "键 > 上一页最后一个键" 取下一页，避免深分页 OFFSET 扫描；
+# 默认不做 COUNT，需总数时额外传 include_total=exact|approx。
+
+class CursorPage:
+    """游标分页结果：items 为当前页，next_cursor 为 None 表示已到末尾。"""
+
+    def __init__(self, items, next_cursor, per_page, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+        self.total = total
+
+    def to_payload(self, items=None):
+        data = {
+            'items': self.items if items is None else items,
+            'next_cursor': self.next_cursor,
+            'has_more': self.next_cursor is not None,
+            'per_page': self.per_page,
+        }
+        if self.total is not None:
+            data['total'] = self.total
+        return data
+
+class InvalidCursor(ValueError):
+    """客户端传入的游标无法解析。"""
+
+def _encode_cursor(key) -> str:
+    raw = json.dumps([key], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(token: str):
+    """解析游标；空串表示第一页返回 None，格式非法抛 InvalidCursor。"""
+    token = (token or '').strip()
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise InvalidCursor('invalid cursor')
+    if not isinstance(data, list) or len(data) != 1:
+        raise InvalidCursor('invalid cursor')
+    key = data[0]
+    # 多列排序时游标键为值列表
+    parts = key if isinstance(key, list) and key else [key]
+    if not all(isinstance(v, (str, int, float)) for v in parts):
+        raise InvalidCursor('invalid cursor')
+    return key
+
+def _decode_sort_cursor(token: str, sort):
+    """按排序规格解析游标为键元组：单键时游标为标量（与旧游标兼容），多键时为等长值列表；
+    frame_model 须为字符串、数值列须为数字，否则抛 InvalidCursor。"""
+    last = _decode_cursor(token)
+    if last is None:
+        return None
+    last = last if isinstance(last, list) else [last]
+    if len(last) != len(sort):
+        raise InvalidCursor('invalid cursor')
+    for v, (field, _) in zip(last, sort):
+        if isinstance(v, str) != (field == 'frame_model'):
+            raise InvalidCursor('invalid cursor')
+    return tuple(last)
+
+def _encode_sort_cursor(values) -> str:
+    return _encode_cursor(values[0] if len(values) == 1 else list(values))
+
+def _cursor_requested() -> bool:
+    return 'cursor' in request.args
+
+def _cursor_per_page(per_page):
+    return 20 if per_page is None or per_page <= 0 else per_page
+
+def keyset_paginate(query, key_col, cursor, per_page, desc=False, count=None):
+    """对查询做游标分页。key_col 必须唯一且非空（如主键）；count 同 paginate_query，缺省不计数。"""
+    per_page = _cursor_per_page(per_page)
+    last = _decode_cursor(cursor)
+    if isinstance(last, list):
+        raise InvalidCursor('invalid cursor')
+    total = count(query) if count is not None else None
+    if last is not None:
+        query = query.filter(key_col < last if desc else key_col > last)
+    query = query.order_by(key_col.desc() if desc else key_col.asc())
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = _encode_cursor(getattr(rows[-1], key_col.key))
+    return CursorPage(rows, next_cursor, per_page, total)
+
+def _keyset_after(order, last):
+    """(c1, c2, ...) 按 order 排在 last 之后：c1 > v1 OR (c1 = v1 AND c2 > v2) ...（降序列用 <）。
+    FLOAT 列按 RANGE_EPS 容差比较，避免单精度存储误差导致同值记录被跳过。"""
+    clauses, ties = [], []
+    for (col, desc), v in zip(order, last):
+        if isinstance(col.type, db.Float):
+            clauses.append(and_(*ties, col < v - RANGE_EPS if desc else col > v + RANGE_EPS))
+            ties.append(col.between(v - RANGE_EPS, v + RANGE_EPS))
+        else:
+            clauses.append(and_(*ties, col < v if desc else col > v))
+            ties.append(col == v)
+    return or_(*clauses)
+
+def keyset_paginate_sorted(query, sort, cursor, per_page, count=None):
+    """按排序规格（catalog.parse_sort 结果，末键为唯一的 frame_model）对商品查询做游标分页。"""
+    per_page = _cursor_per_page(per_page)
+    last = _decode_sort_cursor(cursor, sort)
+    order = [(getattr(Product, f), desc) for f, desc in sort]
+    total = count(query) if count is not None else None
+    if last is not None:
+        query = query.filter(_keyset_after(order, last))
+    query = query.order_by(*[col.desc() if desc else col.asc() for col, desc in order])
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = _encode_sort_cursor([getattr(rows[-1], f) for f, _ in sort])
+    return CursorPage(rows, next_cursor, per_page, total)
+
+def keyset_paginate_list(seq, sort, key, cursor, per_page, with_total=False):
+    """对已按 sort 排列的内存序列做游标分页；key(item) 返回 item 的排序键元组。"""
+    per_page = _cursor_per_page(per_page)
+    last = _decode_sort_cursor(cursor, sort)
+    start = 0
+    if last is not None:
+        # 二分定位第一个排在游标键之后的位置
+        hi = len(seq)
+        while start < hi:
+            mid = (start + hi) // 2
+            if sorts_after(key(seq[mid]), last, sort):
+                hi = mid
+            else:
+                start = mid + 1
+    items = list(seq[start:start + per_page])
+    next_cursor = None
+    if start + per_page < len(seq):
+        next_cursor = _encode_sort_cursor(key(seq[start + per_page - 1]))
+    return CursorPage(items, next_cursor, per_page, len(seq) if with_total else None)
 
 def handle_error(e, message="An error occurred"):
     """通用错误处理函数"""
@@ -291,30 +621,45 @@ def _avatar_public_url(filename: str) -> str:
     base = request.host_url.rstrip('/')
     return f"{base}/static/avatars/{filename}"
 
-def _build_public_image_url(path: str) -> str:
+def _image_url_base() -> str:
+    """图片公网 URL 的公共前缀（以 '/' 结尾），每个请求只计算一次并缓存在 g 上。
+    - 若 IMAGE_URL_PREFIX 以 http(s) 开头，直接使用该前缀；
+    - 否则使用当前请求的 host_url + 相对前缀。
+    """
+    base = getattr(g, '_image_url_base', None)
+    if base is not None:
+        return base
+    prefix = app.config.get('IMAGE_URL_PREFIX', '/static/images/') or '/static/images/'
+    # 统一去除/添加，避免重复斜杠
+    if prefix.lower().startswith('http://') or prefix.lower().startswith('https://'):
+        base = prefix.rstrip('/') + '/'
+    else:
+        # 相对前缀，基于当前请求构造绝对 URL
+        base = request.host_url.rstrip('/') + '/' + prefix.strip('/') + '/'
+    g._image_url_base = base
+    return base
+
+def _build_public_image_url(path: str, base: str = None) -> str:
     """将数据库中的图片相对路径/文件名转换为可被前端直接访问的完整 URL。
     规则：
     - 若 path 已是 http(s) 开头，原样返回；
-    - 若 IMAGE_URL_PREFIX 以 http(s) 开头，返回 prefix + path；
-    - 否则使用当前请求的 host_url + 相对前缀 组合为绝对 URL。
+    - 否则拼接 _image_url_base()（可由调用方预先传入 base，避免逐条计算）。
     """
     if not path:
         return path
     lower = path.lower()
     if lower.startswith('http://') or lower.startswith('https://'):
         return path
+    return (base or _image_url_base()) + path.lstrip('/')
 
-    prefix = app.config.get('IMAGE_URL_PREFIX', '/static/images/') or '/static/images/'
-    # 统一去除/添加，避免重复斜杠
-    if prefix.lower().startswith('http://') or prefix.lower().startswith('https://'):
-        return prefix.rstrip('/') + '/' + path.lstrip('/')
-    # 相对前缀，基于当前请求构造绝对 URL
-    base = request.host_url.rstrip('/')
-    rel = '/' + prefix.strip('/') + '/' + path.lstrip('/')
-    return base + rel
+# 派生图参数（见 thumbnails.py）；未启用时为 None，商品输出不带 thumbs
+IMAGE_DERIVATIVES = derivative_settings(app.config) if app.config.get('IMAGE_DERIVATIVES_ENABLED') else None
+# 图片清单（见 imagemeta.py）：启用时商品输出附带与 images 对应的 image_meta
+IMAGE_MANIFEST_ENABLED = bool(app.config.get('IMAGE_MANIFEST_ENABLED'))
 
-def _serialize_product_with_public_images(product: Product) -> dict:
-    d = product.to_dict()
+def _publicize_product_dict(base: dict) -> dict:
+    """基于 Product.to_dict() 结果生成对外输出（不修改入参，便于目录快照复用）。"""
+    d = dict(base)
     # 清洗后端常见占位字符串（例如 'None', 'null' 等）为实际空值，避免前端展示奇怪文本
     def _clean_text(x):
         if isinstance(x, str):
@@ -327,10 +672,145 @@ def _serialize_product_with_public_images(product: Product) -> dict:
         d['brand'] = _clean_text(d.get('brand'))
     if 'notes' in d:
         d['notes'] = _clean_text(d.get('notes'))
-    imgs = d.get('images', []) or []
-    d['images'] = [_build_public_image_url(p) for p in imgs]
+    if 'images' in d:
+        url_base = _image_url_base()
+        raw = d['images'] or []
+        d['images'] = [_build_public_image_url(p, url_base) for p in raw]
+        if IMAGE_DERIVATIVES is not None:
+            # 与 images 一一对应的各宽度派生图 URL；外链图片没有派生图，沿用原图
+            d['thumbs'] = {
+                str(w): [url_base + variant_relpath(p, w, IMAGE_DERIVATIVES['fmt'], IMAGE_DERIVATIVES['root'])
+                         if is_local_image(p) else p for p in raw]
+                for w in IMAGE_DERIVATIVES['sizes']
+            }
+        if IMAGE_MANIFEST_ENABLED:
+            # 宽高/字节数/占位图，只查进程内清单；清单随目录版本刷新，与片段缓存键一致
+            entries = image_manifest.entries(_fragment_scope()[0])
+            d['image_meta'] = [entries.get(p) for p in raw]
     return d
 
+# === 预渲染商品 JSON 片段缓存 ===
+# 键为 (frame_model, 目录版本号, 时间窗口, 图片 URL 前缀)，值为可直接拼接输出的 JSON 文本；
+# 列表接口按片段拼接响应体，命中时跳过 to_dict、文本清洗、URL 拼接与 JSON 编码。
+# 导入、图片迁移等写入会递增目录版本号，各进程在 CATALOG_CHECK_INTERVAL 秒内发现后旧片段不再命中；
+# 直接用 SQL 修改数据库不会递增版本号，此时旧片段最多沿用到当前时间窗口（CATALOG_MAX_AGE 秒）结束，
+# 与目录快照、ETag 的滞后上限相同。
+product_fragment_cache = TTLCache(maxsize=app.config.get('PRODUCT_FRAGMENT_CACHE_SIZE', 4096))
+CACHE_REGISTRY['product_fragments'] = product_fragment_cache
+# 商品输出视图：fields 为输出字段元组（None 表示全部），max_images 为最多读取的图片列数；
+# 同时决定 SELECT 列（_product_query）与序列化结果（Product.to_dict），也是片段缓存键的一部分。
+ProductView = namedtuple('ProductView', 'fields max_images')
+FULL_VIEW = ProductView(None, Product.IMAGE_SLOTS)
+
+class InvalidFields(ValueError):
+    """fields 参数包含白名单（Product.PUBLIC_FIELDS）之外的字段。"""
+
+def _product_view() -> ProductView:
+    """解析请求的输出视图：
+    - view=card 只加载并返回首图（image2..image15 不查询），默认 full
+    - fields=a,b,c 稀疏字段集，仅查询并输出这些字段（frame_model 始终返回），非法字段抛 InvalidFields
+    """
+    max_images = 1 if (request.args.get('view') or '').strip().lower() == 'card' else Product.IMAGE_SLOTS
+    raw = (request.args.get('fields') or '').strip()
+    if not raw:
+        return ProductView(None, max_images)
+    wanted = {f.strip() for f in raw.split(',') if f.strip()}
+    unknown = wanted.difference(Product.PUBLIC_FIELDS)
+    if unknown:
+        raise InvalidFields('unknown fields: ' + ','.join(sorted(unknown)))
+    # 按白名单顺序规范化，保证同一字段集的缓存键一致
+    return ProductView(tuple(f for f in Product.PUBLIC_FIELDS if f in wanted), max_images)
+
+def _invalid_fields_response(e):
+    return jsonify({'status': 'error', 'message': str(e), 'allowed_fields': list(Product.PUBLIC_FIELDS)}), 400
+
+def _product_query(view: ProductView = FULL_VIEW, extra_columns=()):
+    """按视图构造商品查询；非 full 视图通过 load_only 只选取 Product.load_columns 所需的列
+    （extra_columns 为额外需要读取的列，如游标分页的排序列）。"""
+    if view == FULL_VIEW:
+        return Product.query
+    cols = Product.load_columns(view.fields, view.max_images)
+    cols += tuple(c for c in extra_columns if c not in cols)
+    return Product.query.options(load_only(*[getattr(Product, c) for c in cols]))
+
+def _project_product_dict(d: dict, view: ProductView) -> dict:
+    """从目录快照的 to_dict 结果中取出视图字段（图片张数由调用方选用的快照行决定）。"""
+    if view.fields is None:
+        return d
+    return {k: d[k] for k in ('frame_model',) + view.fields}
+
+# 响应体中待替换为预渲染片段的占位值
+_FRAGMENT_MARKER = '\x00fragment\x00'
+
+def _dump_json(obj) -> str:
+    # 与 jsonify 输出格式一致（JSON_AS_ASCII=False、键排序、紧凑分隔符）
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+def _fragment_scope() -> tuple:
+    """片段缓存键中与具体商品无关的部分，每个请求计算一次。"""
+    scope = getattr(g, '_fragment_scope', None)
+    if scope is None:
+        max_age = app.config.get('CATALOG_MAX_AGE') or 300
+        scope = (catalog.current_version(), int(time.time() // max_age), _image_url_base())
+        g._fragment_scope = scope
+    return scope
+
+def _product_fragment(src, view: ProductView = FULL_VIEW) -> str:
+    """返回单个商品的对外 JSON 文本。src 为 Product 或 Product.to_dict() 结果；view 见 _product_view。"""
+    is_dict = isinstance(src, dict)
+    key = (src['frame_model'] if is_dict else src.frame_model, view) + _fragment_scope()
+    frag = product_fragment_cache.get(key)
+    if frag is None:
+        if is_dict:
+            src = _project_product_dict(src, view)
+        else:
+            src = src.to_dict(max_images=view.max_images, fields=view.fields)
+        frag = _dump_json(_publicize_product_dict(src))
+        product_fragment_cache.set(key, frag)
+    return frag
+
+def _fragment_list(fragments) -> str:
+    return '[' + ','.join(fragments) + ']'
+
+def _render_with_fragment(payload, fragment: str) -> str:
+    """渲染 payload 为 JSON 文本，其中值为 _FRAGMENT_MARKER 的位置替换为预渲染 JSON 文本（商品或商品列表）。"""
+    return _dump_json(payload).replace(_dump_json(_FRAGMENT_MARKER), fragment, 1) + '\n'
+
+def _json_body_response(body: str, status: int = 200):
+    return app.response_class(body, status=status, mimetype=app.config.get('JSONIFY_MIMETYPE', 'application/json'))
+
+def _json_with_fragment(payload, fragment: str, status: int = 200):
+    return _json_body_response(_render_with_fragment(payload, fragment), status)
+
+# === 商品列表结果缓存 ===
+# 键为规范化后的请求（过滤条件、排序、视图、分页、计数方式）+ _fragment_scope()（目录版本号、时间窗口、图片 URL 前缀），
+# 值为完整响应体；目录版本号变化后旧键不再命中，随 LRU/TTL 淘汰。目录引擎开关两条路径都经此缓存，
+# 滞后上限与片段缓存相同：版本号变化在 CATALOG_CHECK_INTERVAL 秒内生效，直接 SQL 修改最多滞后
+# min(QUERY_CACHE_TTL, 当前时间窗口剩余时间)。
+# 相同键的并发未命中经 SingleFlight 合并，只有一个请求执行查询、COUNT 与序列化。
+query_result_cache = TTLCache(maxsize=app.config.get('QUERY_CACHE_SIZE', 1024), ttl=app.config.get('QUERY_CACHE_TTL', 60))
+CACHE_REGISTRY['query_results'] = query_result_cache
+query_flight = SingleFlight(timeout=app.config.get('QUERY_SINGLE_FLIGHT_TIMEOUT', 10))
+
+def cached_result(key, render):
+    """返回 key 对应的缓存响应体；未命中时经 single-flight 调用 render() 生成并写入缓存。
+    render 抛出的异常不缓存，并传递给同一时刻等待该键的全部请求。"""
+    if not app.config.get('QUERY_CACHE_ENABLED', True):
+        return render()
+    body = query_result_cache.get(key)
+    if body is not None:
+        return body
+
+    def _compute():
+        # 领头请求进入时，上一轮同键计算可能刚写入缓存
+        hit = query_result_cache.get(key)
+        if hit is not None:
+            return hit
+        value = render()
+        query_result_cache.set(key, value)
+        return value
+    return query_flight.do(key, _compute)
+
 
 def _client_ip() -> str:
     # 在 ProxyFix 之后，request.access_route 会包含真实链路
@@ -341,6 +821,123 @@ def _client_ip() -> str:
         pass
     return request.remote_addr or ''
 
+# === JSON 响应压缩（gzip；安装 brotli 后优先 br） ===
+# 可缓存的目录响应（带 ETag）按 (ETag, 编码) 缓存压缩结果，热门页不必每次重新压缩；
+# 压缩后 ETag 改为弱校验（与 nginx gzip 一致），conditional_get 以弱比较匹配 If-None-Match。
+# 已带 Content-Encoding 的响应 nginx 不会再次 gzip。
+compressed_cache = TTLCache(maxsize=app.config.get('COMPRESSED_CACHE_SIZE', 256))
+CACHE_REGISTRY['compressed_responses'] = compressed_cache
+compression_stats = CompressionStats()
+# ETag -> 对应 200 响应体是否达到压缩阈值，供 304 响应选用与 200 相同形式（强/弱）的 ETag
+compressible_etags = TTLCache(maxsize=4096)
+CACHE_REGISTRY['compressible_etags'] = compressible_etags
+
+def _compressible(data: bytes) -> bool:
+    return len(data) >= app.config.get('COMPRESS_MIN_SIZE', 1024)
+
+@app.after_request
+def compress_response(resp):
+    if not app.config.get('COMPRESS_ENABLED'):
+        return resp
+    try:
+        if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+                or resp.mimetype != 'application/json' or 'Content-Encoding' in resp.headers):
+            return resp
+        resp.vary.add('Accept-Encoding')
+        data = resp.get_data()
+        etag, _ = resp.get_etag()
+        compressible = _compressible(data)
+        if etag:
+            compressible_etags.set(etag, compressible)
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None or not compressible:
+            return resp
+        cacheable = bool(etag) and getattr(g, '_cache_policy', None) == 'catalog'
+        body = compressed_cache.get((etag, encoding)) if cacheable else None
+        hit = body is not None
+        cpu_ms = 0.0
+        if not hit:
+            t0 = time.thread_time()
+            body = compress(data, encoding,
+                            gzip_level=app.config.get('COMPRESS_GZIP_LEVEL', 6),
+                            brotli_quality=app.config.get('COMPRESS_BROTLI_QUALITY', 5))
+            cpu_ms = (time.thread_time() - t0) * 1000
+            if cacheable:
+                compressed_cache.set((etag, encoding), body)
+        compression_stats.record(request.endpoint or request.path, encoding, len(data), len(body), cpu_ms, cached=hit)
+        resp.set_data(body)
+        resp.headers['Content-Encoding'] = encoding
+        if etag:
+            resp.set_etag(etag, weak=True)
+    except Exception:
+        logger.exception('response compression failed')
+    return resp
+
+# === 目录接口的条件请求（ETag / If-None-Match） ===
+
+def _catalog_etag() -> str:
+    """由目录版本号 + 路径 + 查询参数 + 图片 URL 前缀/主机 派生强 ETag。
+    版本号取自进程内节流缓存（catalog.current_version），比对时无需查库；
+    另混入按 CATALOG_MAX_AGE 划分的时间窗口，兜底手工 SQL 修改商品但未更新版本号的情况。
+    """
+    max_age = app.config.get('CATALOG_MAX_AGE') or 300
+    parts = [
+        str(catalog.current_version()),
+        str(int(time.time() // max_age)),
+        request.path,
+        '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+        request.host_url,
+        app.config.get('IMAGE_URL_PREFIX', '') or '',
+    ]
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def _not_modified(etag: str, weak: bool = None, body: bytes = None):
+    """304 须与对应的 200 响应携带相同形式的 ETag。weak 为 None 时按 compress_response 的规则判断：
+    启用压缩、客户端接受压缩编码且 200 响应体达到 COMPRESS_MIN_SIZE 时为弱 ETag。
+    响应体大小取自 body（已生成 200 时传入），否则取本进程生成该 200 时的记录；本进程没有记录
+    （由其他 worker 生成或已淘汰）时沿用客户端 If-None-Match 中该 ETag 的形式。
+    自行设置 Content-Encoding 的接口显式传入 weak。"""
+    resp = make_response('', 304)
+    if weak is None:
+        if body is not None:
+            compressible = _compressible(body)
+        else:
+            compressible = compressible_etags.get(etag)
+            if compressible is None:
+                compressible = request.if_none_match.is_weak(etag)
+        weak = (bool(app.config.get('COMPRESS_ENABLED')) and compressible
+                and choose_encoding(request.accept_encodings) is not None)
+    if app.config.get('COMPRESS_ENABLED'):
+        resp.vary.add('Accept-Encoding')
+    resp.set_etag(etag, weak=weak)
+    return resp
+
+def conditional_get(source='catalog'):
+    """目录只读接口装饰器：输出强 ETag，命中 If-None-Match 时返回 304，并采用可缓存策略（见 set_security_headers）。
+    - source='catalog': ETag 在执行视图（查库）之前由 _catalog_etag 计算并比对
+    - source='body': ETag 为响应体摘要，适用于不查库的小响应（如系统配置）
+    非 200 响应不附带 ETag，且仍按 no-store 处理。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = _catalog_etag() if source == 'catalog' else None
+            if etag and request.if_none_match.contains_weak(etag):
+                g._cache_policy = 'catalog'
+                return _not_modified(etag)
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+            g._cache_policy = 'catalog'
+            if etag is None:
+                etag = hashlib.sha1(resp.get_data()).hexdigest()
+                if request.if_none_match.contains_weak(etag):
+                    return _not_modified(etag, body=resp.get_data())
+            resp.set_etag(etag)
+            return resp
+        return wrapper
+    return decorator
+
 @app.errorhandler(404)
 def handle_404(_):
     return jsonify({'status': 'error', 'message': 'Not found'}), 404
@@ -350,6 +947,7 @@ def healthz():
     return jsonify({'status': 'ok'}), 200
 
 @app.route('/api/system/config', methods=['GET'])
+@conditional_get('body')
 def get_system_config():
     """获取系统全局配置（如生产模式开关）"""
     return jsonify({
@@ -360,210 +958,531 @@ def get_system_config():
         }
     })
 
+def _material_match_any(col, tags):
+    """构造“材质标签”匹配条件：
+    - tags: 可迭代的标签（如 ['TR','B钛']）
+    - 数据库存储格式示例："TR+钛"、"TR+B钛"；按'+'分隔为精确标签
+    - 精确匹配策略（避免子串误命中）：
+      col = tag OR col LIKE 'tag+%' OR col LIKE '%+tag' OR col LIKE '%+tag+%'
+    """
+    conds = []
+    for raw in tags:
+        tag = (raw or '').strip()
+        if not tag:
+            continue
+        like_mid = f"%+{tag}+%"
+        like_head = f"{tag}+%"
+        like_tail = f"%+{tag}"
+        conds.append(or_(col == tag, col.like(like_head), col.like(like_tail), col.like(like_mid)))
+    if not conds:
+        return None
+    # 任一命中即可
+    out = conds[0]
+    for c in conds[1:]:
+        out = or_(out, c)
+    return out
+
+def _apply_product_filters(query, conds):
+    """将规范化过滤条件（catalog.FilterCond）应用到 SQLAlchemy 查询上（AND）。"""
+    for c in conds:
+        if c.op == 'contains_ci':
+            like = f"%{c.value}%"
+            query = query.filter(func.lower(getattr(Product, c.field)).like(like))
+            logger.debug("apply fuzzy filter %s (case-insensitive contains) like %s", c.field, like)
+        elif c.op == 'brand_or_notes':
+            # 其他信息：品牌或备注任一模糊匹配
+            like = f"%{c.value}%"
+            query = query.filter(or_(Product.brand.like(like), Product.notes.like(like)))
+            logger.debug("apply fuzzy filter other_info (brand or notes) like %s", like)
+        elif c.op == 'like':
+            like = f"%{c.value}%"
+            query = query.filter(getattr(Product, c.field).like(like))
+            logger.debug("apply fuzzy filter %s like %s", c.field, like)
+        elif c.op == 'material_any':
+            cond = _material_match_any(Product.frame_material, c.value)
+            if cond is not None:
+                query = query.filter(cond)
+                logger.debug("apply material any-of tags: %s", list(c.value))
+        elif c.op == 'range':
+            lo, hi = c.value
+            query = query.filter(getattr(Product, c.field).between(lo - RANGE_EPS, hi + RANGE_EPS))
+            if lo == hi:
+                logger.debug("apply numeric filter %s ~= %s (eps=%s)", c.field, lo, RANGE_EPS)
+            else:
+                logger.debug("apply numeric filter %s in [%s, %s] (eps=%s)", c.field, lo, hi, RANGE_EPS)
+        elif c.op == 'invalid':
+            # 非法数值，令整体结果为空
+            query = query.filter(False)
+            logger.debug("invalid numeric filter for %s: %s", c.field, c.value)
+        elif c.op == 'eq':
+            col = getattr(Product, c.field, None)
+            if col is None:
+                continue
+            query = query.filter(col == c.value)
+            logger.debug("apply text filter %s = %s", c.field, c.value)
+    return query
+
 @app.route('/api/products', methods=['GET'])
+@conditional_get()
 def get_products():
-    """获取产品列表"""
+    """获取产品列表（view=card 时只返回首图；fields=a,b,c 只查询并返回指定字段）
+    过滤条件先规范化（catalog.build_filter_spec）；启用 CATALOG_LISTING_ENGINE_ENABLED 时优先在进程内目录快照上求值，
+    遇到内存引擎不支持的条件时回退到 SQL。
+    sort=price,-weight 多键排序（字段见 catalog.SORT_FIELDS，'-' 为降序，默认按型号升序），可与过滤、游标分页组合；
+    内存路径使用快照预计算的排列，SQL 路径依赖 (is_active, 列, frame_model) 复合索引。
+    完整响应体按规范化请求缓存（cached_result），同一筛选的并发请求只计算一次。
+    """
     try:
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
 
-        # 搜索参数（精确匹配）
-        search_field = (request.args.get('search_field') or '').strip()
-        search_value = (request.args.get('search_value') or '').strip()
         allowed_fields = getattr(app.config, 'ALLOWED_SEARCH_FIELDS', None) or app.config.get('ALLOWED_SEARCH_FIELDS', ['frame_model'])
-        # 多字段并行过滤：从查询参数中抓取所有白名单字段
-        multi_filters = {}
-        for f in allowed_fields:
-            v = request.args.get(f, type=str)
-            if v is not None and str(v).strip() != '':
-                multi_filters[f] = str(v).strip()
-
-        query = Product.query.filter_by(is_active='是')
-        numeric_fields = {'lens_size', 'nose_bridge_width', 'temple_length', 'frame_total_length', 'frame_height', 'weight', 'price'}
-
-        def _material_match_any(col, tags):
-            """构造“材质标签”匹配条件：
-            - tags: 可迭代的标签（如 ['TR','B钛']）
-            - 数据库存储格式示例："TR+钛"、"TR+B钛"；按'+'分隔为精确标签
-            - 精确匹配策略（避免子串误命中）：
-              col = tag OR col LIKE 'tag+%' OR col LIKE '%+tag' OR col LIKE '%+tag+%'
-            """
-            conds = []
-            for raw in tags:
-                tag = (raw or '').strip()
-                if not tag:
-                    continue
-                like_mid = f"%+{tag}+%"
-                like_head = f"{tag}+%"
-                like_tail = f"%+{tag}"
-                conds.append(or_(col == tag, col.like(like_head), col.like(like_tail), col.like(like_mid)))
-            if not conds:
-                return None
-            # 任一命中即可
-            out = conds[0]
-            for c in conds[1:]:
-                out = or_(out, c)
-            return out
-
-        def _parse_range_or_number(s: str):
-            """解析数值或范围字符串，支持：
-            - 单值: "42" -> (42.0, 42.0)
-            - 范围: "40-45" / "40 - 45" -> (40.0, 45.0)
-            返回: (lo, hi) 或抛出 ValueError
-            """
-            if s is None:
-                raise ValueError('empty')
-            text = str(s).strip()
-            # 兼容中文破折号、全角连字符
-            text = text.replace('－', '-').replace('—', '-').replace('–', '-')
-            if '-' in text:
-                parts = [p.strip() for p in text.split('-', 1)]
-                if len(parts) != 2 or parts[0] == '' or parts[1] == '':
-                    raise ValueError('invalid range')
-                lo = float(parts[0])
-                hi = float(parts[1])
-                if lo > hi:
-                    lo, hi = hi, lo
-                return (lo, hi)
-            # 单值
-            v = float(text)
-            return (v, v)
-
-        if multi_filters:
-            # 同时应用多字段过滤（AND）
-            for f, v in multi_filters.items():
-                if f == 'frame_model':
-                    # 镜架型号：忽略大小写的子串匹配（如搜索 123 可匹配到 s123）
-                    needle = (v or '').strip().lower()
-                    like = f"%{needle}%"
-                    query = query.filter(func.lower(Product.frame_model).like(like))
-                    logger.debug("apply fuzzy filter frame_model (case-insensitive contains) like %s", like)
-                    continue
-                if f == 'other_info':
-                    # 其他信息：恢复为品牌或备注任一模糊匹配
-                    like = f"%{v}%"
-                    query = query.filter(or_(Product.brand.like(like), Product.notes.like(like)))
-                    logger.debug("apply fuzzy filter other_info (brand or notes) like %s", like)
-                    continue
-                if f == 'brand_info':
-                    # 品牌信息：仅在品牌字段模糊匹配
-                    like = f"%{v}%"
-                    query = query.filter(Product.brand.like(like))
-                    logger.debug("apply fuzzy filter brand_info (brand only) like %s", like)
-                    continue
-                if f == 'frame_material':
-                    # 解析为多选标签，分隔符支持逗号/中文逗号/竖线
-                    parts = [p.strip() for p in re.split(r'[，,|]+', v) if p and p.strip()]
-                    cond = _material_match_any(Product.frame_material, parts)
-                    if cond is not None:
-                        query = query.filter(cond)
-                        logger.debug("apply material any-of tags: %s", parts)
-                    continue
-                col = getattr(Product, f, None)
-                if col is None:
-                    continue
-                if f in numeric_fields:
-                    try:
-                        lo, hi = _parse_range_or_number(v)
-                        eps = 1e-4
-                        query = query.filter(col.between(lo - eps, hi + eps))
-                        if lo == hi:
-                            logger.debug("apply numeric filter %s ~= %s (eps=%s)", f, lo, eps)
-                        else:
-                            logger.debug("apply numeric filter %s in [%s, %s] (eps=%s)", f, lo, hi, eps)
-                    except ValueError:
-                        # 非法数值，令整体结果为空
-                        query = query.filter(False)
-                        logger.debug("invalid numeric filter for %s: %s", f, v)
-                else:
-                    query = query.filter(col == v)
-                    logger.debug("apply text filter %s = %s", f, v)
-            try:
-                logger.info("/api/products using multi filters: %s", multi_filters)
-            except Exception:
-                pass
-        elif search_value:
-            # 兼容旧的单字段搜索参数
-            if not search_field or search_field not in allowed_fields:
-                search_field = app.config.get('DEFAULT_SEARCH_FIELD', 'frame_model')
-            col = getattr(Product, search_field, None)
-            if search_field == 'frame_model':
-                # 镜架型号：忽略大小写的子串匹配（如搜索 123 可匹配到 s123）
-                needle = (search_value or '').strip().lower()
-                like = f"%{needle}%"
-                query = query.filter(func.lower(Product.frame_model).like(like))
-                logger.debug("apply single fuzzy frame_model (case-insensitive contains) like %s", like)
-            if search_field == 'other_info':
-                like = f"%{search_value}%"
-                query = query.filter(or_(Product.brand.like(like), Product.notes.like(like)))
-                logger.debug("apply single fuzzy other_info (brand or notes) like %s", like)
-            elif search_field == 'brand_info':
-                like = f"%{search_value}%"
-                query = query.filter(Product.brand.like(like))
-                logger.debug("apply single fuzzy brand_info (brand only) like %s", like)
-            elif search_field == 'frame_material':
-                parts = [p.strip() for p in re.split(r'[，,|]+', search_value) if p and p.strip()]
-                cond = _material_match_any(Product.frame_material, parts)
-                if cond is not None:
-                    query = query.filter(cond)
-                    logger.debug("apply single material any-of tags: %s", parts)
-            elif col is not None:
-                if search_field in numeric_fields:
-                    try:
-                        lo, hi = _parse_range_or_number(search_value)
-                        eps = 1e-4
-                        query = query.filter(col.between(lo - eps, hi + eps))
-                        if lo == hi:
-                            logger.debug("apply numeric single filter %s ~= %s (eps=%s)", search_field, lo, eps)
-                        else:
-                            logger.debug("apply numeric single filter %s in [%s, %s] (eps=%s)", search_field, lo, hi, eps)
-                    except ValueError:
-                        query = query.filter(False)
-                        logger.debug("invalid numeric single filter %s: %s", search_field, search_value)
+        mode, conds = build_filter_spec(request.args, allowed_fields, app.config.get('DEFAULT_SEARCH_FIELD', 'frame_model'))
+        try:
+            if mode == 'multi':
+                logger.info("/api/products using multi filters: %s", {c.field or c.op: c.value for c in conds})
+            elif mode == 'single':
+                logger.info("/api/products using single filter: %s", [tuple(c) for c in conds])
+        except Exception:
+            pass
+
+        use_cursor = _cursor_requested()
+        cursor = request.args.get('cursor')
+        view = _product_view()
+        sort = parse_sort(request.args.get('sort'))
+        # 与 paginate_list/paginate_query/keyset 分页的边界处理一致，使等价参数得到相同的缓存键
+        if use_cursor:
+            per_page = _cursor_per_page(per_page)
+            total_mode = _total_mode('none')
+            page_key = ('cursor', (cursor or '').strip(), per_page)
+        else:
+            page = max(page, 1)
+            per_page = 20 if per_page < 0 else per_page
+            total_mode = _total_mode('exact')
+            page_key = ('page', page, per_page)
+        cache_key = ('products', conds, sort, view, page_key, total_mode) + _fragment_scope()
+
+        def _render() -> str:
+            products = None
+            if app.config.get('CATALOG_LISTING_ENGINE_ENABLED'):
+                snap = catalog.snapshot()
+                hits = snap.select(conds, sort)
+                if hits is not None:
+                    if use_cursor:
+                        products = keyset_paginate_list(hits, sort, lambda i: snap.sort_key(i, sort), cursor, per_page,
+                                                        with_total=total_mode != 'none')
+                    else:
+                        products = paginate_list(hits, page, per_page)
+                    rows = snap.card_rows if view.max_images == 1 else snap.rows
+                    products.items = [_product_fragment(rows[i], view) for i in products.items]
+            if products is None:
+                query = _product_query(view, extra_columns=[f for f, _ in sort]).filter_by(is_active='是')
+                query = _apply_product_filters(query, conds)
+                counter = make_counter(total_mode, ('products', conds), (CATALOG_VERSION_KEY,))
+                if use_cursor:
+                    products = keyset_paginate_sorted(query, sort, cursor, per_page, count=counter)
                 else:
-                    query = query.filter(col == search_value)
-                    logger.debug("apply text single filter %s = %s", search_field, search_value)
-            try:
-                logger.info("/api/products using single filter: %s=%s", search_field, search_value)
-            except Exception:
-                pass
+                    # 排序末键固定为型号，保证翻页之间顺序稳定
+                    order = [getattr(Product, f).desc() if desc else getattr(Product, f).asc() for f, desc in sort]
+                    products = paginate_query(query.order_by(*order), page, per_page, count=counter)
+                products.items = [_product_fragment(p, view) for p in products.items]
 
-        products = paginate_query(query, page, per_page)
+            # 列表由预渲染商品片段拼接输出
+            items_json = _fragment_list(products.items)
+            if use_cursor:
+                return _render_with_fragment({'status': 'success', 'data': products.to_payload(_FRAGMENT_MARKER)}, items_json)
 
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'items': [_serialize_product_with_public_images(product) for product in products.items],
-                'total': products.total,
-                'pages': products.pages,
-                'current_page': products.page
-            }
-        })
+            return _render_with_fragment({
+                'status': 'success',
+                'data': {
+                    'items': _FRAGMENT_MARKER,
+                    'total': products.total,
+                    'pages': products.pages,
+                    'current_page': products.page
+                }
+            }, items_json)
+
+        return _json_body_response(cached_result(cache_key, _render))
+    except InvalidCursor:
+        return jsonify({'status': 'error', 'message': 'invalid cursor'}), 400
+    except InvalidFields as e:
+        return _invalid_fields_response(e)
+    except InvalidSort as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return handle_error(e, "Error getting products")
 
+# === 目录索引接口 ===
+# materials / facets / suggest / nearest / similar 与离线目录包只基于目录快照的索引实现，没有 SQL 版本，
+# 不受 CATALOG_LISTING_ENGINE_ENABLED 控制（该开关只决定 /api/products 与 /api/products/batch 走快照还是 SQL）。
+# 快照在首次调用时加载（每个 worker 进程各一份，内存估算见 config.CATALOG_LISTING_ENGINE_ENABLED），此后随目录版本号或 CATALOG_MAX_AGE 重建。
+
+@app.route('/api/materials', methods=['GET'])
+def list_materials():
+    """列出全部材质标签及对应上架商品数（来自目录快照的材质倒排索引）。
+    Return: { items: [{ tag, count }], total: n, version }
+    """
+    try:
+        snap = catalog.snapshot()
+        items = snap.material_facets()
+        return jsonify({'status': 'success', 'data': {'items': items, 'total': len(items), 'version': snap.version}})
+    except Exception as e:
+        return handle_error(e, 'Error listing materials')
+
+# 分面结果缓存：键为规范化过滤条件，值附带目录版本号
+facet_cache = TTLCache(maxsize=app.config.get('FACET_CACHE_SIZE', 512))
+CACHE_REGISTRY['facets'] = facet_cache
+
+@app.route('/api/products/facets', methods=['GET'])
+def product_facets():
+    """搜索页分面统计：在与 /api/products 相同的过滤条件下，统计各材质标签、品牌及
+    价格/重量/镜片尺寸分桶（FACET_BUCKETS）的商品数。单次遍历命中集合，按过滤条件缓存。
+    Return: { total, materials: [{tag, count}], brands: [{brand, count}], buckets: {字段: [{from, to, count}]}, version }
+    """
+    try:
+        allowed_fields = app.config.get('ALLOWED_SEARCH_FIELDS', ['frame_model'])
+        _, conds = build_filter_spec(request.args, allowed_fields, app.config.get('DEFAULT_SEARCH_FIELD', 'frame_model'))
+        snap = catalog.snapshot()
+        hit = facet_cache.get(conds)
+        if hit is not None and hit[0] == snap.version:
+            return jsonify({'status': 'success', 'data': hit[1]})
+
+        buckets = {f: sorted(edges) for f, edges in (app.config.get('FACET_BUCKETS') or {}).items() if edges}
+        indices = snap.select(conds)
+        if indices is not None:
+            rows = snap.facet_rows(indices, buckets)
+        else:
+            # 内存引擎不支持的条件：一次查询取出命中商品的分面列，在 Python 中单次遍历计数
+            cols = [getattr(Product, f) for f in buckets if hasattr(Product, f)]
+            q = Product.query.with_entities(Product.frame_material, Product.brand, *cols).filter_by(is_active='是')
+            q = _apply_product_filters(q, conds)
+            names = [c.key for c in cols]
+            rows = ((r[0], r[1], dict(zip(names, r[2:]))) for r in q.all())
+        data = compute_facets(rows, buckets)
+        data['version'] = snap.version
+        facet_cache.set(conds, (snap.version, data))
+        return jsonify({'status': 'success', 'data': data})
+    except Exception as e:
+        return handle_error(e, 'Error computing product facets')
+
+SUGGEST_MAX_LIMIT = 20
+
+@app.route('/api/products/suggest', methods=['GET'])
+@conditional_get()
+def suggest_products():
+    """输入联想：按 q（忽略大小写）返回匹配的型号与品牌，前缀命中优先，不足时补充子串命中。
+    完全在目录快照的有序数组 / n-gram 倒排表上完成，不查询数据库，可随每次按键调用。
+    Query: q（必填）, limit（每类最多返回条数，默认 8，最大 20）
+    Return: { q, models: [frame_model], brands: [{brand, count}], version }
+    """
+    try:
+        q = (request.args.get('q') or '').strip()
+        try:
+            limit = min(max(int(request.args.get('limit', 8)), 1), SUGGEST_MAX_LIMIT)
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'limit must be an integer'}), 400
+        snap = catalog.snapshot()
+        models, brands = snap.suggest(q, limit)
+        return jsonify({'status': 'success', 'data': {
+            'q': q,
+            'models': models,
+            'brands': [{'brand': b, 'count': cnt} for b, cnt in brands],
+            'version': snap.version,
+        }})
+    except Exception as e:
+        return handle_error(e, 'Error suggesting products')
+
+# === 离线目录包 ===
+# 键为 (目录版本号, 图片 URL 前缀)，另以 ('name', 文件名) 索引，使刚被替换的旧包仍可下载。
+# 不含快照加载时间：快照按 max_age 定期重载时版本号未变，不必重新生成并让客户端重新下载整个包。
+bundle_cache = TTLCache(maxsize=8)
+CACHE_REGISTRY['catalog_bundles'] = bundle_cache
+
+def _current_bundle():
+    """当前目录版本对应的目录包（bundle.CatalogBundle）；每个版本只生成一次，并发请求经 single-flight 合并。"""
+    snap = catalog.snapshot()
+    base = _image_url_base()
+    key = ('bundle', snap.version, base)
+    found = bundle_cache.get(key)
+    if found is not None:
+        return found
+
+    def _build():
+        b = bundle_cache.get(key)
+        if b is None:
+            b = build_bundle(snap, base)
+            bundle_cache.set(key, b)
+            bundle_cache.set(('name', b.name), b)
+            logger.info('catalog bundle built %s products=%s bytes=%s gzip=%s',
+                        b.name, b.count, len(b.body), len(b.encoded['gzip']))
+        return b
+    return query_flight.do(key, _build)
+
+@app.route('/api/catalog/bundle', methods=['GET'])
+@conditional_get()
+def catalog_bundle_manifest():
+    """离线目录包描述：客户端比较 name 与本地缓存，不同时再下载 url。
+    Return: { version, name, sha1, count, size, encoded_sizes: {编码: 字节数}, url }
+    """
+    try:
+        b = _current_bundle()
+        return jsonify({'status': 'success', 'data': {
+            'version': b.version,
+            'name': b.name,
+            'sha1': b.sha1,
+            'count': b.count,
+            'size': len(b.body),
+            'encoded_sizes': {enc: len(data) for enc, data in b.encoded.items()},
+            'url': url_for('catalog_bundle_file', name=b.name, _external=True),
+        }})
+    except Exception as e:
+        return handle_error(e, 'Error building catalog bundle')
+
+@app.route('/api/catalog/bundle/<string:name>', methods=['GET'])
+def catalog_bundle_file(name):
+    """下载目录包（格式见 bundle.py）。直接输出预压缩内容，按文件名长期缓存；已被淘汰的旧包返回 404。"""
+    try:
+        b = _current_bundle()
+        if b.name != name:
+            b = bundle_cache.get(('name', name))
+            if b is None:
+                return jsonify({'status': 'error', 'message': 'bundle not found'}), 404
+        g._cache_policy = 'immutable'
+        if request.if_none_match.contains_weak(b.sha1):
+            return _not_modified(b.sha1, weak=False)
+        encoding = choose_encoding(request.accept_encodings)
+        resp = app.response_class(b.encoded.get(encoding, b.body), mimetype='application/json')
+        if encoding in b.encoded:
+            resp.headers['Content-Encoding'] = encoding
+        resp.vary.add('Accept-Encoding')
+        resp.set_etag(b.sha1)
+        return resp
+    except Exception as e:
+        return handle_error(e, 'Error serving catalog bundle')
+
+CHANGES_MAX_LIMIT = 1000
+CHANGES_SORT = (('row_version', False), ('frame_model', False))
+
+@app.route('/api/products/changes', methods=['GET'])
+@conditional_get()
+def product_changes():
+    """目录变更流：返回 row_version > since 的商品，客户端据此增量同步，无需重新拉取整个列表。
+    Query: since（上次同步得到的 version，首次传 0 即全量）, limit（默认 200，最大 1000）, cursor（翻页，同一 since 下传上一页的 next_cursor）,
+           view / fields 同 /api/products
+    Return: { since, version, upserted: [商品], deactivated: [frame_model], next_cursor, has_more }
+    has_more 为 false 时保存 version 作为下次的 since。按 (row_version, frame_model) 游标分页，
+    翻页期间再次变更的商品版本号更大，会出现在后续页中，不会漏读。
+    """
+    try:
+        try:
+            since = int(request.args.get('since', 0))
+            limit = min(max(int(request.args.get('limit', 200)), 1), CHANGES_MAX_LIMIT)
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'since and limit must be integers'}), 400
+        if since < 0:
+            return jsonify({'status': 'error', 'message': 'since must be >= 0'}), 400
+        view = _product_view()
+        # 先读版本号再查变更：返回的 version 之前提交的变更都已包含在本次结果中
+        version = read_catalog_version()
+        query = _product_query(view, extra_columns=('row_version', 'is_active'))
+        # since=0 为全量同步：只需当前上架商品（未经 mark_products_changed 的存量商品 row_version 为 0）
+        query = query.filter(Product.row_version > since) if since else query.filter_by(is_active='是')
+        page = keyset_paginate_sorted(query, CHANGES_SORT, request.args.get('cursor'), limit)
+        upserted, deactivated = [], []
+        for p in page.items:
+            if p.is_active == '是':
+                upserted.append(_product_fragment(p, view))
+            else:
+                deactivated.append(p.frame_model)
+        return _json_with_fragment({'status': 'success', 'data': {
+            'since': since,
+            'version': version,
+            'upserted': _FRAGMENT_MARKER,
+            'deactivated': deactivated,
+            'next_cursor': page.next_cursor,
+            'has_more': page.next_cursor is not None,
+        }}, _fragment_list(upserted))
+    except InvalidCursor:
+        return jsonify({'status': 'error', 'message': 'invalid cursor'}), 400
+    except InvalidFields as e:
+        return _invalid_fields_response(e)
+    except Exception as e:
+        return handle_error(e, 'Error listing product changes')
+
+@app.route('/api/products/nearest', methods=['GET'])
+def nearest_products():
+    """按面部/镜架尺寸查找最贴合的上架商品（加权 k 近邻）。
+    Query:
+      - lens_size / nose_bridge_width / temple_length / frame_total_length / frame_height: 目标尺寸（至少一个）
+      - w_<维度>: 该维度权重（>=0，缺省 1）
+      - tol_<维度>: 该维度容差（>=0），超出容差的商品不参与排序
+      - k: 返回数量（默认 10，最大 50）
+      - 其余 ALLOWED_SEARCH_FIELDS（材质、品牌、价格等）按 /api/products 语义作为附加过滤
+    Return: { items: [{ ...商品, fit: { distance, deltas } }], version }
+    """
+    try:
+        target, weights, tolerances = {}, {}, {}
+        for f in FIT_FIELDS:
+            try:
+                v = request.args.get(f, type=str)
+                if v is not None and v.strip() != '':
+                    target[f] = float(v)
+                w = request.args.get(f'w_{f}', type=str)
+                if w is not None and w.strip() != '':
+                    weights[f] = float(w)
+                t = request.args.get(f'tol_{f}', type=str)
+                if t is not None and t.strip() != '':
+                    tolerances[f] = float(t)
+            except ValueError:
+                return jsonify({'status': 'error', 'message': f'invalid number for {f}'}), 400
+        if not target:
+            return jsonify({'status': 'error', 'message': 'at least one measurement is required'}), 400
+        if any(v < 0 for v in weights.values()) or any(v < 0 for v in tolerances.values()):
+            return jsonify({'status': 'error', 'message': 'weights and tolerances must be non-negative'}), 400
+        try:
+            k = int(request.args.get('k', 10))
+        except ValueError:
+            k = 10
+        k = max(1, min(k, 50))
+
+        allowed_fields = app.config.get('ALLOWED_SEARCH_FIELDS', ['frame_model'])
+        extra_fields = [f for f in allowed_fields if f not in FIT_FIELDS]
+        _, conds = build_filter_spec(request.args, extra_fields)
+        snap = catalog.snapshot()
+        mask = snap.match(conds) if conds else None
+        if conds and mask is None:
+            # 内存引擎不支持的附加条件：用 SQL 求出候选型号
+            q = _apply_product_filters(Product.query.with_entities(Product.frame_model).filter_by(is_active='是'), conds)
+            mask = snap.mask_for_models(r.frame_model for r in q.all())
+
+        t0 = time.perf_counter()
+        hits = snap.nearest(target, weights, tolerances, k=k, mask=mask)
+        cost_ms = (time.perf_counter() - t0) * 1000
+        logger.debug('nearest target=%s k=%s hits=%s cost=%.2fms', target, k, len(hits), cost_ms)
+        items = []
+        for dist, i, deltas in hits:
+            d = _publicize_product_dict(snap.rows[i])
+            d['fit'] = {'distance': round(dist, 4), 'deltas': deltas}
+            items.append(d)
+        return jsonify({'status': 'success', 'data': {'items': items, 'version': snap.version}})
+    except Exception as e:
+        return handle_error(e, 'Error finding nearest products')
+
+# 批量查询单次最多型号数（与分享推送 product_list 上限一致）
+BATCH_LOOKUP_LIMIT = 50
+
+@app.route('/api/products/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    """批量获取商品详情（分享落地页/预览一次拉取整组型号）。
+    GET  Query: ids=a,b,c
+    POST Body JSON: { ids: [str, ...] }（列表较长时使用）
+    去重后最多 50 个；按请求顺序返回上架商品，未找到或已下架的型号列入 missing。
+    Return: { items: [...], missing: [frame_model, ...] }
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            raw = data.get('ids') or []
+            if not isinstance(raw, list):
+                return jsonify({'status': 'error', 'message': 'ids(list) is required'}), 400
+        else:
+            raw = re.split(r'[，,]+', request.args.get('ids') or '')
+        ids = []
+        seen = set()
+        for m in raw:
+            if not m or not isinstance(m, str):
+                continue
+            mm = m.strip()
+            if not mm or mm in seen:
+                continue
+            seen.add(mm)
+            ids.append(mm)
+        if not ids:
+            return jsonify({'status': 'error', 'message': 'ids is required'}), 400
+        if len(ids) > BATCH_LOOKUP_LIMIT:
+            return jsonify({'status': 'error', 'message': f'at most {BATCH_LOOKUP_LIMIT} ids per request'}), 400
+
+        found = {}
+        if app.config.get('CATALOG_LISTING_ENGINE_ENABLED'):
+            snap = catalog.snapshot()
+            for m in ids:
+                i = snap.position.get(m)
+                if i is not None:
+                    found[m] = _product_fragment(snap.rows[i])
+        else:
+            rows = Product.query.filter(Product.frame_model.in_(ids), Product.is_active == '是').all()
+            found = {p.frame_model: _product_fragment(p) for p in rows}
+        items_json = _fragment_list(found[m] for m in ids if m in found)
+        missing = [m for m in ids if m not in found]
+        return _json_with_fragment({'status': 'success', 'data': {'items': _FRAGMENT_MARKER, 'missing': missing}}, items_json)
+    except Exception as e:
+        return handle_error(e, 'Error getting products batch')
+
 @app.route('/api/products/<string:frame_model>', methods=['GET'])
+@conditional_get()
 def get_product(frame_model):
-    """获取单个产品详情"""
+    """获取单个产品详情（支持 fields=a,b,c 稀疏字段集）"""
     try:
-        product = Product.query.filter_by(frame_model=frame_model, is_active='是').first()
+        view = _product_view()
+        product = _product_query(view).filter_by(frame_model=frame_model, is_active='是').first()
         if not product:
             return jsonify({'status': 'error', 'message': '商品不存在'}), 404
 
-        return jsonify({
+        return _json_with_fragment({
             'status': 'success',
-            'data': _serialize_product_with_public_images(product)
-        })
+            'data': _FRAGMENT_MARKER
+        }, _product_fragment(product, view))
+    except InvalidFields as e:
+        return _invalid_fields_response(e)
     except Exception as e:
         return handle_error(e, f"Error getting product {frame_model}")
 
 
+@app.route('/api/products/<string:frame_model>/similar', methods=['GET'])
+@conditional_get()
+def similar_products(frame_model):
+    """相似镜架推荐：读取预计算表 product_similar（一次主键查询），商品数据取自目录快照。
+    结果由 flask similar rebuild/refresh 离线生成，已下架的型号在输出时跳过。
+    Query: k（返回数量，默认全部，最多 SIMILAR_TOP_K），view / fields 同 /api/products
+    Return: { frame_model, items: [{ ...商品, similarity }], version }
+    """
+    try:
+        view = _product_view()
+        try:
+            k = int(request.args.get('k', 0)) or None
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'k must be an integer'}), 400
+        snap = catalog.snapshot()
+        if frame_model not in snap.position:
+            return jsonify({'status': 'error', 'message': '商品不存在'}), 404
+        row = ProductSimilar.query.get(frame_model)
+        items = []
+        rows = snap.card_rows if view.max_images == 1 else snap.rows
+        for m, score in (json.loads(row.items) if row else []):
+            i = snap.position.get(m)
+            if i is None:
+                continue
+            d = _publicize_product_dict(_project_product_dict(rows[i], view))
+            d['similarity'] = score
+            items.append(d)
+            if k and len(items) >= k:
+                break
+        return jsonify({'status': 'success', 'data': {'frame_model': frame_model, 'items': items, 'version': snap.version}})
+    except InvalidFields as e:
+        return _invalid_fields_response(e)
+    except Exception as e:
+        return handle_error(e, f"Error getting similar products for {frame_model}")
+
+
 # === 文件上传：头像 ===
 @app.route('/api/upload/avatar', methods=['POST'])
 def upload_avatar():
     """上传用户头像文件，返回可长期访问的公网 URL。
-    Form: open_id, file (multipart)
-    Return: { status, url }
+    Form: open_id, file (multipart) 或 remote_url（微信头像地址）
+    Return: 上传文件 { status: success, url }；
+            remote_url 为异步抓取（用户须已存在，否则 404），立即返回 202 { status: accepted, state, url: 当前头像（占位） }，
+            完成后后台更新 users.avatar_url，客户端可轮询 /api/users/profile 直到 avatar_url 变化；
+            来源地址或文件内容与当前头像相同时不下载/不写入，直接返回 { status: success, url: 当前头像, unchanged: true }
     """
     try:
         logger.info('avatar upload debug form_keys=%s files_keys=%s', list(request.form.keys()), list(request.files.keys()))
@@ -579,8 +1498,7 @@ def upload_avatar():
             logger.warning('avatar upload missing file and remote_url (open_id=%r)', open_id)
             return jsonify({'status': 'error', 'message': 'file or remote_url required'}), 400
 
-        # 若本地文件存在，走本地上传；否则尝试远程下载
-        content_bytes = None
+        # 若本地文件存在，走本地上传；否则提交远程抓取任务
         content_type = None
         if f is not None:
             # 基本校验
@@ -600,30 +1518,30 @@ def upload_avatar():
             logger.info('avatar upload received open_id=%r mimetype=%r size=%s', open_id, f.mimetype, size)
             content_type = f.mimetype
         else:
-            # 远程下载：仅允许微信头像域名，避免滥用
+            # 远程头像：仅允许微信头像域名，避免滥用；下载在后台线程池完成，不占用请求线程（见 avatars.py）
             from urllib.parse import urlparse
+            host = (urlparse(remote_url).hostname or '').lower()
+            if host not in AVATAR_REMOTE_HOSTS:
+                logger.warning('avatar remote_url host not allowed: %r (open_id=%r)', host, open_id)
+                return jsonify({'status': 'error', 'message': 'remote host not allowed'}), 400
+            row = db.session.query(User.avatar_url, User.avatar_source_url).filter(User.open_id == open_id).first()
+            if row is None:
+                # 抓取结果只写回已有用户，需先调用 /api/users/upsert
+                logger.warning('avatar remote fetch for unknown user (open_id=%r)', open_id)
+                return jsonify({'status': 'error', 'message': 'user not found'}), 404
+            previous, source = row
+            if previous and source == remote_url:
+                # 来源地址与当前头像一致：沿用已有头像，不再下载
+                logger.info('avatar remote unchanged, skip fetch url=%r (open_id=%r)', remote_url, open_id)
+                return jsonify({'status': 'success', 'url': previous, 'unchanged': True})
             try:
-                pr = urlparse(remote_url)
-                host = (pr.hostname or '').lower()
-                allowed_hosts = {'thirdwx.qlogo.cn', 'wx.qlogo.cn'}
-                if host not in allowed_hosts:
-                    logger.warning('avatar remote_url host not allowed: %r (open_id=%r)', host, open_id)
-                    return jsonify({'status': 'error', 'message': 'remote host not allowed'}), 400
-                r = requests.get(remote_url, timeout=5)
-                r.raise_for_status()
-                content_type = r.headers.get('Content-Type', '')
-                if not _allowed_image(content_type):
-                    logger.warning('avatar remote content-type unsupported: %r (open_id=%r)', content_type, open_id)
-                    return jsonify({'status': 'error', 'message': 'unsupported file type'}), 400
-                content_bytes = r.content
-                size = len(content_bytes)
-                if size > 2 * 1024 * 1024:
-                    logger.warning('avatar remote too large size=%s (open_id=%r)', size, open_id)
-                    return jsonify({'status': 'error', 'message': 'file too large'}), 400
-                logger.info('avatar remote fetched ok size=%s type=%r url=%r (open_id=%r)', size, content_type, remote_url, open_id)
-            except Exception as de:
-                logger.error('avatar remote fetch error url=%r open_id=%r err=%s', remote_url, open_id, de)
-                return jsonify({'status': 'error', 'message': 'remote fetch failed'}), 400
+                job = avatar_fetcher.submit(open_id, remote_url, _avatar_public_url(''), previous)
+            except AvatarQueueFull:
+                logger.warning('avatar remote fetch queue full (open_id=%r)', open_id)
+                return jsonify({'status': 'error', 'message': 'avatar fetch busy, retry later'}), 503
+            logger.info('avatar remote fetch accepted job=%s url=%r (open_id=%r)', job['job_id'], remote_url, open_id)
+            # url 为占位：完成前沿用用户当前头像，完成后后台更新 users.avatar_url
+            return jsonify({'status': 'accepted', 'state': job['state'], 'url': job['url'] or previous or ''}), 202
 
         # 生成安全文件名
         ext = '.jpg'
@@ -632,17 +1550,15 @@ def upload_avatar():
                 ext = '.png'
         except Exception:
             pass
-        safe = secure_filename(open_id) or 'user'
-        # 使用 open_id 前缀 + 时间戳，避免频繁覆盖；如需覆盖可改为固定名
-        filename = f"{safe}_{int(time.time())}{ext}"
-        save_dir = Path(app.root_path) / 'static' / 'avatars'
-        save_dir.mkdir(parents=True, exist_ok=True)
-        save_path = save_dir / filename
-        if content_bytes is not None:
-            with open(save_path, 'wb') as fp:
-                fp.write(content_bytes)
-        else:
-            f.save(save_path)
+        # 按内容摘要存储：相同头像只存一份，URL 不变可长期缓存（见 blobstore.py）
+        content = f.read()
+        digest = content_digest(content)
+        current = db.session.query(User.avatar_url).filter(User.open_id == open_id).scalar()
+        if current and digest_of(current) == digest:
+            # 与用户当前头像内容相同：不写文件，直接返回当前 URL
+            logger.info('avatar upload unchanged open_id=%r url=%r', open_id, current)
+            return jsonify({'status': 'success', 'url': current, 'unchanged': True})
+        filename = put_bytes(avatar_root(app), content, ext, digest)
 
         url = _avatar_public_url(filename)
         logger.info('avatar upload success open_id=%r filename=%r url=%r', open_id, filename, url)
@@ -662,6 +1578,10 @@ def list_favorites():
       - open_id (required)
       - page, per_page （仅在非分组模式下分页产品）
       - group_by=batch 可启用批次分组模式（忽略分页，返回全部分组）
+      - view=card 只返回首图（不加载 image2..image15），默认 full
+      - fields=a,b,c 只查询并返回指定字段（白名单见 Product.PUBLIC_FIELDS，frame_model 始终返回）
+      - cursor 启用游标分页（按型号升序；首页传空串）
+      - include_total=exact|approx|none 总数计算方式（分页模式默认 exact，游标模式默认 none）
     批次定义：同一批推荐操作（批量接口或单次添加）生成唯一 batch_id 与 batch_time。
     未分配 batch_id 的旧数据归为 legacy 分组。
     """
@@ -680,10 +1600,12 @@ def list_favorites():
                     .all())
             # 收集所有型号到产品查询
             frame_models = [f.frame_model for f in favs]
+            view = _product_view()
             if not frame_models:
                 return jsonify({'status': 'success', 'data': {'batches': []}})
-            products = Product.query.filter(Product.frame_model.in_(frame_models), Product.is_active == '是').all()
-            prod_map = {p.frame_model: _serialize_product_with_public_images(p) for p in products}
+            products = _product_query(view).filter(Product.frame_model.in_(frame_models), Product.is_active == '是').all()
+            prod_map = {p.frame_model: _publicize_product_dict(p.to_dict(max_images=view.max_images, fields=view.fields))
+                        for p in products}
             batches = []
             # 分组：batch_id 为 None -> legacy 单独处理，按 batch_time 逆序，其次 created_at
             from collections import OrderedDict
@@ -715,17 +1637,30 @@ def list_favorites():
             page = int(request.args.get('page', 1))
             per_page = int(request.args.get('per_page', 10))
             subq = select(Favorite.frame_model).where(Favorite.open_id == open_id)
-            query = Product.query.filter(Product.frame_model.in_(subq)).filter_by(is_active='是')
-            products = paginate_query(query, page, per_page)
-            return jsonify({
+            view = _product_view()
+            query = _product_query(view).filter(Product.frame_model.in_(subq)).filter_by(is_active='是')
+            count_key = ('favorites', open_id)
+            count_versions = (CATALOG_VERSION_KEY,)
+            if _cursor_requested():
+                cp = keyset_paginate(query, Product.frame_model, request.args.get('cursor'), per_page,
+                                     count=make_counter(_total_mode('none'), count_key, count_versions, USER_COUNT_TTL))
+                items_json = _fragment_list(_product_fragment(p, view) for p in cp.items)
+                return _json_with_fragment({'status': 'success', 'data': cp.to_payload(_FRAGMENT_MARKER)}, items_json)
+            products = paginate_query(query, page, per_page,
+                                      count=make_counter(_total_mode('exact'), count_key, count_versions, USER_COUNT_TTL))
+            return _json_with_fragment({
                 'status': 'success',
                 'data': {
-                    'items': [_serialize_product_with_public_images(p) for p in products.items],
+                    'items': _FRAGMENT_MARKER,
                     'total': products.total,
                     'pages': products.pages,
                     'current_page': products.page
                 }
-            })
+            }, _fragment_list(_product_fragment(p, view) for p in products.items))
+    except InvalidCursor:
+        return jsonify({'status': 'error', 'message': 'invalid cursor'}), 400
+    except InvalidFields as e:
+        return _invalid_fields_response(e)
     except Exception as e:
         return handle_error(e, 'Error listing favorites')
 
@@ -772,8 +1707,8 @@ def add_favorite():
             user = User(open_id=open_id)
             db.session.add(user)
 
-        # 检查商品存在
-        product = Product.query.filter_by(frame_model=frame_model, is_active='是').first()
+        # 检查商品存在（仅取主键列）
+        product = Product.query.with_entities(Product.frame_model).filter_by(frame_model=frame_model, is_active='是').first()
         if not product:
             return jsonify({'status': 'error', 'message': '商品不存在或未上架'}), 404
 
@@ -797,6 +1732,7 @@ def add_favorite():
             fav = Favorite(open_id=open_id, frame_model=frame_model, batch_id=batch_id, batch_time=batch_time)
             db.session.add(fav)
         db.session.commit()
+        _evict_favorite_counts(open_id)
         return jsonify({'status': 'success'})
     except Exception as e:
         db.session.rollback()
@@ -814,6 +1750,7 @@ def remove_favorite():
             return jsonify({'status': 'error', 'message': 'open_id and frame_model are required'}), 400
         Favorite.query.filter_by(open_id=open_id, frame_model=frame_model).delete()
         db.session.commit()
+        _evict_favorite_counts(open_id)
         return jsonify({'status': 'success'})
     except Exception as e:
         db.session.rollback()
@@ -867,6 +1804,9 @@ def upsert_user():
             if nickname is not None:
                 user.nickname = nickname
             if avatar_url is not None:
+                if avatar_url != user.avatar_url:
+                    # 头像改由客户端指定，来源地址不再对应当前头像
+                    user.avatar_source_url = None
                 user.avatar_url = avatar_url
             # 设置介绍人：只允许设置一次；若已存在且不同则拒绝覆盖；同值则幂等
             if referrer_open_id is not None:
@@ -1320,6 +2260,7 @@ def track_share_open():
             changed = True
         if changed:
             db.session.commit()
+            _evict_share_counts(rec.salesperson_open_id)
             try:
                 logger.info('shares.open updated share_id=%s customer=%s open_count=%s first_open_time=%s last_open_time=%s',
                             getattr(rec, 'id', None), customer_open_id, getattr(rec, 'open_count', None), getattr(rec, 'first_open_time', None), getattr(rec, 'last_open_time', None))
@@ -1380,6 +2321,7 @@ def track_share_open_by_dedup():
             changed = True
         if changed:
             db.session.commit()
+            _evict_share_counts(rec.salesperson_open_id)
             try:
                 logger.info('shares.open_by_dedup updated key=%r share_id=%s customer=%s open_count=%s first_open_time=%s last_open_time=%s',
                             dedup_key, getattr(rec, 'id', None), customer_open_id, getattr(rec, 'open_count', None), getattr(rec, 'first_open_time', None), getattr(rec, 'last_open_time', None))
@@ -1404,6 +2346,8 @@ def list_shares():
       - salesperson_open_id: 仅列出该销售发起的分享
       - customer_open_id: 仅列出被该客户打开过的分享
       - page, per_page: 分页
+      - cursor: 启用游标分页（按 id 倒序；首页传空串）
+      - include_total=exact|approx|none 总数计算方式（分页模式默认 exact，游标模式默认 none）
     """
     try:
         salesperson_open_id = (request.args.get('salesperson_open_id') or '').strip()
@@ -1428,7 +2372,16 @@ def list_shares():
             # customer_open_ids 中包含该客户；使用 LIKE 简单匹配（JSON 数组字符串），再在内存中过滤精确包含
             like = f"%{customer_open_id}%"
             q = q.filter(SalesShare.customer_open_ids.like(like))
-        items = paginate_query(q.order_by(SalesShare.id.desc()), page, per_page)
+        count_key = ('shares', salesperson_open_id, customer_open_id)
+        if _cursor_requested():
+            cp = keyset_paginate(q, SalesShare.id, request.args.get('cursor'), per_page, desc=True,
+                                 count=make_counter(_total_mode('none'), count_key, ttl=USER_COUNT_TTL))
+            data_items = [r.to_dict() for r in cp.items]
+            if customer_open_id:
+                data_items = [d for d in data_items if customer_open_id in (d.get('customer_open_ids') or [])]
+            return jsonify({'status': 'success', 'data': cp.to_payload(data_items)})
+        items = paginate_query(q.order_by(SalesShare.id.desc()), page, per_page,
+                               count=make_counter(_total_mode('exact'), count_key, ttl=USER_COUNT_TTL))
         data_items = [r.to_dict() for r in items.items]
         # 若使用 customer_open_id，需要精确过滤（避免 LIKE 误命中子串）
         if customer_open_id:
@@ -1444,6 +2397,8 @@ def list_shares():
             'pages': items.pages,
             'current_page': items.page
         }})
+    except InvalidCursor:
+        return jsonify({'status': 'error', 'message': 'invalid cursor'}), 400
     except Exception as e:
         return handle_error(e, 'Error listing shares')
 
@@ -1479,6 +2434,7 @@ def mark_share_sent():
         rec.sent_count = (rec.sent_count or 0) + 1
         rec.last_sent_time = now_cn()
         db.session.commit()
+        _evict_share_counts(rec.salesperson_open_id)
         try:
             logger.info('shares.mark_sent updated share_id=%s sent_count=%s last_sent_time=%s',
                         getattr(rec, 'id', None), getattr(rec, 'sent_count', None), getattr(rec, 'last_sent_time', None))
@@ -1544,6 +2500,7 @@ def add_favorites_batch():
             # 重置但传空列表：清空推荐
             Favorite.query.filter_by(open_id=open_id).delete(synchronize_session=False)
             db.session.commit()
+            _evict_favorite_counts(open_id)
             return jsonify({'status': 'success', 'data': {'added': 0, 'reset': True}})
         if not uniq:
             return jsonify({'status': 'success', 'data': {'added': 0, 'reset': False}})
@@ -1572,6 +2529,7 @@ def add_favorites_batch():
                 db.session.add(Favorite(open_id=open_id, frame_model=fm, batch_id=new_batch_id, batch_time=batch_time))
                 added += 1
         db.session.commit()
+        _evict_favorite_counts(open_id)
         return jsonify({'status': 'success', 'data': {'added': added, 'reset': bool(reset), 'batch_id': new_batch_id}})
     except Exception as e:
         db.session.rollback()
@@ -1597,6 +2555,24 @@ def admin_home():
                            ss_action=url_for('admin_sales_shares'))
 
 
+@app.route('/admin/cache_stats', methods=['GET'])
+def admin_cache_stats():
+    """进程内各缓存的容量与命中统计，以及各接口的响应压缩率与压缩 CPU 耗时（仅反映当前 worker 进程）。"""
+    resp = jsonify({'status': 'success', 'data': {
+        'pid': os.getpid(),
+        'caches': {name: c.stats() for name, c in CACHE_REGISTRY.items()},
+        'single_flight': query_flight.stats(),
+        'avatar_fetch': avatar_fetcher.stats(),
+        'compression': {
+            'enabled': bool(app.config.get('COMPRESS_ENABLED')),
+            'encodings': list(available_encodings()),
+            'endpoints': compression_stats.snapshot(),
+        },
+    }})
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
 @app.route('/admin/pageviews', methods=['GET'])
 def admin_pageviews():
     open_id = (request.args.get('open_id') or '').strip()
@@ -1714,8 +2690,9 @@ def admin_pageviews():
         # 推荐商品列表（去重、仅上架）
         try:
             subq = select(Favorite.frame_model).where(Favorite.open_id == open_id)
-            prods = Product.query.filter(Product.frame_model.in_(subq), Product.is_active == '是').all()
-            fav_products = [_serialize_product_with_public_images(p) for p in prods]
+            # 后台表格不展示图片：按卡片字段加载，且不收集图片
+            prods = _product_query(ProductView(None, 0)).filter(Product.frame_model.in_(subq), Product.is_active == '是').all()
+            fav_products = [_publicize_product_dict(p.to_dict(max_images=0)) for p in prods]
         except Exception:
             fav_products = []
         # 访问日志（最新 500 条）
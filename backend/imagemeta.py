@@ -0,0 +1,204 @@
+"""商品图片清单：每张本地图片的宽高（按 EXIF 方向校正）、字节数与极小占位图，离线预计算后写入 image_meta 表。
+
+商品输出的 image_meta 字段与 images 一一对应（未计算或外链图片为 null），小程序据此在图片下载前
+按宽高比预留版面并显示模糊占位图。
+- 占位图：长边 LQIP_SIZE 像素的 PNG，以 data URI 保存（约 200 字节），客户端无需解码库
+- 增量刷新：文件大小或修改时间变化才重新计算；全量刷新时顺带清理不再被上架商品引用的记录
+- 刷新有写入时递增 image_manifest_version，并把引用了变化图片的商品标记为已变更（目录版本号 +1），
+  片段/查询缓存随目录版本失效，变更流也会带出这些商品
+- 请求中只查进程内字典（ImageManifest），不访问文件系统；目录版本变化时读一次清单版本号，有变化才整表重载
+命令行：flask images manifest [--since 目录版本号] [--force] [--workers 4]；flask catalog import、
+flask images migrate-cas 之后自动为变更商品刷新。
+"""
+import io
+import json
+import time
+import base64
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from PIL import Image, ImageOps
+from sqlalchemy import select
+
+from models import db, Product, ImageMeta, CatalogMeta
+from catalog import IMAGE_MANIFEST_VERSION_KEY, bump_meta_version, mark_products_changed
+from thumbnails import images_cli, is_local_image
+
+logger = logging.getLogger(__name__)
+
+LQIP_SIZE = 8
+WRITE_BATCH = 1000
+_EXIF_ORIENTATION = 0x0112
+
+
+def probe_image(src: Path):
+    """读取一张图片的 (宽, 高, 占位图 data URI)。宽高为按 EXIF 方向校正后的显示尺寸。"""
+    with Image.open(src) as im:
+        width, height = im.size
+        if im.getexif().get(_EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        if im.format == 'JPEG':
+            # 解码阶段直接降采样，占位图只需要极小尺寸
+            im.draft('RGB', (LQIP_SIZE * 8, LQIP_SIZE * 8))
+        img = ImageOps.exif_transpose(im)
+        img.thumbnail((LQIP_SIZE, LQIP_SIZE), Image.BILINEAR)
+        if 'A' in img.getbands() or (img.mode == 'P' and 'transparency' in img.info):
+            # 透明背景按白底合成，与商品图常见底色一致
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        buf = io.BytesIO()
+        img.save(buf, 'PNG', optimize=True)
+    return width, height, 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def _referenced_paths(since: int = None) -> dict:
+    """上架商品（since 给定时为 row_version > since 的商品）引用的本地图片：{相对路径: [型号, ...]}。"""
+    cols = [Product.frame_model] + [getattr(Product, f'image{i}') for i in range(1, Product.IMAGE_SLOTS + 1)]
+    query = db.session.query(*cols).filter(Product.is_active == '是')
+    if since is not None:
+        query = query.filter(Product.row_version > since)
+    refs = {}
+    for row in query.yield_per(2000):
+        for p in row[1:]:
+            if is_local_image(p):
+                refs.setdefault(p, []).append(row[0])
+    return refs
+
+
+def _existing(paths=None) -> dict:
+    """已有清单记录：{相对路径: (file_size, mtime_ns)}；paths 为 None 时读取全部。"""
+    query = db.session.query(ImageMeta.path, ImageMeta.file_size, ImageMeta.mtime_ns)
+    if paths is None:
+        return {p: (s, m) for p, s, m in query.yield_per(5000)}
+    paths = list(paths)
+    out = {}
+    for k in range(0, len(paths), WRITE_BATCH):
+        for p, s, m in query.filter(ImageMeta.path.in_(paths[k:k + WRITE_BATCH])):
+            out[p] = (s, m)
+    return out
+
+
+def refresh_manifest(image_root, since: int = None, force: bool = False, workers: int = 4) -> dict:
+    """计算新增/变化图片的清单记录并写入 image_meta（一个事务），返回统计。单张失败只记录，不中断整体。"""
+    root = Path(image_root)
+    stats = {'referenced': 0, 'computed': 0, 'unchanged': 0, 'missing': 0, 'failed': 0, 'removed': 0}
+    t0 = time.perf_counter()
+    refs = _referenced_paths(since)
+    stats['referenced'] = len(refs)
+    existing = _existing(None if since is None else refs)
+    todo, gone = [], []
+    for path in refs:
+        try:
+            st = (root / path.replace('\\', '/').lstrip('/')).stat()
+        except OSError:
+            stats['missing'] += 1
+            if path in existing:
+                gone.append(path)
+            continue
+        if force or existing.get(path) != (st.st_size, st.st_mtime_ns):
+            todo.append((path, st))
+        else:
+            stats['unchanged'] += 1
+    if since is None:
+        # 全量刷新：清理不再被上架商品引用的记录
+        gone.extend(p for p in existing if p not in refs)
+
+    def _one(item):
+        path, st = item
+        try:
+            w, h, placeholder = probe_image(root / path.replace('\\', '/').lstrip('/'))
+        except Exception as e:
+            logger.warning('image manifest %s failed: %s', path, e)
+            return None
+        return {'path': path, 'width': w, 'height': h, 'file_size': st.st_size,
+                'mtime_ns': st.st_mtime_ns, 'placeholder': placeholder}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        rows = [r for r in pool.map(_one, todo) if r is not None]
+    stats['computed'] = len(rows)
+    stats['failed'] = len(todo) - len(rows)
+    stats['removed'] = len(gone)
+    if rows or gone:
+        try:
+            stale = gone + [r['path'] for r in rows]
+            for k in range(0, len(stale), WRITE_BATCH):
+                ImageMeta.query.filter(ImageMeta.path.in_(stale[k:k + WRITE_BATCH])).delete(synchronize_session=False)
+            for k in range(0, len(rows), WRITE_BATCH):
+                db.session.bulk_insert_mappings(ImageMeta, rows[k:k + WRITE_BATCH])
+            bump_meta_version(IMAGE_MANIFEST_VERSION_KEY)
+            changed = {m for p in stale for m in refs.get(p, ())}
+            stats['products_changed'] = len(changed)
+            stats['version'] = mark_products_changed(changed)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    stats['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    logger.info('image manifest refresh %s', stats)
+    return stats
+
+
+def refresh_product_manifest(since: int = None, force: bool = False, workers: int = 4) -> dict:
+    """按应用配置刷新商品图片清单（since 见 _referenced_paths）。"""
+    return refresh_manifest(current_app.config['IMAGE_SAVE_DIR'], since, force, workers)
+
+
+class ImageManifest:
+    """进程内图片清单：{相对路径: {'width', 'height', 'bytes', 'placeholder'}}，查找为一次字典访问。
+    entries(目录版本号) 在目录版本变化时读取一次清单版本号，清单有变化才整表重载（刷新会同时递增两者）。"""
+
+    def __init__(self):
+        self._entries = {}
+        self._version = None
+        self._catalog_version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._version = None
+        self._catalog_version = None
+
+    def _load(self, conn) -> dict:
+        t0 = time.perf_counter()
+        rows = conn.execute(select(ImageMeta.path, ImageMeta.width, ImageMeta.height,
+                                   ImageMeta.file_size, ImageMeta.placeholder))
+        entries = {p: {'width': w, 'height': h, 'bytes': s, 'placeholder': ph} for p, w, h, s, ph in rows}
+        logger.info('image manifest loaded entries=%s cost=%.1fms', len(entries), (time.perf_counter() - t0) * 1000)
+        return entries
+
+    def entries(self, catalog_version) -> dict:
+        if catalog_version == self._catalog_version:
+            return self._entries
+        with self._lock:
+            if catalog_version != self._catalog_version:
+                try:
+                    # 单独取一个连接读取，失败不影响（也不回滚）请求会话中的事务
+                    with db.engine.connect() as conn:
+                        version = conn.execute(select(CatalogMeta.value)
+                                               .where(CatalogMeta.key == IMAGE_MANIFEST_VERSION_KEY)).scalar() or 0
+                        if version != self._version:
+                            self._entries = self._load(conn)
+                            self._version = version
+                except Exception as e:
+                    # 表不存在等情况：沿用已有清单，记下本目录版本，下个目录版本再试
+                    logger.warning('image manifest load failed: %s', e)
+                self._catalog_version = catalog_version
+            return self._entries
+
+
+image_manifest = ImageManifest()
+
+
+@images_cli.command('manifest')
+@click.option('--since', type=int, default=None, help='只处理 row_version 大于该目录版本号的商品（不清理过期记录）')
+@click.option('--force', is_flag=True, help='忽略已有记录，全部重新计算')
+@click.option('--workers', type=int, default=4, help='并发线程数')
+def manifest_command(since, force, workers):
+    """计算上架商品本地图片的宽高、字节数与占位图，写入图片清单。"""
+    click.echo(json.dumps(refresh_product_manifest(since, force, workers), ensure_ascii=False))
@@ -0,0 +1,333 @@
+"""商品目录批量导入（flask catalog import 文件.csv|xlsx）。
+
+流程：
+1. 流式读取文件（CSV 逐行；xlsx 以只读模式逐行），表头可用字段名（frame_model）或列注释（镜架型号 / 镜片大小(mm)）；
+   只比较和写入文件中出现的列，未出现的列（如图片列）保持不变
+2. 一次查询读出现有商品的这些列，在内存中比对，只保留新增与有变化的行（数值按 RANGE_EPS 容差比较）
+3. 在同一事务内按批 executemany 写入：MySQL 用 INSERT ... ON DUPLICATE KEY UPDATE，SQLite 用 ON CONFLICT DO UPDATE，
+   其他数据库退化为 INSERT + UPDATE 两组 executemany；--deactivate-missing 时把文件中没有的上架商品置为下架
+4. 目录版本号 +1，写入行的 row_version 置为新版本号（出现在 /api/products/changes 中），
+   提交后增量刷新相似推荐，并在启用 IMAGE_DERIVATIVES_ENABLED 时为这些商品生成图片派生图
+xlsx 需要可选依赖 openpyxl（pip install openpyxl）。
+"""
+import csv
+import json
+import math
+import time
+import logging
+from operator import itemgetter
+from pathlib import Path
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, update, insert, select
+
+from models import db, Product
+from catalog import RANGE_EPS, bump_catalog_version
+
+try:
+    import openpyxl
+except ImportError:  # 可选依赖，仅 xlsx 需要
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH = 1000
+ACTIVE, INACTIVE = '是', '否'
+_ACTIVE_ALIASES = {'是': ACTIVE, '1': ACTIVE, 'true': ACTIVE, 'yes': ACTIVE, 'y': ACTIVE, '上架': ACTIVE,
+                   '否': INACTIVE, '0': INACTIVE, 'false': INACTIVE, 'no': INACTIVE, 'n': INACTIVE, '下架': INACTIVE}
+# 可导入的列：除 row_version（由导入过程维护）外的全部商品列
+IMPORT_COLUMNS = tuple(c.name for c in Product.__table__.columns if c.name != 'row_version')
+# 新增商品必须提供的列（非空且无默认值）
+REQUIRED_COLUMNS = tuple(c.name for c in Product.__table__.columns
+                         if c.name in IMPORT_COLUMNS and not c.nullable and c.default is None)
+# 非空且有默认值的列（is_active）：留空时新商品取默认值，已有商品保持现值
+INSERT_DEFAULTS = {c.name: c.default.arg for c in Product.__table__.columns
+                   if c.name in IMPORT_COLUMNS and not c.nullable and c.default is not None and c.default.is_scalar}
+
+
+class CatalogImportError(ValueError):
+    """导入文件整体不可用（缺少型号列、格式不支持等）。"""
+
+
+def _header_aliases() -> dict:
+    """表头别名 -> 列名：字段名、列注释、去掉单位后的列注释（"镜片大小(mm)" -> "镜片大小"），均忽略大小写与空白。"""
+    aliases = {}
+    for col in Product.__table__.columns:
+        if col.name not in IMPORT_COLUMNS:
+            continue
+        names = [col.name]
+        if col.comment:
+            names += [col.comment, col.comment.split('(')[0].split('（')[0]]
+        for n in names:
+            aliases[n.strip().lower()] = col.name
+    return aliases
+
+
+def _iter_rows(path: Path):
+    """逐行产出 (行号, [单元格值])，第一行为表头。"""
+    suffix = path.suffix.lower()
+    if suffix == '.csv':
+        with path.open('r', encoding='utf-8-sig', newline='') as f:
+            for lineno, row in enumerate(csv.reader(f), start=1):
+                yield lineno, row
+    elif suffix in ('.xlsx', '.xlsm'):
+        if openpyxl is None:
+            raise CatalogImportError('reading xlsx requires openpyxl (pip install openpyxl)')
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for lineno, row in enumerate(wb.active.iter_rows(values_only=True), start=1):
+                yield lineno, list(row)
+        finally:
+            wb.close()
+    else:
+        raise CatalogImportError(f'unsupported file type: {suffix or path.name}')
+
+
+FLOAT_COLUMNS = frozenset(c.name for c in Product.__table__.columns if isinstance(c.type, db.Float))
+
+
+def _parse_value(col, raw):
+    """把单元格值转换为列类型；空值返回 None，非法值抛 ValueError。"""
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = raw.strip()
+        if raw == '':
+            return None
+    if col in FLOAT_COLUMNS:
+        try:
+            v = float(raw)
+        except (TypeError, ValueError):
+            v = float('nan')
+        if not math.isfinite(v):
+            raise ValueError(f'invalid number for {col}: {raw!r}')
+        return v
+    if col == 'is_active':
+        v = _ACTIVE_ALIASES.get(str(raw).lower())
+        if v is None:
+            raise ValueError(f'invalid is_active: {raw!r}')
+        return v
+    if isinstance(raw, float) and raw.is_integer():
+        # xlsx 中的纯数字型号（如 1203）读出为 1203.0
+        raw = int(raw)
+    return str(raw)
+
+
+def _same(col, a, b) -> bool:
+    if a is None or b is None:
+        return a is b
+    if col in FLOAT_COLUMNS:
+        # FLOAT 列存储有单精度误差，按 RANGE_EPS / 相对误差容差比较
+        return abs(a - b) <= max(RANGE_EPS, 1e-6 * max(abs(a), abs(b)))
+    return a == b
+
+
+def read_import_file(path: Path):
+    """解析导入文件。返回 (columns, records, errors, duplicates)：
+    records 为 {frame_model: {列: 值}}（同一型号出现多次时以最后一行为准），errors 为 [(行号, 原因)]。
+    """
+    aliases = _header_aliases()
+    rows = _iter_rows(path)
+    try:
+        _, header = next(rows)
+    except StopIteration:
+        raise CatalogImportError('empty file')
+    columns = []
+    for pos, name in enumerate(header):
+        col = aliases.get(str(name or '').strip().lower())
+        if col is not None and col not in (c for _, c in columns):
+            columns.append((pos, col))
+    if 'frame_model' not in (c for _, c in columns):
+        raise CatalogImportError('missing frame_model column')
+
+    records, errors, duplicates = {}, [], 0
+    for lineno, row in rows:
+        if not any(v not in (None, '') for v in row):
+            continue
+        try:
+            rec = {col: _parse_value(col, row[pos] if pos < len(row) else None) for pos, col in columns}
+        except (TypeError, ValueError) as e:
+            errors.append((lineno, str(e)))
+            continue
+        model = rec['frame_model']
+        if not model:
+            errors.append((lineno, 'empty frame_model'))
+            continue
+        # 非空列留空：新商品视为错误或取默认值（在比对阶段处理），已有商品视为不修改该列
+        rec = {c: v for c, v in rec.items() if v is not None or (c not in REQUIRED_COLUMNS and c not in INSERT_DEFAULTS)}
+        if model in records:
+            duplicates += 1
+        records[model] = rec
+    # frame_model 排在首位（比对时以查询结果首列为键）
+    return sorted((c for _, c in columns), key=lambda c: c != 'frame_model'), records, errors, duplicates
+
+
+def diff_catalog(columns, records, deactivate_missing=False):
+    """与现有商品比对。返回 (inserts, updates, deactivate, unchanged, errors)；
+    updates 中留空的非空列以现值补齐，使每行的列集合与文件表头一致（同批 executemany 的前提）。"""
+    table = Product.__table__
+    cols = [table.c[c] for c in columns]
+    if 'is_active' not in columns:
+        cols.append(table.c.is_active)
+    n = len(columns)
+    active_pos = len(cols) - 1 if 'is_active' not in columns else columns.index('is_active')
+    # Core 查询直接取元组，避免 ORM 逐行构造开销
+    current = {row[0]: tuple(row) for row in db.session.connection().execute(select(*cols))}
+    pick = itemgetter(*columns) if n > 1 else (lambda r: (r[columns[0]],))
+
+    inserts, updates, errors = [], [], []
+    unchanged = 0
+    for model, rec in records.items():
+        cur = current.get(model)
+        if cur is None:
+            missing = [c for c in REQUIRED_COLUMNS if rec.get(c) is None]
+            if missing:
+                errors.append((model, 'missing required columns: ' + ','.join(missing)))
+                continue
+            defaults = {c: v for c, v in INSERT_DEFAULTS.items() if c in columns and c not in rec}
+            inserts.append(dict(rec, **defaults) if defaults else rec)
+            continue
+        if len(rec) == n:
+            vals = pick(rec)
+        else:
+            vals = tuple(rec[c] if c in rec else cur[i] for i, c in enumerate(columns))
+        # 先整行精确比较（绝大多数未变化的行在此返回），不等时再逐列按容差比较
+        if vals == cur[:n] or all(_same(c, v, w) for c, v, w in zip(columns, vals, cur)):
+            unchanged += 1
+        else:
+            updates.append(dict(zip(columns, vals)))
+    deactivate = []
+    if deactivate_missing:
+        deactivate = [m for m, cur in current.items() if cur[active_pos] == ACTIVE and m not in records]
+    return inserts, updates, deactivate, unchanged, errors
+
+
+def _upsert_stmt(columns):
+    """按方言构造 INSERT ... 冲突时更新 语句（executemany 时驱动可合并为多行 VALUES）；不支持时返回 None。"""
+    dialect = db.engine.dialect.name
+    set_cols = [c for c in columns if c != 'frame_model'] + ['row_version']
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(Product.__table__)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in set_cols})
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(Product.__table__)
+        return stmt.on_conflict_do_update(index_elements=['frame_model'],
+                                          set_={c: stmt.excluded[c] for c in set_cols})
+    return None
+
+
+def _executemany(stmt, rows):
+    for k in range(0, len(rows), WRITE_BATCH):
+        db.session.execute(stmt, rows[k:k + WRITE_BATCH])
+
+
+def apply_changes(columns, inserts, updates, deactivate) -> int:
+    """在当前事务中写入变更（调用方提交）。返回新的目录版本号。"""
+    version = bump_catalog_version()
+    columns = list(columns)
+    table = Product.__table__
+    # INSERT ... 冲突更新 的插入部分同样受非空约束检查，文件缺少必填列时只能逐行 UPDATE（此时也不会有新增行）
+    upsert = _upsert_stmt(columns) if set(REQUIRED_COLUMNS).issubset(columns) else None
+    if upsert is not None and 'is_active' in columns:
+        # 新增与更新同为一条语句：批量 executemany，驱动可合并为多行 VALUES
+        _executemany(upsert, [dict(r, row_version=version) for r in inserts + updates])
+    else:
+        # 文件不含 is_active 时新增行需要默认值（上架）而更新行不能覆盖它，分两组执行
+        if inserts:
+            _executemany(insert(table), [dict({c: r.get(c) for c in columns}, is_active=r.get('is_active', ACTIVE),
+                                              row_version=version) for r in inserts])
+        if updates and upsert is not None:
+            _executemany(upsert, [dict(r, row_version=version) for r in updates])
+        elif updates:
+            set_cols = [c for c in columns if c != 'frame_model']
+            stmt = (update(table)
+                    .where(table.c.frame_model == bindparam('_pk'))
+                    .values({c: bindparam(c) for c in set_cols + ['row_version']}))
+            _executemany(stmt, [dict({c: r[c] for c in set_cols}, _pk=r['frame_model'], row_version=version)
+                                for r in updates])
+    if deactivate:
+        stmt = (update(table)
+                .where(table.c.frame_model == bindparam('_pk'))
+                .values(is_active=INACTIVE, row_version=version))
+        _executemany(stmt, [{'_pk': m} for m in deactivate])
+    return version
+
+
+def import_catalog(path, deactivate_missing=False, dry_run=False) -> dict:
+    """导入商品文件并返回统计；任何写入错误都会回滚整个导入。"""
+    path = Path(path)
+    stats = {'file': str(path)}
+    t0 = time.perf_counter()
+    columns, records, errors, duplicates = read_import_file(path)
+    t1 = time.perf_counter()
+    inserts, updates, deactivate, unchanged, diff_errors = diff_catalog(columns, records, deactivate_missing)
+    t2 = time.perf_counter()
+    stats.update(columns=columns, rows=len(records), duplicates=duplicates,
+                 inserted=len(inserts), updated=len(updates), deactivated=len(deactivate), unchanged=unchanged,
+                 invalid=len(errors) + len(diff_errors),
+                 errors=[{'line': ln, 'error': msg} for ln, msg in errors[:20]]
+                 + [{'frame_model': m, 'error': msg} for m, msg in diff_errors[:20]])
+    version = None
+    if not dry_run and (inserts or updates or deactivate):
+        try:
+            version = apply_changes(columns, inserts, updates, deactivate)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    t3 = time.perf_counter()
+    stats.update(version=version, dry_run=dry_run, ms={
+        'read': round((t1 - t0) * 1000, 1),
+        'diff': round((t2 - t1) * 1000, 1),
+        'write': round((t3 - t2) * 1000, 1),
+    })
+    logger.info('catalog import %s', {k: v for k, v in stats.items() if k != 'errors'})
+    return stats
+
+
+catalog_cli = AppGroup('catalog', help='商品目录维护')
+
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--deactivate-missing', is_flag=True, help='将文件中没有的上架商品置为下架（文件须为完整目录）')
+@click.option('--dry-run', is_flag=True, help='只比对并输出统计，不写入')
+@click.option('--skip-similar', is_flag=True, help='导入后不刷新相似推荐')
+@click.option('--skip-images', is_flag=True, help='导入后不生成图片派生图与图片清单')
+def import_command(path, deactivate_missing, dry_run, skip_similar, skip_images):
+    """导入 CSV / xlsx 商品文件，只写入新增与变化的行。"""
+    try:
+        stats = import_catalog(path, deactivate_missing=deactivate_missing, dry_run=dry_run)
+    except CatalogImportError as e:
+        raise click.ClickException(str(e))
+    if stats['version'] is not None and not skip_similar:
+        from similar import refresh_similar, DEFAULT_TOP_K
+        try:
+            k = int(current_app.config.get('SIMILAR_TOP_K', DEFAULT_TOP_K))
+            stats['similar'] = refresh_similar(k)
+        except Exception as e:
+            # 相似推荐可稍后用 flask similar refresh 补算，不影响已提交的导入
+            logger.warning('similar refresh after import failed: %s', e)
+            stats['similar'] = {'error': str(e)}
+    if stats['version'] is not None and not skip_images and current_app.config.get('IMAGE_DERIVATIVES_ENABLED'):
+        from thumbnails import derive_product_images
+        try:
+            # 只处理本次导入写入的商品（row_version 为新版本号）
+            stats['images'] = derive_product_images(since=stats['version'] - 1)
+        except Exception as e:
+            # 可稍后用 flask images derive 补生成
+            logger.warning('image derivatives after import failed: %s', e)
+            stats['images'] = {'error': str(e)}
+    if stats['version'] is not None and not skip_images and current_app.config.get('IMAGE_MANIFEST_ENABLED'):
+        from imagemeta import refresh_product_manifest
+        try:
+            stats['manifest'] = refresh_product_manifest(since=stats['version'] - 1)
+        except Exception as e:
+            # 可稍后用 flask images manifest 补算
+            logger.warning('image manifest after import failed: %s', e)
+            stats['manifest'] = {'error': str(e)}
+    click.echo(json.dumps(stats, ensure_ascii=False))
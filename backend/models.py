@@ -37,30 +37,50 @@ class Product(db.Model):
     brand = db.Column(db.String(100), nullable=True, comment='所属品牌')
     frame_thickness = db.Column(db.Float, nullable=True, comment='包边厚度(mm)')
     notes = db.Column(db.String(500), nullable=True, comment='备注信息')
-    
-    def to_dict(self):
-        result = {
-            'frame_model': self.frame_model,
-            'lens_size': self.lens_size,
-            'nose_bridge_width': self.nose_bridge_width,
-            'temple_length': self.temple_length,
-            'frame_total_length': self.frame_total_length,
-            'frame_height': self.frame_height,
-            'frame_material': self.frame_material,
-            'weight': self.weight,
-            'price': self.price,
-            'brand': self.brand,
-            'frame_thickness': self.frame_thickness,
-            'notes': self.notes,
-            'images': []
-        }
-        
-        # 收集所有非空图片
-        for i in range(1, 16):
-            image = getattr(self, f'image{i}')
-            if image:
-                # 拼接为完整 URL
-                result['images'].append(f"{image}")
+    # 最后一次变更时的目录版本号（catalog.mark_products_changed 写入），供变更流 /api/products/changes 增量读取
+    row_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0', comment='变更版本号')
+
+    # 列表排序（sort=price 等）复合索引：等值过滤 is_active 后按 (列, frame_model) 有序读取，分页无需 filesort
+    __table_args__ = (
+        db.Index('ix_products_active_price', 'is_active', 'price', 'frame_model'),
+        db.Index('ix_products_active_weight', 'is_active', 'weight', 'frame_model'),
+        db.Index('ix_products_active_lens_size', 'is_active', 'lens_size', 'frame_model'),
+        db.Index('ix_products_row_version', 'row_version', 'frame_model'),
+    )
+
+    IMAGE_SLOTS = 15
+    # 对外输出字段（?fields= 白名单）；images 对应 image1..image{max_images} 中的非空值
+    PUBLIC_FIELDS = (
+        'frame_model', 'lens_size', 'nose_bridge_width', 'temple_length', 'frame_total_length',
+        'frame_height', 'frame_material', 'weight', 'price', 'brand', 'frame_thickness', 'notes', 'images',
+    )
+
+    @classmethod
+    def load_columns(cls, fields=None, max_images=IMAGE_SLOTS):
+        """to_dict(max_images, fields) 实际读取的列名，配合 load_only 使用（主键 frame_model 始终包含）。"""
+        fields = cls.PUBLIC_FIELDS if fields is None else fields
+        cols = ['frame_model'] + [f for f in fields if f not in ('frame_model', 'images')]
+        if 'images' in fields:
+            cols += [f'image{i}' for i in range(1, max_images + 1)]
+        return tuple(cols)
+
+    def to_dict(self, max_images=IMAGE_SLOTS, fields=None):
+        """max_images: 仅收集 image1..image{max_images}；fields: 仅输出这些字段（frame_model 始终输出）。
+        只访问 load_columns(fields, max_images) 中的列，按其 load_only 加载的对象不会触发延迟加载。
+        """
+        fields = self.PUBLIC_FIELDS if fields is None else fields
+        result = {'frame_model': self.frame_model}
+        for name in fields:
+            if name != 'images':
+                result[name] = getattr(self, name)
+
+        if 'images' in fields:
+            # 收集所有非空图片
+            result['images'] = []
+            for i in range(1, max_images + 1):
+                image = getattr(self, f'image{i}')
+                if image:
+                    result['images'].append(f"{image}")
         return result
 
 
@@ -71,6 +91,8 @@ class User(db.Model):
     open_id = db.Column(db.String(64), primary_key=True, comment='微信 open_id')
     nickname = db.Column(db.String(100), nullable=True, comment='昵称')
     avatar_url = db.Column(db.String(255), nullable=True, comment='头像 URL')
+    # 当前头像的来源地址（远程抓取的微信头像 URL）；来源未变时不再重复下载，头像被其他途径修改时清空
+    avatar_source_url = db.Column(db.String(512), nullable=True, comment='头像来源 URL')
     # 介绍人 open_id，可为空
     referrer_open_id = db.Column(db.String(64), nullable=True, index=True, comment='介绍人 open_id')
     # 我的销售 open_id，可为空
@@ -215,4 +237,45 @@ class SalesShare(db.Model):
             'sent_count': self.sent_count,
             'last_sent_time': self.last_sent_time.isoformat() if self.last_sent_time else None,
             'note': self.note,
-        }
\ No newline at end of file
+        }
+
+class CatalogMeta(db.Model):
+    """目录元数据（键值计数器）。
+    - catalog_version: 商品目录版本号，任何批量/后台修改商品后递增，
+      供进程内目录缓存判断是否需要重新加载。
+    - image_manifest_version: 图片清单（image_meta）版本号，供进程内清单判断是否需要重新加载。
+    """
+    __tablename__ = 'catalog_meta'
+
+    key = db.Column(db.String(64), primary_key=True, comment='元数据键')
+    value = db.Column(db.BigInteger, nullable=False, default=0, comment='计数值')
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class ProductSimilar(db.Model):
+    """相似镜架预计算结果（离线批量计算，见 similar.py）：每个上架型号一行，按主键一次读取。
+    - items: 按得分降序的 JSON 数组 [[frame_model, score], ...]
+    - fingerprint: 参与相似度计算的字段摘要，增量刷新时据此判断商品是否变化
+    """
+    __tablename__ = 'product_similar'
+
+    frame_model = db.Column(db.String(100), primary_key=True, comment='镜架型号')
+    items = db.Column(db.Text, nullable=False, comment='相似型号及得分（JSON）')
+    fingerprint = db.Column(db.String(40), nullable=False, comment='相似度特征摘要')
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class ImageMeta(db.Model):
+    """商品图片清单（离线预计算，见 imagemeta.py）：每个本地图片相对路径一行。
+    - file_size / mtime_ns: 计算时的文件大小与修改时间，增量刷新时据此判断文件是否变化
+    - placeholder: 极小尺寸 PNG 的 data URI，图片下载完成前作为模糊占位
+    """
+    __tablename__ = 'image_meta'
+
+    path = db.Column(db.String(255), primary_key=True, comment='图片相对路径')
+    width = db.Column(db.Integer, nullable=False, comment='宽（按 EXIF 方向校正后）')
+    height = db.Column(db.Integer, nullable=False, comment='高（按 EXIF 方向校正后）')
+    file_size = db.Column(db.BigInteger, nullable=False, comment='文件字节数')
+    mtime_ns = db.Column(db.BigInteger, nullable=False, comment='文件修改时间（纳秒）')
+    placeholder = db.Column(db.String(1024), nullable=True, comment='占位图 data URI')
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -0,0 +1,341 @@
+"""相似镜架推荐的离线预计算。
+
+"相似"首先要求佩戴尺寸接近：五个镜架尺寸按 SCALES 归一后的欧氏距离 d <= 1 的商品才参与排序，
+再按以下四项的加权和排序（权重见 WEIGHTS）：
+- 尺寸：1 - d
+- 材质：'+' 分隔的材质标签集合的 Jaccard 系数
+- 品牌：相同（忽略大小写，空值/占位文本不算）记 1
+- 价格：1 - |p1 - p2| / max(p1, p2)
+尺寸网格每格边长为一个归一单位，距离 <= 1 的商品必然落在相邻的 3^5 个格子内，因此只需比较网格邻域，
+结果与两两全量比较一致，且避免了 O(n^2) 的计算量。
+
+结果写入 product_similar 表（每个型号一行），/api/products/<frame_model>/similar 按主键一次读取。
+- rebuild：全量重算并整表替换
+- refresh：按特征摘要（fingerprint）找出新增/变化/下架的商品，只重算受影响的型号：
+  变化商品本身、其网格邻域内的商品（距离关系对称），以及已存结果引用了变化/下架型号的商品。
+命令行：flask similar rebuild | refresh | bench --size 50000
+"""
+import json
+import math
+import time
+import heapq
+import random
+import hashlib
+import logging
+from itertools import product as cartesian
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models import db, Product, ProductSimilar
+from catalog import FIT_FIELDS, PLACEHOLDER_TEXTS, _material_tags
+
+logger = logging.getLogger(__name__)
+
+# 各尺寸维度的归一单位（mm）：归一后总距离不超过 1 视为佩戴尺寸接近
+SCALES = {
+    'lens_size': 2.0,
+    'nose_bridge_width': 1.5,
+    'temple_length': 5.0,
+    'frame_total_length': 4.0,
+    'frame_height': 3.0,
+}
+WEIGHTS = {'dims': 0.5, 'material': 0.2, 'brand': 0.1, 'price': 0.2}
+DEFAULT_TOP_K = 12
+# 批量写入每批行数
+WRITE_BATCH = 1000
+# 变化商品占比超过该值时，增量刷新直接转为全量重算
+REFRESH_FULL_RATIO = 0.3
+
+# 特征行：(frame_model, 五个尺寸..., frame_material, brand, price)
+FEATURE_COLUMNS = ('frame_model',) + FIT_FIELDS + ('frame_material', 'brand', 'price')
+_NDIM = len(FIT_FIELDS)
+_NEIGHBOR_OFFSETS = list(cartesian((-1, 0, 1), repeat=_NDIM))
+
+
+def _jaccard(a, b) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def load_features():
+    """读取全部上架商品的特征行（只查询 FEATURE_COLUMNS），按型号升序。"""
+    cols = [getattr(Product, c) for c in FEATURE_COLUMNS]
+    q = db.session.query(*cols).filter(Product.is_active == '是').order_by(Product.frame_model.asc())
+    return [tuple(r) for r in q.all()]
+
+
+def fingerprint(row) -> str:
+    """特征行中除型号外各字段的摘要；任一参与计算的字段变化都会改变摘要。"""
+    return hashlib.sha1(json.dumps(row[1:], ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class SimilarityIndex:
+    """一批特征行上的相似度计算结构：归一坐标、材质相似度矩阵、品牌编码与尺寸网格。"""
+
+    def __init__(self, rows):
+        self.models = [r[0] for r in rows]
+        self.position = {m: i for i, m in enumerate(self.models)}
+        scales = [SCALES[f] for f in FIT_FIELDS]
+        self.coords = [tuple(float(r[1 + d] or 0.0) / scales[d] for d in range(_NDIM)) for r in rows]
+        self.prices = [float(r[_NDIM + 3] or 0.0) for r in rows]
+
+        # 材质驻留为编码，两两 Jaccard 预先算成矩阵（不同材质写法通常只有几十种）
+        mat_code, mat_tags = {}, []
+        self.mats = []
+        for r in rows:
+            m = r[_NDIM + 1] or ''
+            code = mat_code.get(m)
+            if code is None:
+                code = mat_code[m] = len(mat_tags)
+                mat_tags.append({k for k, _ in _material_tags(m)})
+            self.mats.append(code)
+        self.mat_sim = [[_jaccard(a, b) for b in mat_tags] for a in mat_tags]
+
+        # 品牌编码；空值/占位文本给唯一负编码，不与任何商品相同
+        brand_code = {}
+        self.brands = []
+        for i, r in enumerate(rows):
+            b = (r[_NDIM + 2] or '').strip().lower()
+            if not b or b in PLACEHOLDER_TEXTS:
+                self.brands.append(-1 - i)
+            else:
+                self.brands.append(brand_code.setdefault(b, len(brand_code)))
+
+        self.cell_of = [tuple(math.floor(x) for x in c) for c in self.coords]
+        self.cells = {}
+        for i, cell in enumerate(self.cell_of):
+            self.cells.setdefault(cell, []).append(i)
+        # 同一格子内的商品共用候选列表
+        self._cand = {}
+
+    def neighborhood(self, cell):
+        """与 cell 每维相差不超过一格的全部商品下标（同一格子内的商品共用）。"""
+        out = self._cand.get(cell)
+        if out is None:
+            cells = self.cells
+            out = []
+            for off in _NEIGHBOR_OFFSETS:
+                members = cells.get(tuple(a + b for a, b in zip(cell, off)))
+                if members:
+                    out.extend(members)
+            self._cand[cell] = out
+        return out
+
+    def top_k(self, i: int, k: int):
+        """商品 i 的前 k 个相似商品：[(frame_model, score), ...]，得分降序，同分按型号升序。
+        尺寸距离超过 1 的商品不计入，因此尺寸独特的商品可能少于 k 个。"""
+        # 尺寸维度固定为五个（FIT_FIELDS），展开计算以减少解释器开销
+        x0, x1, x2, x3, x4 = self.coords[i]
+        msim = self.mat_sim[self.mats[i]]
+        bi = self.brands[i]
+        pi = self.prices[i]
+        coords, mats, brands, prices = self.coords, self.mats, self.brands, self.prices
+        wd, wm, wb, wp = WEIGHTS['dims'], WEIGHTS['material'], WEIGHTS['brand'], WEIGHTS['price']
+        sqrt = math.sqrt
+        scored = []
+        for j in self.neighborhood(self.cell_of[i]):
+            y0, y1, y2, y3, y4 = coords[j]
+            d0, d1, d2, d3, d4 = x0 - y0, x1 - y1, x2 - y2, x3 - y3, x4 - y4
+            dist2 = d0 * d0 + d1 * d1 + d2 * d2 + d3 * d3 + d4 * d4
+            if dist2 > 1.0 or j == i:
+                continue
+            s = wd * (1.0 - sqrt(dist2)) + wm * msim[mats[j]]
+            if brands[j] == bi:
+                s += wb
+            pj = prices[j]
+            hi = pi if pi > pj else pj
+            s += wp * (1.0 - abs(pi - pj) / hi) if hi > 0 else wp
+            scored.append((s, -j))
+        models = self.models
+        return [(models[-nj], round(s, 4)) for s, nj in heapq.nlargest(k, scored)]
+
+    def compute(self, indices, k: int) -> dict:
+        return {self.models[i]: self.top_k(i, k) for i in indices}
+
+    def compute_all(self, k: int) -> dict:
+        """全部商品的 top_k 结果（与逐个调用 top_k 一致）。相似度对称，按"格子对"遍历使每对商品只计算一次，
+        得分同时写入双方容量为 k 的小顶堆，全量重算耗时约为逐个计算的一半。"""
+        coords, mats, brands, prices, mat_sim = self.coords, self.mats, self.brands, self.prices, self.mat_sim
+        wd, wm, wb, wp = WEIGHTS['dims'], WEIGHTS['material'], WEIGHTS['brand'], WEIGHTS['price']
+        sqrt, push, pushpop = math.sqrt, heapq.heappush, heapq.heappushpop
+        heaps = [[] for _ in coords]
+
+        def offer(h, item):
+            if len(h) < k:
+                push(h, item)
+            elif item > h[0]:
+                pushpop(h, item)
+
+        cells = self.cells
+        for cell, members in cells.items():
+            for off in _NEIGHBOR_OFFSETS:
+                other = tuple(a + b for a, b in zip(cell, off))
+                # 每对格子只处理一次（同一格子内按下标去重）
+                if other < cell:
+                    continue
+                others = cells.get(other)
+                if not others:
+                    continue
+                same = other == cell
+                for i in members:
+                    x0, x1, x2, x3, x4 = coords[i]
+                    msim = mat_sim[mats[i]]
+                    bi, pi, heap_i = brands[i], prices[i], heaps[i]
+                    for j in others:
+                        if same and j <= i:
+                            continue
+                        y0, y1, y2, y3, y4 = coords[j]
+                        d0, d1, d2, d3, d4 = x0 - y0, x1 - y1, x2 - y2, x3 - y3, x4 - y4
+                        dist2 = d0 * d0 + d1 * d1 + d2 * d2 + d3 * d3 + d4 * d4
+                        if dist2 > 1.0:
+                            continue
+                        s = wd * (1.0 - sqrt(dist2)) + wm * msim[mats[j]]
+                        if brands[j] == bi:
+                            s += wb
+                        pj = prices[j]
+                        hi = pi if pi > pj else pj
+                        s += wp * (1.0 - abs(pi - pj) / hi) if hi > 0 else wp
+                        offer(heap_i, (s, -j))
+                        offer(heaps[j], (s, -i))
+        models = self.models
+        return {models[i]: [(models[-nj], round(s, 4)) for s, nj in sorted(h, reverse=True)]
+                for i, h in enumerate(heaps)}
+
+
+def _write(results: dict, fps: dict, delete_models=None):
+    """写入结果：delete_models 为 None 时整表替换，否则先删除这些型号的旧行。调用方提交事务。"""
+    if delete_models is None:
+        ProductSimilar.query.delete(synchronize_session=False)
+    else:
+        delete_models = list(delete_models)
+        for k in range(0, len(delete_models), WRITE_BATCH):
+            chunk = delete_models[k:k + WRITE_BATCH]
+            ProductSimilar.query.filter(ProductSimilar.frame_model.in_(chunk)).delete(synchronize_session=False)
+    rows = [{
+        'frame_model': m,
+        'items': json.dumps(items, ensure_ascii=False, separators=(',', ':')),
+        'fingerprint': fps[m],
+    } for m, items in results.items()]
+    for k in range(0, len(rows), WRITE_BATCH):
+        db.session.bulk_insert_mappings(ProductSimilar, rows[k:k + WRITE_BATCH])
+
+
+def rebuild_similar(k: int = DEFAULT_TOP_K, rows=None) -> dict:
+    """全量重算全部上架商品的相似列表并替换 product_similar。返回各阶段耗时统计。"""
+    stats = {'mode': 'rebuild'}
+    t0 = time.perf_counter()
+    if rows is None:
+        rows = load_features()
+    t1 = time.perf_counter()
+    index = SimilarityIndex(rows)
+    t2 = time.perf_counter()
+    results = index.compute_all(k)
+    t3 = time.perf_counter()
+    try:
+        _write(results, {r[0]: fingerprint(r) for r in rows})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    t4 = time.perf_counter()
+    stats.update(products=len(rows), written=len(results), cells=len(index.cells),
+                 load_ms=round((t1 - t0) * 1000, 1), index_ms=round((t2 - t1) * 1000, 1),
+                 score_ms=round((t3 - t2) * 1000, 1), write_ms=round((t4 - t3) * 1000, 1))
+    logger.info('similar rebuild %s', stats)
+    return stats
+
+
+def refresh_similar(k: int = DEFAULT_TOP_K) -> dict:
+    """增量刷新：只重算新增/变化商品及受其影响的型号，删除已下架型号的结果。"""
+    t0 = time.perf_counter()
+    rows = load_features()
+    fps = {r[0]: fingerprint(r) for r in rows}
+    stored = {m: (fp, items) for m, fp, items in
+              db.session.query(ProductSimilar.frame_model, ProductSimilar.fingerprint, ProductSimilar.items)}
+    changed = [m for m, fp in fps.items() if stored.get(m, (None,))[0] != fp]
+    removed = [m for m in stored if m not in fps]
+    stats = {'mode': 'refresh', 'products': len(rows), 'changed': len(changed), 'removed': len(removed)}
+    if not changed and not removed:
+        stats.update(written=0, total_ms=round((time.perf_counter() - t0) * 1000, 1))
+        return stats
+    if len(changed) + len(removed) > REFRESH_FULL_RATIO * max(len(rows), 1):
+        return dict(rebuild_similar(k, rows), changed=len(changed), removed=len(removed))
+
+    index = SimilarityIndex(rows)
+    affected = set(changed)
+    for m in changed:
+        cell = index.cell_of[index.position[m]]
+        affected.update(index.models[j] for j in index.neighborhood(cell))
+    dirty = set(changed) | set(removed)
+    for m, (_, items) in stored.items():
+        if m in fps and m not in affected and any(x[0] in dirty for x in json.loads(items)):
+            affected.add(m)
+    results = index.compute((index.position[m] for m in sorted(affected)), k)
+    try:
+        _write(results, fps, delete_models=affected | set(removed))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    stats.update(written=len(results), total_ms=round((time.perf_counter() - t0) * 1000, 1))
+    logger.info('similar refresh %s', stats)
+    return stats
+
+
+def synthetic_rows(size: int, seed: int = 1):
+    """生成合成目录特征行（尺寸分布接近真实镜架），用于 bench 计时。"""
+    rnd = random.Random(seed)
+    mats = ['TR', '钛', 'B钛', '板材', '金属', 'TR+钛', 'TR+B钛', '板材+金属', '纯钛', '合金+板材']
+    brands = [f'brand{b}' for b in range(200)] + [None]
+    rows = []
+    for i in range(size):
+        lens = rnd.choice(range(44, 59)) + rnd.choice((0, 0, 0.5))
+        bridge = rnd.randint(14, 22)
+        rows.append((f'SYN{i:06d}', lens, bridge, rnd.choice((135, 138, 140, 142, 145, 148, 150)),
+                     2 * lens + bridge + rnd.randint(6, 14), rnd.randint(30, 55),
+                     rnd.choice(mats), rnd.choice(brands), rnd.choice((99, 199, 299, 399, 599, 899, 1299))))
+    return rows
+
+
+similar_cli = AppGroup('similar', help='相似镜架推荐预计算（product_similar 表）')
+
+
+def _top_k(k):
+    return k or int(current_app.config.get('SIMILAR_TOP_K', DEFAULT_TOP_K))
+
+
+@similar_cli.command('rebuild')
+@click.option('--k', type=int, default=None, help='每个型号保留的相似商品数（默认 SIMILAR_TOP_K）')
+def rebuild_command(k):
+    """全量重算并替换相似推荐表。"""
+    click.echo(json.dumps(rebuild_similar(_top_k(k)), ensure_ascii=False))
+
+
+@similar_cli.command('refresh')
+@click.option('--k', type=int, default=None, help='每个型号保留的相似商品数（默认 SIMILAR_TOP_K）')
+def refresh_command(k):
+    """增量刷新：只重算变化商品及其影响范围。"""
+    click.echo(json.dumps(refresh_similar(_top_k(k)), ensure_ascii=False))
+
+
+@similar_cli.command('bench')
+@click.option('--size', type=int, default=50000, help='合成商品数')
+@click.option('--k', type=int, default=DEFAULT_TOP_K)
+@click.option('--seed', type=int, default=1)
+def bench_command(size, k, seed):
+    """在合成目录上计时全量计算（不读写数据库）。"""
+    rows = synthetic_rows(size, seed)
+    t0 = time.perf_counter()
+    index = SimilarityIndex(rows)
+    t1 = time.perf_counter()
+    index.compute_all(k)
+    t2 = time.perf_counter()
+    cand = [len(index.neighborhood(index.cell_of[i])) for i in range(0, len(rows), max(1, len(rows) // 1000))]
+    click.echo(json.dumps({
+        'products': size, 'k': k, 'cells': len(index.cells),
+        'avg_candidates': round(sum(cand) / len(cand), 1) if cand else 0,
+        'index_ms': round((t1 - t0) * 1000, 1), 'score_ms': round((t2 - t1) * 1000, 1),
+    }))
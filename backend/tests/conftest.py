@@ -0,0 +1,63 @@
+"""测试环境：临时 SQLite 数据库与图片目录；每个用例前重建数据表并清空进程内缓存。
+
+运行：cd backend && python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_TMP = tempfile.mkdtemp(prefix='eyewear-test-')
+os.environ['DATABASE_URL'] = f'sqlite:///{_TMP}/test.db'
+os.environ['IMAGE_SAVE_DIR'] = os.path.join(_TMP, 'images')
+os.environ.setdefault('AUTO_CREATE_DB', '1')
+
+import config  # noqa: E402
+
+# SQLite 不支持连接池参数（pool_size / max_overflow）
+config.Config.SQLALCHEMY_ENGINE_OPTIONS = {}
+
+import eyewear_app  # noqa: E402
+from catalog import catalog  # noqa: E402
+from imagemeta import image_manifest  # noqa: E402
+from models import db, Product  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app = eyewear_app.app
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    for cache in eyewear_app.CACHE_REGISTRY.values():
+        cache.clear()
+    catalog.invalidate()
+    image_manifest.invalidate()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_product(i: int, **overrides) -> Product:
+    """构造一个上架商品：数值字段按序号变化，便于过滤与排序断言。"""
+    mats = ['TR', '钛', 'B钛', '板材', '金属', 'TR+钛', 'TR+B钛', '板材+金属']
+    brands = ['Ray', 'Oakley', '暴龙', None]
+    fields = dict(
+        frame_model=f'M{i:04d}', is_active='是',
+        lens_size=(48, 50, 52, 54)[i % 4], nose_bridge_width=(16, 17, 18)[i % 3],
+        temple_length=(135, 140, 145)[i % 3], frame_total_length=125 + i % 20, frame_height=35 + i % 15,
+        frame_material=mats[i % len(mats)], weight=round(8 + (i * 7) % 22 + 0.5, 1),
+        price=(199, 299, 399, 599, 899)[i % 5], brand=brands[i % len(brands)],
+        image1=f'{i}_1.jpg',
+    )
+    fields.update(overrides)
+    return Product(**fields)
@@ -0,0 +1,58 @@
+"""条件请求：304 响应的 ETag 形式（强/弱）须与对应的 200 响应一致。"""
+import pytest
+
+import eyewear_app
+from models import db
+from conftest import make_product
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture
+def compressing(app):
+    app.config.update(COMPRESS_ENABLED=True, COMPRESS_MIN_SIZE=1024)
+    with app.app_context():
+        db.session.add_all([make_product(i) for i in range(60)])
+        db.session.commit()
+    return app
+
+
+def _revalidate(client, url, etag, headers=GZIP):
+    return client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+
+
+def test_small_response_keeps_strong_etag_on_304(compressing, client):
+    r = client.get('/api/system/config', headers=GZIP)
+    assert 'Content-Encoding' not in r.headers
+    assert not r.headers['ETag'].startswith('W/')
+    r2 = _revalidate(client, '/api/system/config', r.headers['ETag'])
+    assert r2.status_code == 304 and r2.headers['ETag'] == r.headers['ETag']
+
+
+def test_compressed_response_sends_weak_etag_on_304(compressing, client):
+    url = '/api/products?per_page=50'
+    r = client.get(url, headers=GZIP)
+    assert r.headers['Content-Encoding'] == 'gzip' and r.headers['ETag'].startswith('W/')
+    r2 = _revalidate(client, url, r.headers['ETag'])
+    assert r2.status_code == 304 and r2.headers['ETag'] == r.headers['ETag']
+    # 不接受压缩的客户端得到未压缩的 200 与强 ETag，304 同样为强 ETag
+    r3 = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert not r3.headers['ETag'].startswith('W/')
+    r4 = _revalidate(client, url, r3.headers['ETag'], {'Accept-Encoding': 'identity'})
+    assert r4.status_code == 304 and r4.headers['ETag'] == r3.headers['ETag']
+
+
+def test_small_catalog_response_keeps_strong_etag_on_304(compressing, client):
+    url = '/api/products?per_page=1&fields=price'
+    r = client.get(url, headers=GZIP)
+    assert 'Content-Encoding' not in r.headers and not r.headers['ETag'].startswith('W/')
+    r2 = _revalidate(client, url, r.headers['ETag'])
+    assert r2.status_code == 304 and r2.headers['ETag'] == r.headers['ETag']
+
+
+def test_unknown_etag_follows_client_form(compressing, client):
+    url = '/api/products?per_page=50'
+    etag = client.get(url, headers=GZIP).headers['ETag']
+    eyewear_app.compressible_etags.clear()
+    r = _revalidate(client, url, etag)
+    assert r.status_code == 304 and r.headers['ETag'] == etag
@@ -0,0 +1,52 @@
+"""列表总数缓存：写入后本进程内的相关计数键须被清理。"""
+from models import db, Salesperson
+
+SP = 'sp0000000000000000000000000001'
+CUSTOMER = 'cu0000000000000000000000000001'
+
+
+def _push_shares(client, n):
+    ids = []
+    for i in range(n):
+        r = client.post('/api/shares/push', json={'salesperson_open_id': SP, 'product_list': [f'M{i:04d}'],
+                                                  'dedup_key': f'k{i}'})
+        assert r.status_code == 200, r.get_json()
+        ids.append(r.get_json()['data']['id'])
+    return ids
+
+
+def _total(client, **params):
+    query = '&'.join(f'{k}={v}' for k, v in params.items())
+    return client.get(f'/api/shares?per_page=1&{query}').get_json()['data']['total']
+
+
+def test_mark_sent_evicts_unfiltered_and_salesperson_totals(app, client):
+    with app.app_context():
+        db.session.add(Salesperson(open_id=SP, name='s'))
+        db.session.commit()
+    ids = _push_shares(client, 4)
+    for share_id in ids[:2]:
+        client.post('/api/shares/mark_sent', json={'share_id': share_id})
+    assert _total(client) == 2
+    assert _total(client, salesperson_open_id=SP) == 2
+
+    client.post('/api/shares/mark_sent', json={'share_id': ids[2]})
+    assert _total(client) == 3
+    assert _total(client, salesperson_open_id=SP) == 3
+
+
+def test_share_open_evicts_customer_filtered_totals(app, client):
+    with app.app_context():
+        db.session.add(Salesperson(open_id=SP, name='s'))
+        db.session.commit()
+    ids = _push_shares(client, 2)
+    for share_id in ids:
+        client.post('/api/shares/mark_sent', json={'share_id': share_id})
+    client.post('/api/shares/open', json={'share_id': ids[0], 'customer_open_id': CUSTOMER})
+    assert _total(client, customer_open_id=CUSTOMER) == 1
+    assert _total(client, salesperson_open_id=SP, customer_open_id=CUSTOMER) == 1
+
+    r = client.post('/api/shares/open', json={'share_id': ids[1], 'customer_open_id': CUSTOMER})
+    assert r.status_code == 200, r.get_json()
+    assert _total(client, customer_open_id=CUSTOMER) == 2
+    assert _total(client, salesperson_open_id=SP, customer_open_id=CUSTOMER) == 2
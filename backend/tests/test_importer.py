@@ -0,0 +1,86 @@
+"""商品导入：留空单元格、缺少 is_active 列、比对与版本号。"""
+import csv
+
+from models import db, Product
+from importer import import_catalog, ACTIVE, INACTIVE
+from conftest import make_product
+
+HEADER = ['frame_model', 'is_active', 'lens_size', 'nose_bridge_width', 'temple_length', 'frame_total_length',
+          'frame_height', 'frame_material', 'weight', 'price']
+
+
+def _write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+    return path
+
+
+def _row(model, is_active='是', price=299):
+    return [model, is_active, 52, 17, 140, 135, 40, 'TR', 12.5, price]
+
+
+def _seed(app, *products):
+    with app.app_context():
+        db.session.add_all(products)
+        db.session.commit()
+
+
+def _get(app, model):
+    with app.app_context():
+        p = Product.query.get(model)
+        return p and (p.is_active, p.price, p.row_version)
+
+
+def test_blank_is_active_defaults_on_insert_and_keeps_value_on_update(app, tmp_path):
+    _seed(app, make_product(1, frame_model='OLD', is_active=INACTIVE, price=199))
+    path = _write_csv(tmp_path / 'a.csv', HEADER, [_row('OLD', '', 399), _row('NEW', '')])
+    with app.app_context():
+        stats = import_catalog(path)
+    assert (stats['inserted'], stats['updated'], stats['invalid']) == (1, 1, 0)
+    assert _get(app, 'NEW')[:2] == (ACTIVE, 299)
+    assert _get(app, 'OLD')[:2] == (INACTIVE, 399)
+
+
+def test_missing_is_active_column(app, tmp_path):
+    _seed(app, make_product(1, frame_model='OLD', is_active=INACTIVE, price=199))
+    header = [c for c in HEADER if c != 'is_active']
+    rows = [[v for c, v in zip(HEADER, r) if c != 'is_active'] for r in (_row('OLD', price=399), _row('NEW'))]
+    with app.app_context():
+        stats = import_catalog(_write_csv(tmp_path / 'b.csv', header, rows))
+    assert (stats['inserted'], stats['updated']) == (1, 1)
+    assert _get(app, 'NEW')[:2] == (ACTIVE, 299)
+    assert _get(app, 'OLD')[:2] == (INACTIVE, 399)
+
+
+def test_blank_required_cell_rejects_new_row_and_keeps_existing_value(app, tmp_path):
+    _seed(app, make_product(1, frame_model='OLD', price=199))
+    blank_old = _row('OLD', price='')
+    blank_new = _row('NEW', price='')
+    with app.app_context():
+        stats = import_catalog(_write_csv(tmp_path / 'c.csv', HEADER, [blank_old, blank_new, _row('OK')]))
+    assert stats['inserted'] == 1 and stats['invalid'] == 1
+    assert stats['errors'] == [{'frame_model': 'NEW', 'error': 'missing required columns: price'}]
+    assert _get(app, 'NEW') is None
+    assert _get(app, 'OLD')[1] == 199
+
+
+def test_unchanged_rows_are_skipped_and_changed_rows_get_new_version(app, tmp_path):
+    path = _write_csv(tmp_path / 'd.csv', HEADER, [_row('A'), _row('B')])
+    with app.app_context():
+        first = import_catalog(path)
+        again = import_catalog(path)
+    assert (first['inserted'], again['inserted'], again['updated'], again['unchanged']) == (2, 0, 0, 2)
+    assert again['version'] is None
+    with app.app_context():
+        third = import_catalog(_write_csv(tmp_path / 'e.csv', HEADER, [_row('A'), _row('B', price=899)]))
+    assert third['updated'] == 1 and third['unchanged'] == 1
+    assert _get(app, 'B')[2] == third['version'] > _get(app, 'A')[2]
+
+
+def test_invalid_is_active_value_is_reported(app, tmp_path):
+    with app.app_context():
+        stats = import_catalog(_write_csv(tmp_path / 'f.csv', HEADER, [_row('A', 'maybe'), _row('B')]))
+    assert stats['inserted'] == 1
+    assert stats['errors'][0]['line'] == 2
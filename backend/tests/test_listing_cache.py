@@ -0,0 +1,48 @@
+"""SQL 路径（目录引擎关闭）下的片段缓存与结果缓存：目录版本号变化立即失效，直接改库最多滞后一个时间窗口。"""
+import time
+
+from catalog import catalog, mark_products_changed
+from models import db, Product
+from conftest import make_product
+
+
+def _prices(client):
+    body = client.get('/api/products?per_page=10&sort=frame_model').get_json()
+    return {p['frame_model']: p['price'] for p in body['data']['items']}
+
+
+def _seed(app):
+    app.config['CATALOG_LISTING_ENGINE_ENABLED'] = False
+    with app.app_context():
+        db.session.add_all([make_product(i) for i in range(3)])
+        mark_products_changed([f'M{i:04d}' for i in range(3)])
+        db.session.commit()
+
+
+def _set_price(app, price, bump):
+    with app.app_context():
+        Product.query.filter_by(frame_model='M0001').update({'price': price})
+        if bump:
+            mark_products_changed(['M0001'])
+        db.session.commit()
+
+
+def test_version_bump_is_visible_on_next_check(app, client, monkeypatch):
+    monkeypatch.setattr(catalog, 'check_interval', 0)
+    _seed(app)
+    assert _prices(client)['M0001'] == 299
+    _set_price(app, 1234, bump=True)
+    assert _prices(client)['M0001'] == 1234
+
+
+def test_direct_edit_is_visible_after_time_window(app, client, monkeypatch):
+    monkeypatch.setattr(catalog, 'check_interval', 0)
+    _seed(app)
+    assert _prices(client)['M0001'] == 299
+    _set_price(app, 1234, bump=False)
+    assert _prices(client)['M0001'] == 299
+
+    # 时间窗口滚动后，片段缓存与结果缓存的键都随之变化
+    now = time.time() + app.config['CATALOG_MAX_AGE']
+    monkeypatch.setattr(time, 'time', lambda: now)
+    assert _prices(client)['M0001'] == 1234
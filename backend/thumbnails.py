@@ -0,0 +1,223 @@
+"""商品图片派生图（缩略图）生成。
+
+原图位于 IMAGE_SAVE_DIR 下（数据库 image1..image15 存相对路径），派生图按宽度写到
+IMAGE_SAVE_DIR/<IMAGE_DERIVATIVE_DIR>/<宽度>/<原相对路径去扩展名>.<格式>，例如
+  a/1203_1.jpg -> _v/200/a/1203_1.webp
+由 nginx 作为静态文件直出（缺失时回退原图，见 nginx-config）。接口输出的 thumbs 字段按同一规则拼接 URL。
+- 只缩小不放大；按宽度等比缩放，JPEG 原图先用 draft 在解码阶段降采样
+- 派生图比原图新时跳过（--force 强制重建），写入先落临时文件再原子替换
+命令行：flask images derive [--since 目录版本号] [--force] [--workers 4]；flask catalog import 导入后自动为变更商品生成。
+flask images migrate-cas 把旧文件名的商品图片与头像迁移到内容寻址存储（见 blobstore.py），
+flask images prune-retired 在宽限期后删除迁移前的旧文件及其派生图。
+"""
+import os
+import time
+import json
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from PIL import Image, ImageOps
+
+from models import db, Product
+import blobstore
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXT = {'webp': 'webp', 'jpeg': 'jpg', 'jpg': 'jpg'}
+_EXIF_ORIENTATION = 0x0112
+
+
+def is_local_image(path: str) -> bool:
+    lower = (path or '').lower()
+    return bool(path) and not (lower.startswith('http://') or lower.startswith('https://'))
+
+
+def variant_relpath(path: str, width: int, fmt: str = 'webp', root: str = '_v') -> str:
+    """原图相对路径 -> 派生图相对路径（'/' 分隔，可直接拼接 URL）。"""
+    stem = os.path.splitext(path.replace('\\', '/').lstrip('/'))[0]
+    return f'{root}/{int(width)}/{stem}.{FORMAT_EXT[fmt]}'
+
+
+def derivative_settings(config) -> dict:
+    """从应用配置读取派生图参数。"""
+    fmt = (config.get('IMAGE_DERIVATIVE_FORMAT') or 'webp').lower()
+    if fmt not in FORMAT_EXT:
+        raise ValueError(f'unsupported IMAGE_DERIVATIVE_FORMAT: {fmt}')
+    return {
+        'sizes': tuple(sorted({int(w) for w in config.get('IMAGE_DERIVATIVE_SIZES') or ()})),
+        'fmt': FORMAT_EXT[fmt],
+        'quality': int(config.get('IMAGE_DERIVATIVE_QUALITY', 80)),
+        'root': (config.get('IMAGE_DERIVATIVE_DIR') or '_v').strip('/'),
+    }
+
+
+def _save(img, dst: Path, fmt: str, quality: int) -> int:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + '.tmp')
+    if fmt == 'jpg':
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        img.save(tmp, 'WEBP', quality=quality, method=4)
+    os.replace(tmp, dst)
+    return dst.stat().st_size
+
+
+def render_variants(src: Path, targets, fmt: str, quality: int) -> int:
+    """为一张原图生成多个宽度的派生图。targets 为 [(宽度, 目标路径)]；返回写入字节数。"""
+    written = 0
+    with Image.open(src) as im:
+        widest = max(w for w, _ in targets)
+        # EXIF 方向 5–8 转置后显示宽度为原始高度，draft 的请求尺寸按原始（未转置）方向给出
+        transposed = im.getexif().get(_EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+        shown_w, shown_h = (im.height, im.width) if transposed else im.size
+        if im.format == 'JPEG' and shown_w > widest:
+            # 解码阶段按 1/2、1/4、1/8 降采样，大图可省去大部分解码与缩放时间
+            size = (widest, max(1, shown_h * widest // shown_w))
+            im.draft('RGB', size[::-1] if transposed else size)
+        img = ImageOps.exif_transpose(im)
+        img.load()
+        # 由大到小依次缩放，每次在上一级结果上继续缩小
+        for width, dst in sorted(targets, reverse=True):
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            written += _save(img, dst, fmt, quality)
+    return written
+
+
+def product_image_paths(since: int = None):
+    """上架商品（since 给定时为 row_version > since 的商品）引用的本地原图相对路径，去重。"""
+    cols = [getattr(Product, f'image{i}') for i in range(1, Product.IMAGE_SLOTS + 1)]
+    query = db.session.query(*cols).filter(Product.is_active == '是')
+    if since is not None:
+        query = query.filter(Product.row_version > since)
+    seen = set()
+    for row in query.yield_per(2000):
+        for p in row:
+            if is_local_image(p) and p not in seen:
+                seen.add(p)
+                yield p
+
+
+def derive_images(paths, save_dir, sizes, fmt='webp', quality=80, root='_v', force=False, workers=4) -> dict:
+    """为 paths 中的每张原图生成各宽度的派生图，返回统计。单张失败只记录，不中断整体。"""
+    save_dir = Path(save_dir)
+    stats = {'sources': 0, 'generated': 0, 'skipped': 0, 'missing': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+    t0 = time.perf_counter()
+
+    def _one(path):
+        src = save_dir / path.replace('\\', '/').lstrip('/')
+        try:
+            st = src.stat()
+        except OSError:
+            return 'missing', 0, 0
+        targets = []
+        for w in sizes:
+            dst = save_dir / variant_relpath(path, w, fmt, root)
+            if not force:
+                try:
+                    if dst.stat().st_mtime >= st.st_mtime:
+                        continue
+                except OSError:
+                    pass
+            targets.append((w, dst))
+        if not targets:
+            return 'skipped', 0, 0
+        try:
+            return 'generated', st.st_size, render_variants(src, targets, fmt, quality)
+        except Exception as e:
+            logger.warning('derive %s failed: %s', path, e)
+            return 'failed', 0, 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for status, size_in, size_out in pool.map(_one, paths):
+            stats['sources'] += 1
+            stats[status] += 1
+            stats['bytes_in'] += size_in
+            stats['bytes_out'] += size_out
+    stats['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    return stats
+
+
+def derive_product_images(since: int = None, force: bool = False, workers: int = 4) -> dict:
+    """按应用配置为商品图片生成派生图（since 见 product_image_paths）。"""
+    cfg = derivative_settings(current_app.config)
+    paths = list(product_image_paths(since))
+    return derive_images(paths, current_app.config['IMAGE_SAVE_DIR'], cfg['sizes'], cfg['fmt'], cfg['quality'],
+                         cfg['root'], force=force, workers=workers)
+
+
+images_cli = AppGroup('images', help='商品图片派生图（缩略图）')
+
+
+@images_cli.command('derive')
+@click.option('--since', type=int, default=None, help='只处理 row_version 大于该目录版本号的商品')
+@click.option('--force', is_flag=True, help='忽略已有派生图，全部重建')
+@click.option('--workers', type=int, default=4, help='并发线程数')
+def derive_command(since, force, workers):
+    """为上架商品的本地图片生成各宽度派生图。"""
+    click.echo(json.dumps(derive_product_images(since, force, workers), ensure_ascii=False))
+
+
+@images_cli.command('migrate-cas')
+@click.option('--dry-run', is_flag=True, help='只统计，不写文件也不改数据库')
+@click.option('--skip-avatars', is_flag=True, help='不迁移用户头像')
+def migrate_cas_command(dry_run, skip_avatars):
+    """把商品图片与用户头像迁移到内容寻址存储，并批量改写数据库引用（可重复执行）。
+    旧文件不立即删除（客户端与 CDN 可能仍引用旧 URL）：商品图片登记到待删除清单，宽限期后由
+    flask images prune-retired 删除；旧头像由 flask avatars gc 按宽限期删除。
+    须先开启 IMAGE_DERIVATIVES_ENABLED：迁移后的 cas/ 路径没有对应的 thumb/ 缩略图，
+    小程序列表图只能依赖派生图（thumbs 字段）。"""
+    if not dry_run and not current_app.config.get('IMAGE_DERIVATIVES_ENABLED'):
+        raise click.ClickException('IMAGE_DERIVATIVES_ENABLED is off: migrated cas/ images have no thumb/ copies, '
+                                   'enable derivatives before migrating')
+    image_root = current_app.config['IMAGE_SAVE_DIR']
+    result = {'products': blobstore.migrate_product_images(image_root, dry_run)}
+    if not skip_avatars:
+        result['avatars'] = blobstore.migrate_avatars(blobstore.avatar_root(current_app), dry_run)
+    if not dry_run and current_app.config.get('IMAGE_DERIVATIVES_ENABLED') and 'version' in result['products']:
+        result['derivatives'] = derive_product_images(since=result['products']['version'] - 1)
+    if not dry_run and current_app.config.get('IMAGE_MANIFEST_ENABLED') and 'version' in result['products']:
+        from imagemeta import refresh_product_manifest
+        result['manifest'] = refresh_product_manifest(since=result['products']['version'] - 1)
+    replaced = result['products'].pop('replaced_files', [])
+    result.get('avatars', {}).pop('replaced_files', None)
+    if not dry_run:
+        result['products']['retired'] = blobstore.retire_files(blobstore.retired_list_path(current_app), replaced)
+    click.echo(json.dumps(result, ensure_ascii=False))
+
+
+def legacy_variant_paths(save_dir, path: str, root: str = '_v'):
+    """旧文件名原图在各宽度目录下已存在的派生图相对路径（不限于当前配置的宽度与格式）。"""
+    base = Path(save_dir) / root
+    widths = [d.name for d in base.iterdir() if d.is_dir() and d.name.isdigit()] if base.is_dir() else []
+    out = []
+    for w in widths:
+        for fmt in sorted(set(FORMAT_EXT.values())):
+            rel = variant_relpath(path, int(w), fmt, root)
+            if (Path(save_dir) / rel).is_file():
+                out.append(rel)
+    return out
+
+
+@images_cli.command('prune-retired')
+@click.option('--grace-hours', type=float, default=24, help='登记未满该小时数的旧文件不删除')
+@click.option('--dry-run', is_flag=True, help='只统计，不删除')
+def prune_retired_command(grace_hours, dry_run):
+    """删除 migrate-cas 登记的旧文件名商品图片及其派生图（已重新被商品引用的文件保留）。"""
+    image_root = current_app.config['IMAGE_SAVE_DIR']
+    deriv_root = derivative_settings(current_app.config)['root']
+    cols = [getattr(Product, f'image{i}') for i in range(1, Product.IMAGE_SLOTS + 1)]
+    referenced = {p for row in db.session.query(*cols).yield_per(2000) for p in row if is_local_image(p)}
+    stats = blobstore.prune_retired(blobstore.retired_list_path(current_app), image_root, referenced,
+                                    grace_hours * 3600,
+                                    extra_paths=lambda name: legacy_variant_paths(image_root, name, deriv_root),
+                                    dry_run=dry_run)
+    click.echo(json.dumps(stats, ensure_ascii=False))
@@ -219,7 +219,8 @@ Page({
     this.setData({ isLoading: true })
     // 构造查询参数对象
     const queryParams = (() => {
-      const d = { page, per_page: 10 }
+      // view=card：列表卡片只需首图，后端不再查询其余图片列
+      const d = { page, per_page: 10, view: 'card' }
       const q = (this.data.searchQuery || '').trim()
       const filters = this.data.filters
       if (filters && typeof filters === 'object') {
@@ -4,6 +4,7 @@ const app = getApp()
 Page({
   data: {
     product: null,
+    similar: [],
     model: '',
     currentImageIndex: 0
   },
@@ -22,6 +23,7 @@ Page({
     const { model } = options
     this.setData({ model: model || '' })
     this.loadProduct(model)
+    this.loadSimilar(model)
 
     // Calculate nav height
     try {
@@ -85,6 +87,26 @@ Page({
     })
   },
 
+  // 相似镜架（后端预计算），只取卡片所需字段与首图；失败时不展示该区块
+  loadSimilar(model) {
+    if (!model) return
+    wx.request({
+      url: `${app.globalData.apiBaseUrl}/products/${model}/similar`,
+      data: { k: 8, view: 'card', fields: 'price,images' },
+      success: (res) => {
+        if (res.data && res.data.status === 'success') {
+          this.setData({ similar: res.data.data.items || [] })
+        }
+      }
+    })
+  },
+
+  goToSimilar(e) {
+    const { model } = e.currentTarget.dataset
+    if (!model) return
+    wx.navigateTo({ url: `/pages/product/detail?model=${model}` })
+  },
+
   onShow() {
     const pagePath = '/pages/product/detail' + (this.data.model ? `?model=${this.data.model}` : '')
     const track = (oid) => {
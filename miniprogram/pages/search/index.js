@@ -242,7 +242,7 @@ Page({
     wx.request({
       url: `${app.globalData.apiBaseUrl}/products`,
       method: 'GET',
-      data: Object.assign({ page: 1, per_page: 1 }, params),
+      data: Object.assign({ page: 1, per_page: 1, view: 'card', fields: 'frame_model' }, params),
       success: (res) => {
         const ok = res && res.data && res.data.status === 'success'
         const data = ok && res.data.data